@@ -0,0 +1,83 @@
+"""
+Benchmark comparing one model call per note with batched multi-note feedback requests.
+
+It generates feedback for a set of synthetic daily entries against the local stand-in model
+(`modules.llm_stub`), once with `generate_feedback` per entry and once with
+`generate_feedback_batch` over batches of increasing size, as a bulk review does, and
+reports the round trips, estimated prompt tokens per note, and notes per second. The stub
+answers after a fixed latency plus a delay per generated token, so the output cost of
+batched and single calls is the same and the difference is the per-request overhead.
+
+Usage:
+    python -m benchmarks.feedback_batching [entries] [latency_seconds] [seconds_per_token]
+"""
+# carelog/benchmarks/feedback_batching.py
+
+import random
+import sys
+import time
+
+from modules import gemini
+from modules.llm import HTTPProvider
+from modules.llm_stub import StubLLMServer
+from modules.ratelimit import estimate_tokens
+
+PHRASES = ["Slept badly and woke up twice.", "Headache since the morning.", "Ate most of my lunch.",
+           "Walked to the garden with help.", "Feeling anxious about the scan.", "Nausea after the tablets."]
+
+
+def synthetic_entries(count: int, seed: int = 7) -> list:
+    """Returns `count` `(notes, mood, pain, appetite)` tuples like patient daily entries."""
+    rng = random.Random(seed)
+    return [(" ".join(rng.sample(PHRASES, 3)), rng.randint(0, 10), rng.randint(0, 10), rng.randint(0, 10))
+            for _ in range(count)]
+
+
+def run_single(entries: list) -> dict:
+    """Generates feedback with one call per entry."""
+    start = time.perf_counter()
+    results = [gemini.generate_feedback(*entry) for entry in entries]
+    return {
+        'seconds': time.perf_counter() - start,
+        'calls': len(entries),
+        'prompt_tokens': sum(estimate_tokens(gemini.build_feedback_prompt(*entry)) for entry in entries),
+        'ok': sum(result is not None for result in results),
+    }
+
+
+def run_batched(entries: list, size: int) -> dict:
+    """Generates feedback with one call per batch of `size` entries."""
+    batches = [entries[i:i + size] for i in range(0, len(entries), size)]
+    start = time.perf_counter()
+    results = [text for batch in batches for text in gemini.generate_feedback_batch(batch)]
+    return {
+        'seconds': time.perf_counter() - start,
+        'calls': len(batches),
+        'prompt_tokens': sum(estimate_tokens(gemini.build_batch_prompt(batch)) for batch in batches),
+        'ok': sum(result is not None for result in results),
+    }
+
+
+def main(count: int = 40, latency: float = 0.3, token_latency: float = 0.002):
+    """Runs both modes and prints a table."""
+    entries = synthetic_entries(count)
+    server = StubLLMServer(port=0, latency=latency, token_latency=token_latency)
+    gemini.provider = HTTPProvider(server.start(), timeout=60)
+    print(f"{count} entries; stub latency {latency}s + {token_latency * 1000:.1f} ms per output token")
+    print(f"{'mode':>10} {'calls':>6} {'prompt tok/note':>16} {'notes/s':>8} {'parsed':>7}")
+    try:
+        rows = [('single', run_single(entries))]
+        rows += [(f"batch {size}", run_batched(entries, size)) for size in (2, 5, 10)]
+        for label, result in rows:
+            print(f"{label:>10} {result['calls']:6d} {result['prompt_tokens'] / count:16.1f} "
+                  f"{count / result['seconds']:8.1f} {result['ok']:7d}")
+    finally:
+        gemini.provider.close()
+        gemini.provider = None
+        server.stop()
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    main(int(args[0]) if args else 40, float(args[1]) if len(args) > 1 else 0.3,
+         float(args[2]) if len(args) > 2 else 0.002)
@@ -0,0 +1,74 @@
+"""
+Load test for the AI feedback path against the local stand-in model server.
+
+It starts `modules.llm_stub.StubLLMServer` with a simulated latency and failure rate, points
+`modules.gemini.generate_feedback` at it through an `HTTPProvider`, and fires requests from
+many threads at once, as a burst of clinicians clicking "Generate" would. It reports the
+throughput, latency percentiles, and failures, with and without connection reuse.
+
+Usage:
+    python -m benchmarks.feedback_load [threads] [requests] [latency_seconds] [failure_rate]
+"""
+# carelog/benchmarks/feedback_load.py
+
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from modules import gemini
+from modules.llm import HTTPProvider
+from modules.llm_stub import StubLLMServer
+
+
+def _percentile(values: list, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run(provider, threads: int, requests: int) -> dict:
+    """Calls `generate_feedback` `requests` times from `threads` threads and returns the results."""
+    gemini.provider = provider
+
+    def call(index: int):
+        start = time.perf_counter()
+        feedback = gemini.generate_feedback(f"Patient note {index}: slept badly, mild headache.", 5, 4, 6)
+        return time.perf_counter() - start, feedback is not None
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        results = list(pool.map(call, range(requests)))
+    elapsed = time.perf_counter() - start
+    latencies = [latency for latency, ok in results if ok]
+    return {
+        'throughput': requests / elapsed,
+        'p50': statistics.median(latencies) if latencies else 0.0,
+        'p95': _percentile(latencies, 0.95) if latencies else 0.0,
+        'failed': sum(not ok for _, ok in results),
+        'connections': provider.metrics['connections_opened'],
+    }
+
+
+def main(threads: int = 16, requests: int = 200, latency: float = 0.2, failure_rate: float = 0.05):
+    """Runs the load test and prints a report."""
+    server = StubLLMServer(port=0, latency=latency, jitter=latency / 2, failure_rate=failure_rate, seed=1)
+    url = server.start()
+    print(f"{requests} requests from {threads} threads; stub latency {latency}s "
+          f"(+ up to {latency / 2}s jitter), failure rate {failure_rate}")
+    print(f"{'connections':>12} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'failed':>7} {'opened':>7}")
+    try:
+        for label, pool_size in (('reused', threads), ('per call', 0)):
+            provider = HTTPProvider(url, timeout=latency * 10 + 5, pool_size=pool_size)
+            result = run(provider, threads, requests)
+            provider.close()
+            print(f"{label:>12} {result['throughput']:8.1f} {result['p50'] * 1000:8.1f} "
+                  f"{result['p95'] * 1000:8.1f} {result['failed']:7d} {result['connections']:7d}")
+    finally:
+        gemini.provider = None
+        server.stop()
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    main(int(args[0]) if args else 16, int(args[1]) if len(args) > 1 else 200,
+         float(args[2]) if len(args) > 2 else 0.2, float(args[3]) if len(args) > 3 else 0.05)
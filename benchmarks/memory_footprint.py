@@ -0,0 +1,152 @@
+"""
+Benchmark for the in-memory footprint of stored records.
+
+It builds a synthetic hospital with many notes and chat messages, round-trips it through
+JSON as `_load_data` does, and measures the memory held by the loaded data with
+`tracemalloc`, comparing plain dictionaries with the slotted records of `modules.models`,
+with and without interning of the low-cardinality string fields.
+It also times the read path: three fields of every note read with item lookups, with
+`get`, and as attributes (records only), and filtering one patient's visible notes the way
+`CareLogService.get_notes_for_patient` does, with `get` and with `getattr(note, field, None)`.
+
+Usage:
+    python -m benchmarks.memory_footprint [notes] [messages]
+"""
+# carelog/benchmarks/memory_footprint.py
+
+import gc
+import json
+import random
+import sys
+import time
+import tracemalloc
+import uuid
+from datetime import datetime, timedelta
+
+from modules.models import hydrate_hospital
+
+
+def synthetic_hospital(notes: int, messages: int, patients: int = 500, clinicians: int = 50) -> dict:
+    """Builds a hospital dataset shaped like the persisted one."""
+    rng = random.Random(42)
+    start = datetime(2024, 1, 1)
+    patient_names = [f"patient{i}" for i in range(patients)]
+    clinician_names = [f"clinician{i}" for i in range(clinicians)]
+    users = {}
+    for name in patient_names:
+        users[f"{name}_patient"] = {
+            'username': name, 'password_hash': uuid.uuid4().hex * 2, 'role': 'patient',
+            'salt': uuid.uuid4().hex, 'status': 'approved', 'full_name': name.title(),
+            'dob': '1990-01-01', 'sex': 'Other', 'pronouns': 'they/them', 'bio': '',
+            'assigned_clinicians': rng.sample(clinician_names, 2),
+        }
+    note_list = []
+    for i in range(notes):
+        source = rng.choice(('patient', 'clinician'))
+        patient = rng.choice(patient_names)
+        note_list.append({
+            'note_id': str(uuid.uuid4()), 'hospital_id': 'H1', 'patient_id': patient,
+            'author_id': patient if source == 'patient' else rng.choice(clinician_names),
+            'timestamp': (start + timedelta(minutes=i)).isoformat(),
+            'mood': rng.randint(0, 10), 'pain': rng.randint(0, 10), 'appetite': rng.randint(0, 10),
+            'notes': 'Feeling about the same as yesterday.', 'diagnoses': '',
+            'source': source, 'is_private': False, 'hidden_from_patient': False,
+        })
+    general = {}
+    for i in range(messages):
+        patient = rng.choice(patient_names)
+        general.setdefault(patient, []).append({
+            'message_id': str(uuid.uuid4()), 'timestamp': (start + timedelta(minutes=i)).isoformat() + 'Z',
+            'sender': patient, 'sender_role': 'patient', 'text': 'Thank you!',
+            'channel': 'general', 'patient_username': patient,
+        })
+    return {'users': users, 'notes': note_list, 'alerts': [], 'chats': {'general': general, 'direct': {}}}
+
+
+def measure_load(payload: str, loader) -> tuple:
+    """Loads a JSON payload with `loader` and returns `(loaded, bytes_retained)`."""
+    gc.collect()
+    tracemalloc.start()
+    loaded = loader(payload)
+    gc.collect()
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return loaded, retained
+
+
+def load_dicts(payload: str) -> dict:
+    """Loads the payload as plain dictionaries (the previous in-memory representation)."""
+    return json.loads(payload)
+
+
+def load_records(payload: str, intern: bool = True) -> dict:
+    """Loads the payload and converts it to slotted records, as `_load_data` does."""
+    hospital = json.loads(payload)
+    hydrate_hospital(hospital, intern=intern)
+    return hospital
+
+
+def time_access(notes: list, mode: str = 'items') -> float:
+    """Returns the time in seconds to read three fields of every note ('items', 'get', or 'attributes')."""
+    start = time.perf_counter()
+    total = 0
+    if mode == 'attributes':
+        for note in notes:
+            total += note.pain + note.mood + note.appetite
+    elif mode == 'get':
+        for note in notes:
+            total += note.get('pain') + note.get('mood') + note.get('appetite')
+    else:
+        for note in notes:
+            total += note['pain'] + note['mood'] + note['appetite']
+    return time.perf_counter() - start
+
+
+def time_patient_filter(notes: list, attributes: bool = False) -> float:
+    """Returns the time in seconds to select one patient's non-private notes."""
+    patient = notes[0]['patient_id']
+    start = time.perf_counter()
+    if attributes:
+        [n for n in notes if getattr(n, 'patient_id', None) == patient
+         and not (getattr(n, 'source', None) == 'patient' and getattr(n, 'is_private', None))]
+    else:
+        [n for n in notes if n.get('patient_id') == patient and not (n.get('source') == 'patient' and n.get('is_private'))]
+    return time.perf_counter() - start
+
+
+def best_of(func, *args, repeat: int = 3) -> float:
+    """Returns the lowest of `repeat` timings returned by `func(*args)`."""
+    return min(func(*args) for _ in range(repeat))
+
+
+def main(notes: int = 100_000, messages: int = 100_000):
+    """Runs the footprint comparison and prints a report."""
+    payload = json.dumps(synthetic_hospital(notes, messages))
+    records = notes + messages
+    print(f"Synthetic hospital: {notes} notes, {messages} messages, {len(payload) / 1e6:.1f} MB of JSON")
+    results = {}
+    loaders = (
+        ("dicts", load_dicts),
+        ("records", lambda p: load_records(p, intern=False)),
+        ("records+interning", load_records),
+    )
+    for label, loader in loaders:
+        loaded, retained = measure_load(payload, loader)
+        results[label] = retained
+        print(f"{label:>17}: {retained / 1e6:8.1f} MB retained, {retained / records:6.0f} B/record")
+        modes = ('items', 'get') if label == "dicts" else ('items', 'get', 'attributes')
+        reads = ", ".join(f"{mode} {best_of(time_access, loaded['notes'], mode) * 1000:.1f} ms" for mode in modes)
+        print(f"{'':>17}  field reads: {reads}")
+        filters = f"get {best_of(time_patient_filter, loaded['notes']) * 1000:.1f} ms"
+        if label != "dicts":
+            filters += f", getattr {best_of(time_patient_filter, loaded['notes'], True) * 1000:.1f} ms"
+        print(f"{'':>17}  one patient's notes: {filters}")
+        del loaded
+    baseline = results['dicts']
+    for label in ("records", "records+interning"):
+        print(f"{label:>17}: {baseline / results[label]:.2f}x smaller than dicts")
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    main(int(args[0]) if args else 100_000, int(args[1]) if len(args) > 1 else 100_000)
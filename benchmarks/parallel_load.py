@@ -0,0 +1,66 @@
+"""
+Benchmark for decoding a segmented snapshot with a pool of worker processes.
+
+It writes several synthetic hospitals into one segmented container with real Fernet data
+keys, then loads it as `CareLogService._decode_payload` does, inline and with pools of
+increasing size, and reports the time of each phase: decrypting and parsing segments
+(`decode`, parallelized), reassembling them (`merge`), and building records (`hydrate`),
+which stay in the loading process. Starting the workers (`start`) is timed separately, as
+the service does it before taking any lock.
+
+Requires the `cryptography` package.
+
+Usage:
+    python -m benchmarks.parallel_load [hospitals] [notes_per_hospital]
+"""
+# carelog/benchmarks/parallel_load.py
+
+import os
+import sys
+import time
+
+from cryptography.fernet import Fernet
+
+from benchmarks.memory_footprint import synthetic_hospital
+from modules.encryption import DataKeyring, KeyAgent
+from modules.models import hydrate_hospital
+from modules.segments import SegmentReader, SegmentWriter, open_pool
+
+
+def load(container: bytes, master, workers: int) -> dict:
+    """Loads a container with `workers` processes and returns the phase timings in seconds."""
+    pool_start = time.perf_counter()
+    pool = open_pool(workers)
+    start = time.perf_counter()
+    reader = SegmentReader(container, DataKeyring(KeyAgent(master)))
+    try:
+        data = reader.load(pool=pool)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    hydrate_start = time.perf_counter()
+    for hospital in data['hospitals'].values():
+        hydrate_hospital(hospital)
+    end = time.perf_counter()
+    return dict(reader.timings, start=start - pool_start, hydrate=end - hydrate_start, total=end - start)
+
+
+def main(hospitals: int = 8, notes: int = 25_000):
+    """Runs the comparison and prints a table."""
+    master = Fernet(Fernet.generate_key())
+    data = {'hospitals': {f"H{i}": synthetic_hospital(notes, notes) for i in range(hospitals)}}
+    container = SegmentWriter().write(data, DataKeyring(KeyAgent(master)), 'json', 'zlib')
+    del data
+    print(f"{hospitals} hospitals x {notes} notes and messages: {len(container) / 1e6:.1f} MB, "
+          f"{os.cpu_count()} CPUs")
+    print(f"{'workers':>8} {'start ms':>9} {'decode ms':>10} {'merge ms':>9} {'hydrate ms':>11} {'total ms':>9}")
+    counts = sorted({1, 2, 4, 8, os.cpu_count() or 1})
+    for workers in counts:
+        timings = min((load(container, master, workers) for _ in range(3)), key=lambda t: t['total'])
+        print(f"{workers:>8} {timings['start'] * 1000:9.1f} {timings['decode'] * 1000:10.1f} {timings['merge'] * 1000:9.1f} "
+              f"{timings['hydrate'] * 1000:11.1f} {timings['total'] * 1000:9.1f}")
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    main(int(args[0]) if args else 8, int(args[1]) if len(args) > 1 else 25_000)
@@ -0,0 +1,49 @@
+"""
+Benchmark for the password KDF used by `modules.passwords`.
+
+It calibrates KDF parameters for a target per-hash latency on this machine, then simulates
+a login storm (many concurrent verifications, as at a shift change) and compares running
+the KDF inline in the request threads with running it in the thread pool.
+
+Usage:
+    python -m benchmarks.password_kdf [target_ms] [logins]
+
+The printed `CARELOG_PASSWORD_KDF` line can be exported to use the calibrated parameters.
+"""
+# carelog/benchmarks/password_kdf.py
+
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from modules.passwords import PasswordHasher, calibrate
+
+
+def _login_storm(hasher: PasswordHasher, record: dict, logins: int, threads: int) -> float:
+    """Verifies the same password from many threads at once and returns the wall time in seconds."""
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        results = list(pool.map(lambda _: hasher.verify("Calibrate!1", record)[0], range(logins)))
+    assert all(results)
+    return time.perf_counter() - start
+
+
+def main(target_ms: float = 250.0, logins: int = 32):
+    """Runs the calibration and the login storm comparison."""
+    params, measured_ms = calibrate(target_ms)
+    print(f"Calibrated {params['algorithm']} parameters for ~{target_ms:.0f} ms: {measured_ms:.1f} ms per hash")
+    print(f"CARELOG_PASSWORD_KDF='{json.dumps(params)}'")
+
+    threads = 16
+    for label, workers in (("inline", 0), ("thread pool", None)):
+        hasher = PasswordHasher(params, max_workers=workers)
+        record = hasher.hash("Calibrate!1")
+        elapsed = _login_storm(hasher, record, logins, threads)
+        hasher.shutdown()
+        print(f"{label:>12}: {logins} logins from {threads} threads in {elapsed:.2f} s ({logins / elapsed:.1f} logins/s)")
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    main(float(args[0]) if args else 250.0, int(args[1]) if len(args) > 1 else 32)
@@ -0,0 +1,99 @@
+"""
+Benchmark comparing the segmented container of `modules.segments` with a single Fernet token.
+
+It encrypts a synthetic hospital with a real Fernet key both ways (the segmented container
+with a per-hospital data key wrapped by that key) and reports throughput for:
+- a full write (every segment encrypted);
+- a write after appending one note, as every `add_note` does (the segmented writer is told
+  which note batch changed, as the service does, and serializes and re-encrypts only it);
+- a full load;
+- reading a single patient's notes, which the segmented reader does without decrypting the
+  other patients' batches.
+
+Requires the `cryptography` package.
+
+Usage:
+    python -m benchmarks.segments [notes] [messages]
+"""
+# carelog/benchmarks/segments.py
+
+import sys
+import time
+
+from cryptography.fernet import Fernet
+
+from benchmarks.memory_footprint import synthetic_hospital
+from modules.encryption import DataKeyring, KeyAgent
+from modules.models import hydrate_hospital
+from modules.segments import SegmentReader, SegmentWriter
+from modules.serialization import decode_payload, encode_payload
+
+
+def _timed(func, repeat: int = 3) -> tuple:
+    """Runs `func` `repeat` times and returns `(result, best_seconds)`."""
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def _report(label: str, seconds: float, size: int):
+    print(f"{label:>34}: {seconds * 1000:8.1f} ms  {size / 1e6 / seconds:8.1f} MB/s")
+
+
+def main(notes: int = 100_000, messages: int = 100_000, compression: str = 'zlib'):
+    """Runs both formats over the same dataset and prints a report."""
+    fernet = Fernet(Fernet.generate_key())
+    keyring = DataKeyring(KeyAgent(fernet))
+    data = {'hospitals': {'H1': synthetic_hospital(notes, messages)}}
+    hydrate_hospital(data['hospitals']['H1'])
+    note = dict(data['hospitals']['H1']['notes'][-1], note_id='appended')
+    patient = data['hospitals']['H1']['notes'][0]['patient_id']
+    print(f"Synthetic hospital: {notes} notes, {messages} messages, compression={compression}")
+
+    blob, seconds = _timed(lambda: fernet.encrypt(encode_payload(data, 'json', compression)))
+    print(f"\nSingle token ({len(blob) / 1e6:.1f} MB)")
+    _report("full write", seconds, len(blob))
+    data['hospitals']['H1']['notes'].append(note)
+    _, seconds = _timed(lambda: fernet.encrypt(encode_payload(data, 'json', compression)))
+    _report("write after appending a note", seconds, len(blob))
+    _, seconds = _timed(lambda: decode_payload(fernet.decrypt(blob)))
+    _report("full load", seconds, len(blob))
+    _, seconds = _timed(lambda: [n for n in decode_payload(fernet.decrypt(blob))['hospitals']['H1']['notes']
+                                 if n['patient_id'] == patient])
+    _report("one patient's notes", seconds, len(blob))
+    data['hospitals']['H1']['notes'].pop()
+
+    _, seconds = _timed(lambda: SegmentWriter().write(data, keyring, 'json', compression))
+    writer = SegmentWriter()
+    container = writer.write(data, keyring, 'json', compression)
+    print(f"\nSegmented container ({len(container) / 1e6:.1f} MB)")
+    _report("full write", seconds, len(container))
+
+    def append_and_write():
+        notes = data['hospitals']['H1']['notes']
+        notes.append(note)
+        changes = {'H1': {('notes', (len(notes) - 1) // writer.note_batch)}}
+        try:
+            return writer.seal(writer.encode(data, 'json', compression, changes=changes), keyring)
+        finally:
+            notes.pop()
+    serialized = writer.metrics['segments_serialized']
+    _, seconds = _timed(append_and_write, repeat=1)
+    _report("write after appending a note", seconds, len(container))
+    print(f"{'segments serialized':>34}: {writer.metrics['segments_serialized'] - serialized:8d}")
+    encoded = writer.encode(data, 'json', compression)
+    _, seconds = _timed(lambda: writer.seal(encoded, keyring))
+    _report("  of which encryption", seconds, len(container))
+    _, seconds = _timed(lambda: SegmentReader(container, DataKeyring(KeyAgent(fernet))).load())
+    _report("full load", seconds, len(container))
+    _, seconds = _timed(lambda: SegmentReader(container, DataKeyring(KeyAgent(fernet))).patient_notes('H1', patient))
+    _report("one patient's notes", seconds, len(container))
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    main(int(args[0]) if args else 100_000, int(args[1]) if len(args) > 1 else 100_000)
@@ -0,0 +1,76 @@
+"""
+Benchmark for the data file codecs of `modules.serialization`.
+
+It builds synthetic hospitals of increasing size, then compares the legacy pretty-printed
+JSON with every available codec, uncompressed and with each compressor: encode time,
+decode time (including conversion to records, as `_load_data` does), payload size, and the
+size after Fernet encryption, which base64-expands the payload by a third.
+
+Usage:
+    python -m benchmarks.serialization [notes ...]
+"""
+# carelog/benchmarks/serialization.py
+
+import base64
+import json
+import sys
+import time
+
+from benchmarks.memory_footprint import synthetic_hospital
+from modules.models import hydrate_hospital, json_default
+from modules.serialization import available_codecs, decode_payload, encode_payload
+
+
+# Compression settings compared for each codec.
+COMPRESSION_LEVELS = {'zlib': (1, 6), 'lzma': (1,)}
+
+
+def fernet_size(length: int) -> int:
+    """Returns the size of a Fernet token for a plaintext of `length` bytes."""
+    padded = (length // 16 + 1) * 16
+    return len(base64.urlsafe_b64encode(bytes(1 + 8 + 16 + padded + 32)))
+
+
+def _timed(func, repeat: int = 3) -> tuple:
+    """Runs `func` `repeat` times and returns `(result, best_seconds)`."""
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def _load(raw: bytes) -> dict:
+    data = decode_payload(raw)
+    for hospital in data['hospitals'].values():
+        hydrate_hospital(hospital)
+    return data
+
+
+def main(sizes=(10_000, 100_000)):
+    """Runs the comparison for each hospital size and prints a table."""
+    for notes in sizes:
+        data = {'hospitals': {'H1': synthetic_hospital(notes, notes)}}
+        for hospital in data['hospitals'].values():
+            hydrate_hospital(hospital)
+        print(f"\nSynthetic hospital with {notes} notes and {notes} messages")
+        print(f"{'format':>20} {'encode ms':>10} {'decode ms':>10} {'payload MB':>11} {'encrypted MB':>13}")
+        candidates = [('legacy json', lambda: json.dumps(data, indent=4, default=json_default).encode())]
+        for name in available_codecs():
+            candidates.append((name, lambda name=name: encode_payload(data, name)))
+            for compression, levels in COMPRESSION_LEVELS.items():
+                for level in levels:
+                    candidates.append((f"{name}+{compression}:{level}",
+                                       lambda name=name, c=compression, l=level: encode_payload(data, name, c, l)))
+        for label, encode in candidates:
+            raw, encode_s = _timed(encode)
+            _, decode_s = _timed(lambda: _load(raw))
+            print(f"{label:>20} {encode_s * 1000:10.1f} {decode_s * 1000:10.1f} "
+                  f"{len(raw) / 1e6:11.2f} {fernet_size(len(raw)) / 1e6:13.2f}")
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    main(tuple(int(a) for a in args) if args else (10_000, 100_000))
@@ -0,0 +1,89 @@
+"""
+Benchmark and budget for the cold import time of the application's entry modules.
+
+Each module is imported in a fresh interpreter with `python -X importtime`, the way a worker,
+a CLI tool, or a new Streamlit server process starts, and the median cumulative import time
+over several runs is compared with its budget. It also checks that importing the backend
+does not load dependencies that only some code paths need (the Streamlit UI, the Gemini
+client, pandas, process pools), which are imported on first use instead.
+
+The script exits with status 1 if any module is over budget or loads a deferred
+dependency, so it can guard against regressions in CI.
+
+Usage:
+    python -m benchmarks.startup [runs] [budget_scale]
+"""
+# carelog/benchmarks/startup.py
+
+import os
+import statistics
+import subprocess
+import sys
+
+# Cold import budgets in milliseconds, with headroom over the times measured after the
+# heavy imports were made lazy (about 85 ms for `modules.auth`, 330 ms for `gui`, most of
+# which is Streamlit itself). Scale them for slower machines with the second argument.
+IMPORT_BUDGETS_MS = {
+    'modules.encryption': 60,
+    'modules.gemini': 20,
+    'modules.auth': 200,
+    'gui': 600,
+}
+
+# Modules that must not be imported as a side effect of importing the key.
+DEFERRED_IMPORTS = {
+    'modules.auth': ('streamlit', 'google.generativeai', 'pandas', 'multiprocessing'),
+    'modules.gemini': ('streamlit', 'google.generativeai'),
+    'gui': ('pandas',),
+}
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _run(code: str, *options) -> subprocess.CompletedProcess:
+    """Runs `code` in a fresh interpreter from the project root."""
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    return subprocess.run([sys.executable, *options, '-c', code], cwd=ROOT, env=env,
+                          capture_output=True, text=True, check=True)
+
+
+def import_time(module: str) -> float:
+    """Imports a module in a fresh interpreter and returns its cumulative import time in ms."""
+    result = _run(f"import {module}", '-X', 'importtime')
+    for line in reversed(result.stderr.splitlines()):
+        fields = [field.strip() for field in line.split('|')]
+        if len(fields) == 3 and fields[2] == module:
+            return int(fields[1]) / 1000
+    raise RuntimeError(f"No import time reported for '{module}'.")
+
+
+def loaded_modules(module: str, candidates) -> list:
+    """Imports a module in a fresh interpreter and returns which of `candidates` it loaded."""
+    code = f"import sys, {module}; print(' '.join(m for m in {tuple(candidates)!r} if m in sys.modules))"
+    return _run(code).stdout.split()
+
+
+def main(runs: int = 5, scale: float = 1.0) -> int:
+    """Measures every module, prints a report, and returns the exit status."""
+    failures = 0
+    print(f"{'module':>20} {'median ms':>10} {'budget ms':>10}  deferred imports loaded")
+    for module, budget in IMPORT_BUDGETS_MS.items():
+        budget *= scale
+        try:
+            median = statistics.median(import_time(module) for _ in range(runs))
+        except subprocess.CalledProcessError as e:
+            failures += 1
+            error = e.stderr.strip().splitlines()[-1] if e.stderr.strip() else f"exit status {e.returncode}"
+            print(f"{module:>20} {'-':>10} {budget:10.1f}  import failed: {error}  FAIL")
+            continue
+        loaded = loaded_modules(module, DEFERRED_IMPORTS.get(module, ()))
+        ok = median <= budget and not loaded
+        failures += not ok
+        print(f"{module:>20} {median:10.1f} {budget:10.1f}  {', '.join(loaded) or '-'}"
+              f"{'' if ok else '  FAIL'}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    sys.exit(main(int(args[0]) if args else 5, float(args[1]) if len(args) > 1 else 1.0))
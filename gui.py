@@ -15,7 +15,6 @@ from modules.models import PatientNote
 import json
 import datetime
 import time
-import pandas as pd
 
 # Attempt to import streamlit_autorefresh for automatic page refreshing.
 # If unavailable, fall back to a manual refresh mechanism.
@@ -315,7 +314,6 @@ def show_main_app(service):
             if st.button("Log Out", key=f"{user.role}_logout_btn", use_container_width=True):
                 with st.spinner("Logging out..."):
                     time.sleep(1)
-                    service.logout()
                     st.session_state.current_user = None
                     st.session_state.hospital_id = None
                     st.session_state.auth_page = 'welcome'
@@ -480,9 +478,8 @@ def _render_profile_page(service, hospital_id):
     delete_disabled = not confirm_delete
     if st.button("Delete My Account", type="secondary", disabled=delete_disabled):
         with st.spinner("Deleting account..."):
-            if service.delete_user(hospital_id, user.username, user.role):
+            if service.delete_user(hospital_id, user.username, user.role, user):
                 st.success("Your account has been deleted.")
-                service.logout()
                 st.session_state.current_user = None
                 st.session_state.hospital_id = None
                 st.session_state.auth_page = 'welcome'
@@ -655,7 +652,7 @@ def _render_clinician_chat_page(service, hospital_id):
         return
 
     user = st.session_state.current_user
-    patients = service.get_all_patients(hospital_id)
+    patients = service.get_all_patients(hospital_id, user)
     if not patients:
         st.info("No patients assigned to you yet.")
         return
@@ -764,7 +761,7 @@ def _render_add_note_page(service, hospital_id):
         hospital_id (str): The ID of the hospital.
     """
     st.markdown("<h2 style='text-align: center;'>Add a New Patient Note</h2>", unsafe_allow_html=True)
-    patients = service.get_all_patients(hospital_id)
+    patients = service.get_all_patients(hospital_id, st.session_state.current_user)
     if not patients:
         st.warning("No patients found for this hospital.")
         return
@@ -827,6 +824,41 @@ def _render_add_patient_entry_page(service, hospital_id):
             st.session_state.entry_saved_success = True
             st.rerun()
 
+def _render_patient_summary(service, hospital_id, patient_id, user):
+    """Renders the cached AI summary of a patient's history with a button to update it.
+
+    Args:
+        service: The main application service instance.
+        hospital_id (str): The ID of the hospital.
+        patient_id (str): The ID of the patient.
+        user (User): The clinician viewing the patient.
+    """
+    summary = service.get_patient_summary(hospital_id, patient_id, user)
+    if summary is None:
+        return
+    with st.expander("AI Summary of Recent History", expanded=bool(summary['text'])):
+        if summary['text']:
+            st.write(summary['text'])
+            updated = datetime.datetime.fromisoformat(summary['updated_at']).strftime('%Y-%m-%d %H:%M')
+            st.caption(f"AI-generated from {summary['notes_covered']} entries, last updated {updated}. "
+                       "Verify against the notes before acting on it.")
+        else:
+            st.info("No summary has been generated for this patient yet.")
+        if summary['new_notes']:
+            if st.button(f"Update Summary ({summary['new_notes']} new entries)", key=f"update_summary_{patient_id}"):
+                with st.spinner("Summarizing new entries..."):
+                    success = service.update_patient_summary(hospital_id, patient_id, user)
+                if success is True:
+                    st.rerun()
+                elif success == 'rate_limited':
+                    retry_after = service.get_ai_usage(hospital_id).get('retry_after_seconds', 0)
+                    st.warning(f"The AI service is busy. Please try again in about {max(1, round(retry_after))} seconds.")
+                else:
+                    st.error("Failed to update the summary.")
+        else:
+            st.caption("The summary covers every entry.")
+
+
 def _render_view_notes_page(service, hospital_id, patient_id=None):
     """Renders the page for viewing patient notes and entries.
 
@@ -843,11 +875,11 @@ def _render_view_notes_page(service, hospital_id, patient_id=None):
     # Patient view
     if patient_id:
         st.markdown("<h2 style='text-align: center;'>My Medical Notes & Entries</h2>", unsafe_allow_html=True)
-        notes = service.get_notes_for_patient(hospital_id, patient_id)
+        notes = service.get_notes_for_patient(hospital_id, patient_id, user)
     # Clinician/Admin view
     else:
         st.markdown("<h2 style='text-align: center;'>View All Patient Notes & Entries</h2>", unsafe_allow_html=True)
-        patients = service.get_all_patients(hospital_id)
+        patients = service.get_all_patients(hospital_id, user)
         if not patients:
             st.warning("No patients assigned to you or no patients in this hospital.")
             return
@@ -873,15 +905,18 @@ def _render_view_notes_page(service, hospital_id, patient_id=None):
                 _display_user_profile_details(patient_data)
             
             st.divider() # Add a divider for better separation
+        # Clinicians get a rolling AI summary of the patient's history.
+        if user.role == 'clinician' and selected_patient:
+            _render_patient_summary(service, hospital_id, selected_patient, user)
         # Clinicians can search within a patient's notes.
         if user.role == 'clinician':
             search_term = st.text_input("Search notes for this patient:")
             if search_term:
-                notes = service.search_notes(hospital_id, selected_patient, search_term)
+                notes = service.search_notes(hospital_id, selected_patient, search_term, user)
             else:
-                notes = service.get_notes_for_patient(hospital_id, selected_patient)
+                notes = service.get_notes_for_patient(hospital_id, selected_patient, user)
         else:
-            notes = service.get_notes_for_patient(hospital_id, selected_patient)
+            notes = service.get_notes_for_patient(hospital_id, selected_patient, user)
 
 
     if not notes:
@@ -939,9 +974,12 @@ def _render_view_notes_page(service, hospital_id, patient_id=None):
                     if st.button("Generate AI Feedback", key=f"gen_ai_{note.get('note_id')}"):
                         with st.spinner("Generating AI Feedback..."):
                             success = service.generate_and_store_ai_feedback(note.get('note_id'), hospital_id)
-                        if success:
+                        if success is True:
                             st.success("AI feedback is being generated. A clinician will review it shortly.")
                             st.rerun()
+                        elif success == 'rate_limited':
+                            retry_after = service.get_ai_usage(hospital_id).get('retry_after_seconds', 0)
+                            st.warning(f"The AI service is busy. Please try again in about {max(1, round(retry_after))} seconds.")
                         else:
                             st.error("Could not generate feedback for this note.")
 
@@ -1022,7 +1060,7 @@ def _render_user_management_entry(user_key, user_data, service, hospital_id):
     current_admin_user = st.session_state.current_user
     is_self = (current_admin_user.username == user_data.get('username') and current_admin_user.role == user_data.get('role'))
     if cols[num_cols-1].button("Delete User", key=f"delete_{user_key}", disabled=is_self, type="secondary"):
-        if service.delete_user(hospital_id, user_data.get('username'), user_data.get('role')):
+        if service.delete_user(hospital_id, user_data.get('username'), user_data.get('role'), current_admin_user):
             st.success(f"User {user_data.get('username')} deleted successfully.")
             st.rerun()
         else:
@@ -1115,6 +1153,31 @@ def _render_admin_page(service, hospital_id):
 
     st.divider() # Add a divider for better separation.
 
+    # Language model usage of this hospital since the app started.
+    st.markdown("##### AI Feedback Usage")
+    usage = service.get_ai_usage(hospital_id)
+    u1, u2, u3, u4 = st.columns(4)
+    u1.metric("Requests", usage['requests'])
+    u2.metric("Tokens (est.)", usage['prompt_tokens'] + usage['completion_tokens'])
+    u3.metric("Queued / Rejected", f"{usage['queued']} / {usage['rejected']}")
+    u4.metric("Failures", usage['failures'])
+    st.caption("Counted since the application started. Requests over the rate limits queue briefly or are rejected.")
+    speculative = service.get_speculative_feedback_usage(hospital_id)
+    if speculative['enabled']:
+        st.caption(f"Speculative feedback today: {speculative['calls']} entries, about {speculative['tokens']:,} "
+                   f"of {speculative['limit']:,} tokens; {speculative['skipped']} skipped over the daily cap.")
+    client = service.get_model_client_metrics()
+    if client:
+        c1, c2, c3, c4 = st.columns(4)
+        c1.metric("Model Circuit", client['breaker'].replace('_', '-').title())
+        c2.metric("p95 Latency", f"{client['p95_seconds']:.1f} s" if client['p95_seconds'] is not None else "N/A")
+        c3.metric("Retries / Hedges", f"{client['retries']} / {client['hedges']}")
+        c4.metric("Timeouts", client['timeouts'])
+        if client['breaker'] == 'open':
+            st.warning(f"The AI model is failing; calls are paused for {client['retry_after_seconds']:.0f} more seconds.")
+
+    st.divider() # Add a divider for better separation.
+
     # Data export section.
     st.header("Data Export")
     st.warning(f"The following exports contain data for **{hospital_id} ONLY**.")
@@ -1131,6 +1194,8 @@ def _render_admin_page(service, hospital_id):
 
     # Export as CSV files.
     st.subheader("2. Export as CSV")
+    # Pandas is only needed here; importing it on demand keeps it off every other page.
+    import pandas as pd
     col1, col2 = st.columns(2)
     with col1:
         users_dict_export = hospital_data.get('users', {})
@@ -1214,7 +1279,25 @@ def _render_review_feedback_page(service, hospital_id):
         hospital_id (str): The ID of the hospital.
     """
     st.markdown("<h2 style='text-align: center;'>Review AI Feedback</h2>", unsafe_allow_html=True)
-    pending_feedback = service.get_pending_feedback(hospital_id)
+
+    # Bulk generation packs several entries into each model request.
+    awaiting = service.get_notes_awaiting_feedback(hospital_id, st.session_state.current_user)
+    if awaiting:
+        st.caption(f"{len(awaiting)} patient entries have no AI feedback yet.")
+        if st.button(f"Generate Feedback for All ({len(awaiting)})", key="generate_all_feedback"):
+            with st.spinner("Generating AI Feedback..."):
+                outcomes = service.generate_ai_feedback_batch([n.get('note_id') for n in awaiting], hospital_id)
+            generated = sum(outcome is True for outcome in outcomes.values())
+            limited = sum(outcome == 'rate_limited' for outcome in outcomes.values())
+            if generated:
+                st.success(f"Generated feedback for {generated} entries.")
+            if limited:
+                st.warning(f"The AI service is busy; {limited} entries were skipped. Please try again shortly.")
+            if len(outcomes) - generated - limited:
+                st.error(f"Could not generate feedback for {len(outcomes) - generated - limited} entries.")
+        st.divider()
+
+    pending_feedback = service.get_pending_feedback(hospital_id, st.session_state.current_user)
 
     if not pending_feedback:
         st.info("No AI feedback to review.")
@@ -1230,6 +1313,12 @@ def _render_review_feedback_page(service, hospital_id):
         st.write("**Patient's Note:**")
         st.write(notes_display)
         
+        origin = note.get('ai_feedback', {}).get('origin')
+        if origin == 'fallback':
+            st.caption("Generated by the fallback model because the primary model was unavailable.")
+        elif origin == 'template':
+            st.caption("The AI model was unavailable; this is a standard message based on the scores. Personalize it before approving.")
+
         # Allow the clinician to edit the AI feedback before approval.
         edited_feedback = st.text_area(
             "**AI Generated Feedback (Edit if necessary):**",
@@ -1260,7 +1349,7 @@ def _render_assign_clinicians_page(service, hospital_id):
     """
     st.markdown("<h2 style='text-align: center;'>Assign Clinicians to Patients</h2>", unsafe_allow_html=True)
 
-    patients = service.get_all_patients(hospital_id)
+    patients = service.get_all_patients(hospital_id, st.session_state.current_user)
     clinicians = service.get_all_clinicians(hospital_id)
 
     if not patients or not clinicians:
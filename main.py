@@ -37,6 +37,8 @@ def get_carelog_service():
 
 # Get the singleton service instance.
 service = get_carelog_service()
+# Pick up changes written by other app replicas since the last rerun (a cheap stat call).
+service.refresh_if_changed()
 
 # Session State Management
 # Initialize session state variables if they don't already exist.
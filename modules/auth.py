@@ -2,73 +2,427 @@
 This module provides the core business logic and data management for the CareLog application.
 
 It defines the `CareLogService` class, which is responsible for:
-- User authentication (registration, login, logout).
-- Password hashing and verification.
-- Loading and saving application data to an encrypted JSON file (`records.json`).
-- Managing all data entities, including users, patient notes, and hospitals.
+- User authentication (registration and login). The service holds no per-user session
+  state: methods that depend on who is asking take an explicit `principal` (the `User`
+  returned by `login`), so one shared instance can serve many concurrent sessions.
+- Password hashing and verification, delegated to the thread-pool backed `modules.passwords`.
+- Loading and saving application data to an encrypted file (`records.json`), serialized
+  and compressed by `modules.serialization`, encrypted as independent segments by
+  `modules.segments` with per-hospital data keys (envelope encryption), and written as crash-safe generational snapshots by `modules.storage`. Loaded users, notes, and chat messages are held as
+  compact records from `modules.models`.
+- Coordinating with other processes that share the same data file, so that several app
+  replicas can write to it without overwriting each other's changes.
+- Synchronizing the Streamlit session threads that share the service, with a reader-writer
+  lock per hospital (and one for the hospital map) from `modules.locks`.
+- Managing all data entities, including users, patient notes, and hospitals, with
+  per-hospital user indexes from `modules.indexes` kept up to date on every write.
+- Rotating keys online: master keys are re-wrapped at once, and each hospital's data is
+  re-encrypted with a new data key by a throttled background job that reports its progress.
+- Deleting users in two steps: a tombstone that hides the user at once, and a batched
+  purge of their notes, messages, and assignments on a `modules.background` worker.
 - Handling role-based access control for different user types (patient, clinician, admin).
-- Interfacing with other services like `ChatService` and the `gemini` module for AI feedback.
+- Interfacing with other services like `ChatService` and the `gemini` module for AI feedback,
+  and keeping an incrementally updated AI summary of each patient's history for clinicians.
 """
 # carelog/modules/auth.py
 
-import json
+import functools
 import hashlib
+import inspect
 import os
-from cryptography.fernet import InvalidToken
-from modules.encryption import encryptor
-from modules.models import User, PatientNote
-from modules.gemini import generate_feedback
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from modules.encryption import encryptor, KeyAgent, DataKeyring
+from modules.models import User, PatientNote, UserRecord, hydrate_hospital, to_plain
+from modules.gemini import FALLBACK_DEADLINE_SECONDS, FEEDBACK_BATCH_SIZE, build_batch_prompt, build_feedback_prompt, build_summary_prompt, client_metrics, fallback_configured, generate_fallback_feedback, generate_feedback, generate_feedback_batch, generate_summary, template_feedback
 from modules.chat import ChatService
+from modules.storage import SnapshotStore
+from modules.passwords import password_hasher
+from modules.locks import HospitalLocks
+from modules.indexes import HospitalIndex, DELETED_STATUS
+from modules.background import BackgroundWorker
+from modules.singleflight import SingleFlight
+from modules.segments import SegmentReader, SegmentWriter, is_segmented, open_pool
+from modules.serialization import configured_codec, configured_compression, decode_payload
+from modules.ratelimit import COMPLETION_TOKEN_ESTIMATE, DailyBudget, RateLimiter, configured_limits, configured_max_wait, estimate_tokens
 
 DATA_FILE = 'records.json'
+# Number of previous snapshot generations kept next to DATA_FILE for recovery.
+SNAPSHOT_GENERATIONS = 3
+# Codec for new snapshots ('json' or 'msgpack'); existing snapshots are read in any codec.
+DATA_CODEC = configured_codec()
+# Compression for new snapshots as (name, level), or (None, None) to store them uncompressed.
+DATA_COMPRESSION = configured_compression()
+# Worker processes that decrypt and parse snapshot segments on load (CARELOG_LOAD_WORKERS overrides).
+LOAD_WORKERS = int(os.environ.get('CARELOG_LOAD_WORKERS') or os.cpu_count() or 1)
+# Smaller data files are decoded inline, as starting the workers would take longer.
+PARALLEL_LOAD_MIN_BYTES = 4 * 1024 * 1024
+# Deleted users are purged this many seconds after the first deletion, batched together.
+PURGE_DELAY_SECONDS = 5.0
+# A key rotation re-encrypts one hospital at a time, pausing this many seconds between them.
+KEY_ROTATION_STEP_SECONDS = 2.0
+# Background priority of key rotation steps; purges (priority 0) run first.
+KEY_ROTATION_PRIORITY = 10
+# Returned by `generate_and_store_ai_feedback` when the model rate limits were reached.
+AI_RATE_LIMITED = 'rate_limited'
+# Seconds a feedback request may take across its tiers (primary model, fallback model,
+# template) before it settles for the template (CARELOG_FEEDBACK_BUDGET overrides).
+FEEDBACK_LATENCY_BUDGET_SECONDS = float(os.environ.get('CARELOG_FEEDBACK_BUDGET') or 40.0)
+# Opt-in: generate feedback for new patient entries in the background, before anyone asks.
+SPECULATIVE_FEEDBACK = os.environ.get('CARELOG_SPECULATIVE_FEEDBACK') == '1'
+# Estimated tokens each hospital may spend per day on speculative feedback.
+SPECULATIVE_DAILY_TOKENS = int(os.environ.get('CARELOG_SPECULATIVE_DAILY_TOKENS') or 20000)
+# Speculative feedback jobs that may wait at once; entries beyond it are left for clinicians.
+SPECULATIVE_MAX_PENDING = int(os.environ.get('CARELOG_SPECULATIVE_MAX_PENDING') or 100)
+# A patient's first summary only covers their most recent notes, not their whole history.
+SUMMARY_WINDOW_NOTES = 30
+# New notes folded into a patient summary per model call.
+SUMMARY_CHUNK_NOTES = 10
+
+
+def _hospital_argument(method):
+    """Returns a function that extracts the `hospital_id` argument of a call to `method`."""
+    signature = inspect.signature(method)
+
+    def hospital_of(self, args, kwargs):
+        return signature.bind(self, *args, **kwargs).arguments.get('hospital_id')
+    return hospital_of
+
+
+def _transactional(method):
+    """Runs a service method inside `CareLogService._transaction` for its hospital."""
+    hospital_of = _hospital_argument(method)
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._transaction(hospital_of(self, args, kwargs)):
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+def _read_locked(method):
+    """Runs a service method while holding its hospital's lock for reading."""
+    hospital_of = _hospital_argument(method)
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._locks.read(hospital_of(self, args, kwargs)):
+            return method(self, *args, **kwargs)
+    return wrapper
+
 
 class CareLogService:
     """Manages all business logic and data for the CareLog application."""
     def __init__(self):
         """Initializes the service, loads data, and sets up sub-services."""
-        self.current_user = None
-        self._data = self._load_data()
+        self._store = SnapshotStore(DATA_FILE, generations=SNAPSHOT_GENERATIONS)
+        self._segments = SegmentWriter()
+        # Owners (hospital IDs, or None for top-level fields) changed by a refresh since the last save.
+        self._changes = {}
+        # The hospital and declared segment changes of the transaction running in each thread.
+        self._txn = threading.local()
+        self._keyring = DataKeyring(KeyAgent(encryptor))
+        self._locks = HospitalLocks()
+        self._indexes = {}
+        self._background = BackgroundWorker()
+        # Speculative feedback waits on the model, so it never holds up purges or key rotation.
+        self._speculative = BackgroundWorker('carelog-speculative', max_pending=SPECULATIVE_MAX_PENDING)
+        self._load_metrics = {}
+        # Decoding workers for a large snapshot are started before any lock is taken.
+        load_pool, pool_seconds = self._open_load_pool()
+        self._ai_limiter = RateLimiter(configured_limits(), configured_max_wait())
+        self._ai_flights = SingleFlight()
+        self._speculative_budget = DailyBudget(SPECULATIVE_DAILY_TOKENS)
+        try:
+            self._data = self._load_data(load_pool)
+        finally:
+            if load_pool is not None:
+                load_pool.shutdown()
+        if load_pool is not None and self._load_metrics:
+            self._load_metrics['pool_seconds'] = pool_seconds
         self._ensure_hospital_defaults()
         self.chat = ChatService(self)
+        # Finish purges that were interrupted by a restart.
+        for hospital_id in list(self._data['hospitals']):
+            if self._index(hospital_id).tombstones():
+                self._schedule_purge(hospital_id)
+        # Resume a key rotation that was interrupted by a restart.
+        if self._data.get('key_rotation', {}).get('pending'):
+            self._schedule_rotation_step(delay=0.0)
 
-    def _load_data(self):
-        """Loads and decrypts data from the JSON file.
+    def _open_load_pool(self) -> tuple:
+        """Starts the segment decoding processes if the data file is large enough to need them.
 
         Returns:
-            dict: The loaded data, or a new dictionary if the file doesn't exist or is corrupt.
+            tuple: `(pool, seconds)`, the pool (or None) and the time taken to start it.
         """
         try:
-            with open(DATA_FILE, 'r') as f:
-                encrypted_data = f.read()
-                if not encrypted_data:
-                    return {"hospitals": {}}
-                decrypted_data = encryptor.decrypt(encrypted_data.encode()).decode()
-                data = json.loads(decrypted_data)
-                if 'hospitals' not in data:
-                    data['hospitals'] = {}
-                return data
-        except (FileNotFoundError, InvalidToken, json.JSONDecodeError) as e:
-            # If the file is missing, corrupt, or invalid, start with a fresh data structure.
-            print(f"Warning: Could not load data file ({e}). Starting with a new dataset.")
+            size = os.path.getsize(DATA_FILE)
+        except OSError:
+            return None, 0.0
+        if size < PARALLEL_LOAD_MIN_BYTES:
+            return None, 0.0
+        start = time.perf_counter()
+        pool = open_pool(LOAD_WORKERS)
+        return pool, time.perf_counter() - start
+
+    def _load_data(self, pool=None):
+        """Loads and decrypts data from the newest valid snapshot of the data file.
+
+        Args:
+            pool (Executor, optional): Worker processes that decode the snapshot's segments.
+
+        Returns:
+            dict: The loaded data, or a new dictionary if no valid snapshot exists.
+
+        Raises:
+            InvalidToken: If a snapshot does not decrypt with the configured keys.
+            ValueError: If a snapshot's data key is unavailable or its payload does not parse.
+        """
+        data = self._load_snapshot(pool)
+        if data is None:
+            # No snapshot exists; damaged ones have been moved aside by the store.
+            print("Warning: Could not load data file. Starting with a new dataset.")
+            return {"hospitals": {}}
+        return data
+
+    def _load_snapshot(self, pool=None, reuse: bool = False):
+        """Loads the newest valid snapshot and completes the load metrics with its total time.
+
+        Args:
+            pool (Executor, optional): Worker processes that decode the snapshot's segments.
+            reuse (bool): Whether to keep the in-memory data of hospitals whose segments are
+                          unchanged instead of decrypting them (see `_decode_payload`).
+
+        Returns:
+            dict or None: The decoded data, or None if no valid snapshot exists.
+        """
+        start = time.perf_counter()
+        data = self._store.load(functools.partial(self._decode_payload, pool=pool, reuse=reuse))
+        metrics = self._load_metrics
+        if data is not None and metrics:
+            metrics['total_seconds'] = time.perf_counter() - start
+            # Reading and verifying the snapshot file is what remains.
+            metrics['read_seconds'] = max(0.0, metrics['total_seconds'] - metrics['decode_seconds']
+                                          - metrics['merge_seconds'] - metrics['hydrate_seconds'])
+        return data
+
+    def _decode_payload(self, payload: bytes, pool=None, reuse: bool = False) -> dict:
+        """Decrypts and parses a snapshot payload.
+
+        Payloads are segmented containers; snapshots written before segmentation hold the
+        whole dataset as a single token and are still accepted. Given a pool, containers are
+        decrypted and parsed by its worker processes, one segment per task, while merging
+        and building records stay in this process; the time of each phase is recorded for
+        `get_load_metrics`.
+
+        With `reuse`, only the segments of hospitals that another process changed are
+        decrypted: a hospital whose segments are byte-for-byte the ones this service last
+        wrote or loaded is taken from memory as it is.
+
+        Args:
+            payload (bytes): The encrypted snapshot payload.
+            pool (Executor, optional): Worker processes that decode the segments.
+            reuse (bool): Whether to keep the in-memory data of unchanged hospitals.
+
+        Returns:
+            dict: The decoded data.
+        """
+        if not payload:
             return {"hospitals": {}}
+        workers, segments, kept = 1, 1, {}
+        if is_segmented(payload):
+            reader = SegmentReader(payload, self._keyring)
+            entries = reader.entries
+            if reuse:
+                unchanged = self._segments.unchanged(reader)
+                kept = {owner: self._data['hospitals'][owner] for owner in unchanged
+                        if owner in self._data['hospitals']}
+                if None in unchanged:
+                    kept[None] = {key: value for key, value in self._data.items() if key != 'hospitals'}
+                entries = [entry for entry in entries if entry['hospital'] not in kept]
+            segments = len(entries)
+            if pool is not None and segments > 1:
+                workers = min(LOAD_WORKERS, segments)
+            data = reader.load(entries, pool=pool if workers > 1 else None)
+            timings = reader.timings
+            self._segments.adopt(reader)
+        else:
+            start = time.perf_counter()
+            data = decode_payload(self._keyring.agent.unwrap(payload))
+            timings = {'decode': time.perf_counter() - start, 'merge': 0.0}
+        if 'hospitals' not in data:
+            data['hospitals'] = {}
+        start = time.perf_counter()
+        for hospital_data in data['hospitals'].values():
+            hydrate_hospital(hospital_data)
+        for owner, value in kept.items():
+            if owner is None:
+                data.update(value)
+            else:
+                data['hospitals'][owner] = value
+        self._load_metrics = {
+            'bytes': len(payload),
+            'segments': segments,
+            'workers': workers,
+            'decode_seconds': timings['decode'],
+            'merge_seconds': timings['merge'],
+            'hydrate_seconds': time.perf_counter() - start,
+        }
+        return data
 
     def _save_data(self):
-        """Encrypts and saves the current data to the JSON file."""
-        with open(DATA_FILE, 'w') as f:
-            data_to_encrypt = json.dumps(self._data, indent=4)
-            encrypted_data = encryptor.encrypt(data_to_encrypt.encode())
-            f.write(encrypted_data.decode())
+        """Encrypts and atomically writes the current data as a new snapshot generation.
+
+        Inside a transaction for one hospital, only that hospital's segments (or just those
+        declared with `_changed_segments`) and any hospitals replaced by a refresh are
+        serialized again; the others reuse their encoded plaintext without being read.
+        Anywhere else every segment is serialized. Only segments whose plaintext changed
+        are re-encrypted.
+        """
+        with self._store.lock:
+            scope = getattr(self._txn, 'scope', None)
+            if scope is None or scope[0] is None:
+                changes = None
+                hospital_ids = list(self._data['hospitals'])
+            else:
+                changes = dict(self._changes)
+                hospital_id, segments = scope
+                if segments is None or changes.get(hospital_id, set()) is None:
+                    changes[hospital_id] = None
+                else:
+                    changes[hospital_id] = changes.get(hospital_id, set()) | segments
+                hospital_ids = [hospital_id for hospital_id in changes if hospital_id in self._data['hospitals']]
+            # Readers may run concurrently; only writers must be excluded while serializing.
+            with self._locks.read_all(hospital_ids):
+                segments = self._segments.encode(self._data, DATA_CODEC, *DATA_COMPRESSION, changes=changes)
+            self._store.write(self._segments.seal(segments, self._keyring))
+            self._changes = {}
+
+    def _changed_segments(self, hospital_id: str, *segments):
+        """Declares the only segments the running transaction changes, so saving it skips the rest.
+
+        Without a declaration a transaction re-serializes all of its hospital's segments.
+        Declarations accumulate until the transaction ends.
+
+        Args:
+            hospital_id (str): The hospital of the running transaction.
+            *segments: `(kind, batch)` pairs, such as `('notes', 3)`, or `(kind, None)` for
+                       every batch of a kind.
+        """
+        scope = getattr(self._txn, 'scope', None)
+        if scope is not None and scope[0] == hospital_id:
+            scope[1] = set(segments) if scope[1] is None else scope[1] | set(segments)
+
+    def _note_segment(self, position: int) -> tuple:
+        """Returns the `(kind, batch)` of the segment holding the note at a position of a hospital's notes."""
+        return 'notes', position // self._segments.note_batch
+
+    @contextmanager
+    def _transaction(self, hospital_id: str = None):
+        """Runs a read-modify-write against the shared data file.
+
+        The store lock excludes other writers, in this process and in other processes,
+        for the duration of the block, and the in-memory data is brought up to date first,
+        so a change made inside the block (and saved with `_save_data`) never overwrites a
+        newer write from another replica. The hospital's lock is held for writing, so
+        readers of that hospital wait while readers of other hospitals do not.
+
+        A block for one hospital must change only that hospital, as its saves serialize
+        nothing else.
+
+        Args:
+            hospital_id (str, optional): The hospital the block modifies.
+        """
+        with self._store.lock:
+            self._refresh_locked()
+            outer = getattr(self._txn, 'scope', None)
+            # A block nested in one for the whole store, or for another hospital, saves everything.
+            nested = outer is not None and outer[0] != hospital_id
+            self._txn.scope = [None, None] if nested else [hospital_id, None]
+            try:
+                if hospital_id is None:
+                    yield
+                else:
+                    with self._locks.write(hospital_id):
+                        yield
+            finally:
+                self._txn.scope = outer
+
+    def refresh_if_changed(self) -> bool:
+        """Reloads data written by another process since this one last loaded or saved.
+
+        The check is a single `stat` call when nothing has changed, so it is cheap
+        enough to run at the start of every request.
+
+        Returns:
+            bool: True if newer data was loaded, False otherwise.
+        """
+        if not self._store.has_changed():
+            return False
+        with self._store.lock:
+            return self._refresh_locked()
+
+    def _refresh_locked(self) -> bool:
+        """Merges a newer snapshot into memory; the store lock must be held.
+
+        Hospitals whose content is unchanged keep their existing objects, so only
+        the tenants another process actually wrote to are replaced.
+        """
+        if not self._store.has_changed():
+            return False
+        data = self._load_snapshot(reuse=True)
+        if data is None:
+            return False
+        hospitals = self._data.setdefault('hospitals', {})
+        fresh_hospitals = data.pop('hospitals')
+        with self._locks.hospitals.write():
+            for hospital_id in list(hospitals):
+                if hospital_id not in fresh_hospitals:
+                    del hospitals[hospital_id]
+            for hospital_id, hospital_data in fresh_hospitals.items():
+                self._apply_hospital_defaults(hospital_data)
+                if hospitals.get(hospital_id) is hospital_data:
+                    continue  # Not decrypted at all, as its segments are unchanged.
+                with self._locks.read(hospital_id):
+                    unchanged = hospitals.get(hospital_id) == hospital_data
+                if not unchanged:
+                    # Readers holding the old hospital object keep a consistent view of it.
+                    hospitals[hospital_id] = hospital_data
+                    self._changes[hospital_id] = None
+            if any(self._data.get(key) != value for key, value in data.items()):
+                self._changes[None] = None
+            self._data.update(data)
+        return True
+
+    def _index(self, hospital_id: str) -> HospitalIndex:
+        """Returns a hospital's user index, rebuilding it if it is stale; the hospital's lock must be held."""
+        users = self._data['hospitals'].get(hospital_id, {}).get('users')
+        if users is None:
+            return HospitalIndex({})
+        index = self._indexes.get(hospital_id)
+        if index is None or not index.is_current(users):
+            index = HospitalIndex(users)
+            self._indexes[hospital_id] = index
+        return index
 
     def _ensure_hospital_defaults(self):
         """Ensures that all hospital records have the default data structures."""
         hospitals = self._data.setdefault('hospitals', {})
-        for hospital_id, hospital_data in hospitals.items():
-            hospital_data.setdefault('users', {})
-            hospital_data.setdefault('notes', [])
-            hospital_data.setdefault('alerts', [])
-            chats = hospital_data.setdefault('chats', {})
-            chats.setdefault('general', {})
-            chats.setdefault('direct', {})
+        for hospital_data in hospitals.values():
+            self._apply_hospital_defaults(hospital_data)
+
+    @staticmethod
+    def _apply_hospital_defaults(hospital_data: dict):
+        """Adds any missing default data structures to a single hospital record."""
+        hospital_data.setdefault('users', {})
+        hospital_data.setdefault('notes', [])
+        hospital_data.setdefault('alerts', [])
+        chats = hospital_data.setdefault('chats', {})
+        chats.setdefault('general', {})
+        chats.setdefault('direct', {})
 
     def register_user(self, username, password, role, hospital_id, full_name, dob, sex, pronouns, bio):
         """Registers a new user, handling password hashing and approval logic.
@@ -89,6 +443,13 @@ class CareLogService:
         """
         if not self._is_strong_password(password):
             return 'weak_password'
+        # Derive the hash before taking the store lock; the KDF is deliberately slow.
+        password_fields = password_hasher.hash(password)
+        with self._transaction(hospital_id):
+            return self._register_user_locked(username, password_fields, role, hospital_id, full_name, dob, sex, pronouns, bio)
+
+    def _register_user_locked(self, username, password_fields, role, hospital_id, full_name, dob, sex, pronouns, bio):
+        """Implements `register_user` once the password is hashed and the store lock is held."""
         is_new_hospital = hospital_id not in self._data['hospitals']
 
         # Only an admin can create a new hospital.
@@ -96,39 +457,41 @@ class CareLogService:
             return 'hospital_not_found'
 
         if is_new_hospital:
-            self._data['hospitals'][hospital_id] = {
-                "users": {},
-                "notes": [],
-                "alerts": [],
-                "chats": {
-                    "general": {},
-                    "direct": {}
+            with self._locks.hospitals.write():
+                self._data['hospitals'][hospital_id] = {
+                    "users": {},
+                    "notes": [],
+                    "alerts": [],
+                    "chats": {
+                        "general": {},
+                        "direct": {}
+                    }
                 }
-            }
         else:
-            self._ensure_hospital_defaults()
+            self._apply_hospital_defaults(self._data['hospitals'][hospital_id])
         
         hospital_users = self._data['hospitals'][hospital_id]['users']
+        index = self._index(hospital_id)
         user_key = f"{username}_{role}"
+
+        if index.is_deleted(username, role):
+            # Reusing a deleted user's name: their data must be gone before the new account exists.
+            self._purge_deleted_users_locked(hospital_id)
         
         if user_key in hospital_users:
             return False
 
-        # Hash the password with a unique salt.
-        salt = os.urandom(16).hex()
-        password_to_hash = salt + password
-        password_hash = hashlib.sha256(password_to_hash.encode()).hexdigest()
-        
         # New clinicians and admins require approval unless it's a new hospital.
         status = 'approved'
         if (role == 'admin' or role == 'clinician') and not is_new_hospital:
             status = 'pending'
 
-        hospital_users[user_key] = {
+        hospital_users[user_key] = UserRecord.from_dict({
             'username': username,
-            'password_hash': password_hash,
+            'password_hash': password_fields['password_hash'],
             'role': role,
-            'salt': salt,
+            'salt': password_fields['salt'],
+            'kdf': password_fields['kdf'],
             'status': status,
             'full_name': full_name,
             'dob': dob,
@@ -136,7 +499,8 @@ class CareLogService:
             'pronouns': pronouns,
             'bio': bio,
             'assigned_clinicians': [] # Specific to patients
-        }
+        })
+        index.add_user(user_key, hospital_users[user_key])
         self._save_data()
         if status == 'pending':
             return 'pending'
@@ -153,7 +517,10 @@ class CareLogService:
         return has_upper and has_lower and has_digit and has_special
 
     def login(self, username, password, role, hospital_id):
-        """Authenticates a user and sets the current user session.
+        """Authenticates a user.
+
+        The caller keeps the returned `User` in its own session and passes it back as the
+        `principal` of later calls; the service itself does not remember who logged in.
 
         Args:
             username (str): The user's username.
@@ -168,11 +535,12 @@ class CareLogService:
         hospital_data = self._data['hospitals'].get(hospital_id)
         if not hospital_data:
             return None
-        hospital_users = hospital_data.get('users', {})
         user_key = f"{username}_{role}"
-        user_data = hospital_users.get(user_key)
+        with self._locks.read(hospital_id):
+            user_data = hospital_data.get('users', {}).get(user_key)
+            user_data = dict(user_data) if user_data else None
 
-        if user_data:
+        if user_data and user_data.get('status') != DELETED_STATUS:
             # Check if the account is pending approval.
             if user_data.get('status') == 'pending':
                 return 'pending'
@@ -180,11 +548,13 @@ class CareLogService:
             salt = user_data.get('salt')
             if not salt:
                  return 'error' # Indicates a data integrity issue.
-            password_to_check = salt + password
-            hash_to_check = hashlib.sha256(password_to_check.encode()).hexdigest()
+            matches, upgrade = password_hasher.verify(password, user_data)
 
-            if user_data.get('password_hash') == hash_to_check:
-                self.current_user = User(
+            if matches:
+                if upgrade:
+                    # Transparently re-hash legacy or outdated hashes with the current KDF.
+                    self._upgrade_password_hash(hospital_id, user_key, user_data.get('password_hash'), upgrade)
+                return User(
                     username=user_data['username'],
                     password_hash=user_data['password_hash'],
                     role=user_data['role'],
@@ -194,109 +564,483 @@ class CareLogService:
                     pronouns=user_data.get('pronouns'),
                     bio=user_data.get('bio')
                 )
-                return self.current_user
         return None
         
-    def logout(self):
-        """Logs out the current user by clearing the session."""
-        self.current_user = None
+    def _upgrade_password_hash(self, hospital_id: str, user_key: str, verified_hash: str, upgrade: dict):
+        """Replaces a verified user's password hash fields, unless the password changed meanwhile."""
+        with self._transaction(hospital_id):
+            user_data = self._data['hospitals'].get(hospital_id, {}).get('users', {}).get(user_key)
+            if user_data and user_data.get('password_hash') == verified_hash:
+                user_data.update(upgrade)
+                self._save_data()
 
+    @_transactional
     def add_note(self, note: PatientNote, hospital_id: str):
         """Adds a new patient note and creates a pain alert if necessary.
 
+        With `SPECULATIVE_FEEDBACK` enabled, feedback for a new non-private patient entry is
+        also queued for generation in the background, so it is usually waiting for review
+        when a clinician opens it; nothing is queued once the hospital's daily speculative
+        budget is spent or `SPECULATIVE_MAX_PENDING` jobs are already waiting.
+
         Args:
             note (PatientNote): The note object to add.
             hospital_id (str): The ID of the hospital.
         """
         if hospital_id in self._data['hospitals']:
-            self._data['hospitals'][hospital_id]['notes'].append(note.__dict__)
+            notes = self._data['hospitals'][hospital_id]['notes']
+            notes.append(note.to_record())
+            self._changed_segments(hospital_id, self._note_segment(len(notes) - 1))
             # Create an alert if pain is reported as 10/10.
             if note.pain == 10 and note.source == 'patient':
                 alert = {"alert_id": str(note.note_id), "patient_id": note.patient_id, "timestamp": note.timestamp, "status": "new"}
                 if 'alerts' not in self._data['hospitals'][hospital_id]: self._data['hospitals'][hospital_id]['alerts'] = []
                 self._data['hospitals'][hospital_id]['alerts'].append(alert)
+                self._changed_segments(hospital_id, ('meta', 0))
             self._save_data()
+            if (SPECULATIVE_FEEDBACK and note.source == 'patient' and not note.is_private
+                    and not self._speculative_budget.exhausted(hospital_id)):
+                self._speculative.submit(('speculative-feedback', hospital_id, note.note_id),
+                                         lambda: self._generate_speculative_feedback(note.note_id, hospital_id))
 
     def generate_and_store_ai_feedback(self, note_id: str, hospital_id: str) -> bool:
         """Generates AI feedback for a specific note and stores it with a 'pending' status.
 
+        Calls are admitted by the service's rate limiter: when the global or hospital limits
+        are reached the call queues briefly, or is rejected if the wait would be too long.
+        If the primary model fails or times out, the feedback comes from the fallback model
+        within what is left of `FEEDBACK_LATENCY_BUDGET_SECONDS`, and otherwise from a
+        template built from the scores; its `origin` ('primary', 'fallback', or 'template')
+        is stored with it. Concurrent requests for the same note and prompt share a single
+        model call and write, and feedback is only stored if the note has not been edited
+        since its prompt was built.
+
         Args:
             note_id (str): The ID of the note to generate feedback for.
             hospital_id (str): The ID of the hospital.
 
         Returns:
-            bool: True if feedback was generated and stored, False otherwise.
+            bool or str: True if feedback was generated and stored, `AI_RATE_LIMITED` if the
+                         request was rejected by the rate limiter (see `get_ai_usage` for when
+                         to retry), False if the note does not exist or was changed meanwhile.
         """
-        if hospital_id in self._data['hospitals']:
-            for note in self._data['hospitals'][hospital_id]['notes']:
-                if note['note_id'] == note_id:
-                    notes_text = note.get('notes', '')
-                    mood_val = note.get('mood', 5)
-                    pain_val = note.get('pain', 5)
-                    appetite_val = note.get('appetite', 5)
-                    feedback = generate_feedback(notes_text, mood_val, pain_val, appetite_val)
-                    if feedback:
-                        note['ai_feedback'] = {
-                            "text": feedback,
-                            "status": "pending"
-                        }
-                        self._save_data()
-                        return True
-        return False
+        with self._locks.read(hospital_id):
+            note = self._find_note(hospital_id, note_id)
+            entry = self._feedback_entry(note) if note is not None else None
+        if entry is None:
+            return False
+        prompt = build_feedback_prompt(*entry)
+        key = (hospital_id, note_id, hashlib.sha256(prompt.encode()).hexdigest())
+        def generate():
+            return self._generate_feedback_once(hospital_id, note_id, entry, prompt)
+
+        stored, shared = self._ai_flights.do(key, generate)
+        if shared and stored is None:
+            # Joined a speculative call that stored nothing; this request gets the fallback tiers.
+            stored, _ = self._ai_flights.do(key, generate)
+        return stored
+
+    def _generate_speculative_feedback(self, note_id: str, hospital_id: str) -> bool:
+        """Generates feedback for a new entry in the background, within the daily speculative budget.
+
+        Only the primary model is used, and nothing is stored if the note already has feedback
+        by then; a request that does not fit today's `SPECULATIVE_DAILY_TOKENS` for the
+        hospital is skipped, leaving the entry for a clinician to generate. It shares the
+        single-flight key of `generate_and_store_ai_feedback`, so a clinician asking for the
+        same note meanwhile waits for this call instead of paying for a second one; if it
+        stores nothing, the clinician's request then makes its own call.
 
-    def get_notes_for_patient(self, hospital_id: str, patient_id: str) -> list:
+        Returns:
+            bool or None: True if feedback was stored, False if the note is gone or was
+                          changed, None if nothing was generated.
+        """
+        with self._locks.read(hospital_id):
+            note = self._find_note(hospital_id, note_id)
+            if note is None or note.get('ai_feedback'):
+                return None
+            entry = self._feedback_entry(note)
+        prompt = build_feedback_prompt(*entry)
+        key = (hospital_id, note_id, hashlib.sha256(prompt.encode()).hexdigest())
+        stored, _ = self._ai_flights.do(key, lambda: self._generate_feedback_once(hospital_id, note_id, entry, prompt,
+                                                                                  speculative=True))
+        return stored
+
+    def generate_ai_feedback_batch(self, note_ids: list, hospital_id: str) -> dict:
+        """Generates and stores AI feedback for several notes, packing several into each model call.
+
+        Up to `FEEDBACK_BATCH_SIZE` notes share one request, so the instructions are sent once
+        per batch. Each batch passes the rate limiter as one request and is stored with one
+        write. Notes whose feedback cannot be parsed from the batched response are generated
+        one at a time through `generate_and_store_ai_feedback`.
+
+        Args:
+            note_ids (list): The IDs of the notes to generate feedback for.
+            hospital_id (str): The ID of the hospital.
+
+        Returns:
+            dict: The outcome for each note ID, as returned by `generate_and_store_ai_feedback`.
+        """
+        note_ids = list(dict.fromkeys(note_ids))
+        results = {}
+        for start in range(0, len(note_ids), FEEDBACK_BATCH_SIZE):
+            results.update(self._generate_feedback_batch(note_ids[start:start + FEEDBACK_BATCH_SIZE], hospital_id))
+        return results
+
+    def _generate_feedback_batch(self, note_ids: list, hospital_id: str) -> dict:
+        """Implements `generate_ai_feedback_batch` for one batch of notes."""
+        results = {}
+        entries = {}
+        with self._locks.read(hospital_id):
+            for note_id in note_ids:
+                note = self._find_note(hospital_id, note_id)
+                if note is None:
+                    results[note_id] = False
+                else:
+                    entries[note_id] = self._feedback_entry(note)
+        if len(entries) < 2:
+            for note_id in entries:
+                results[note_id] = self.generate_and_store_ai_feedback(note_id, hospital_id)
+            return results
+
+        batch = list(entries.values())
+        prompt_tokens = estimate_tokens(build_batch_prompt(batch))
+        reserved = prompt_tokens + COMPLETION_TOKEN_ESTIMATE * len(batch)
+        admission = self._ai_limiter.admit(hospital_id, reserved)
+        if admission is None:
+            results.update(dict.fromkeys(entries, AI_RATE_LIMITED))
+            return results
+        # The model call runs outside the transaction so a slow response never blocks other writers.
+        feedback = dict(zip(entries, generate_feedback_batch(batch, admit=admission.admit)))
+        parsed = [text for text in feedback.values() if text]
+        admission.settle(prompt_tokens, sum(estimate_tokens(text) for text in parsed), ok=bool(parsed))
+        with self._transaction(hospital_id):
+            for note_id, text in feedback.items():
+                if not text:
+                    continue
+                position, note = self._locate_note(hospital_id, note_id)
+                # Skip notes deleted or edited while the model was answering.
+                results[note_id] = note is not None and self._feedback_entry(note) == entries[note_id]
+                if results[note_id]:
+                    note['ai_feedback'] = {"text": text, "status": "pending", "origin": "primary"}
+                    self._changed_segments(hospital_id, self._note_segment(position))
+            if any(results.get(note_id) is True for note_id in feedback):
+                self._save_data()
+        # Fall back to one call per note for entries missing from the batched response.
+        for note_id, text in feedback.items():
+            if not text:
+                results[note_id] = self.generate_and_store_ai_feedback(note_id, hospital_id)
+        return results
+
+    @staticmethod
+    def _feedback_entry(note) -> tuple:
+        """Returns the fields of a note that its feedback prompt is built from."""
+        return (note.get('notes', ''), note.get('mood', 5), note.get('pain', 5), note.get('appetite', 5))
+
+    def _generate_feedback_once(self, hospital_id: str, note_id: str, entry: tuple, prompt: str,
+                                speculative: bool = False):
+        """Implements `generate_and_store_ai_feedback` for the single caller of a flight.
+
+        Speculative calls are charged to the hospital's daily speculative budget, skip the
+        fallback tiers, never replace existing feedback, and return None instead of a
+        failure when they store nothing (see `_generate_speculative_feedback`).
+        """
+        start = time.monotonic()
+        budget = FEEDBACK_LATENCY_BUDGET_SECONDS
+        # Time kept back for the fallback model, if there is one; the template takes none.
+        reserve = min(FALLBACK_DEADLINE_SECONDS, budget / 2) if fallback_configured() and not speculative else 0.0
+        prompt_tokens = estimate_tokens(prompt)
+        reserved = prompt_tokens + COMPLETION_TOKEN_ESTIMATE
+        if speculative:
+            with self._locks.read(hospital_id):
+                note = self._find_note(hospital_id, note_id)
+                if note is None or note.get('ai_feedback'):
+                    return None
+            # Charged only by the caller that makes the call, once it is known to be needed.
+            if not self._speculative_budget.try_spend(hospital_id, reserved):
+                return None
+        # Queueing may use at most half of the primary model's share of the budget.
+        admission = self._ai_limiter.admit(hospital_id, reserved, min(self._ai_limiter.max_wait, (budget - reserve) / 2))
+        if admission is None:
+            return None if speculative else AI_RATE_LIMITED
+        # The model call runs outside the transaction so a slow response never blocks other writers.
+        feedback = generate_feedback(*entry, deadline=budget - reserve - (time.monotonic() - start),
+                                     admit=admission.admit)
+        admission.settle(prompt_tokens, estimate_tokens(feedback) if feedback else 0, ok=bool(feedback))
+        origin = 'primary'
+        if not feedback and speculative:
+            return None
+        if not feedback:
+            feedback, origin = self._fallback_feedback(hospital_id, entry, prompt_tokens,
+                                                       budget - (time.monotonic() - start))
+        with self._transaction(hospital_id):
+            position, note = self._locate_note(hospital_id, note_id)
+            if note is None or self._feedback_entry(note) != entry:
+                # Deleted or edited while the model was answering; the feedback is stale.
+                return False
+            if speculative and note.get('ai_feedback'):
+                return None
+            note['ai_feedback'] = {
+                "text": feedback,
+                "status": "pending",
+                "origin": origin
+            }
+            self._changed_segments(hospital_id, self._note_segment(position))
+            self._save_data()
+        return True
+
+    def _fallback_feedback(self, hospital_id: str, entry: tuple, prompt_tokens: int, remaining: float) -> tuple:
+        """Generates feedback after the primary model failed, within the remaining budget.
+
+        The fallback model's calls pass the rate limiter like the primary model's.
+
+        Args:
+            hospital_id (str): The ID of the hospital.
+            entry (tuple): The `(notes, mood, pain, appetite)` of the note.
+            prompt_tokens (int): The estimated tokens of the feedback prompt.
+            remaining (float): The seconds left of the feedback latency budget.
+
+        Returns:
+            tuple: `(text, origin)`, from the fallback model if one is configured and answers
+                   in time, otherwise from the score template.
+        """
+        if remaining > 0 and fallback_configured():
+            start = time.monotonic()
+            reserved = prompt_tokens + COMPLETION_TOKEN_ESTIMATE
+            admission = self._ai_limiter.admit(hospital_id, reserved, min(self._ai_limiter.max_wait, remaining / 2))
+            if admission is not None:
+                feedback = generate_fallback_feedback(*entry, deadline=remaining - (time.monotonic() - start),
+                                                      admit=admission.admit)
+                admission.settle(prompt_tokens, estimate_tokens(feedback) if feedback else 0, ok=bool(feedback))
+                if feedback:
+                    return feedback, 'fallback'
+        return template_feedback(*entry[1:]), 'template'
+
+    def _find_note(self, hospital_id: str, note_id: str):
+        """Returns the stored note with the given ID, or None if it does not exist."""
+        return self._locate_note(hospital_id, note_id)[1]
+
+    def _locate_note(self, hospital_id: str, note_id: str) -> tuple:
+        """Returns `(position, note)` for the stored note with the given ID, or `(None, None)`."""
+        for position, note in enumerate(self._data['hospitals'].get(hospital_id, {}).get('notes', [])):
+            if getattr(note, 'note_id', None) == note_id:
+                return position, note
+        return None, None
+
+    @staticmethod
+    def _is_visible_note(index: HospitalIndex, note: dict) -> bool:
+        """Checks that a note does not belong to a deleted patient or clinician awaiting purge."""
+        if index.is_deleted(getattr(note, 'patient_id', None), 'patient'):
+            return False
+        return not (getattr(note, 'source', None) == 'clinician' and index.is_deleted(getattr(note, 'author_id', None), 'clinician'))
+
+    @_read_locked
+    def get_notes_for_patient(self, hospital_id: str, patient_id: str, principal: User) -> list:
         """Retrieves all notes for a specific patient, applying access control rules.
 
         Args:
             hospital_id (str): The ID of the hospital.
             patient_id (str): The ID of the patient.
+            principal (User): The user making the request.
 
         Returns:
             list: A list of note dictionaries.
         """
         hospital_data = self._data['hospitals'].get(hospital_id, {})
-        all_patient_notes = [n for n in hospital_data.get('notes', []) if n.get('patient_id') == patient_id]
+        index = self._index(hospital_id)
+        if index.is_deleted(patient_id, 'patient'):
+            return []
+        all_patient_notes = [
+            n for n in hospital_data.get('notes', [])
+            if getattr(n, 'patient_id', None) == patient_id and self._is_visible_note(index, n)
+        ]
         
         # Clinicians can only see notes for patients they are assigned to.
-        if self.current_user and self.current_user.role == 'clinician':
-            patient_user_key = f"{patient_id}_patient"
-            patient_data = hospital_data.get('users', {}).get(patient_user_key, {})
-            assigned_clinicians = patient_data.get('assigned_clinicians', [])
-
-            if self.current_user.username in assigned_clinicians:
+        if principal and principal.role == 'clinician':
+            if index.is_assigned(patient_id, principal.username):
                 # Filter out private patient notes.
-                return [n for n in all_patient_notes if not (n.get('source') == 'patient' and n.get('is_private'))]
+                return [n for n in all_patient_notes if not (getattr(n, 'source', None) == 'patient' and getattr(n, 'is_private', None))]
             return [] # Return no notes if not assigned.
         return all_patient_notes # Patients and admins can see all notes.
 
-    def get_pending_feedback(self, hospital_id: str) -> list:
+    @_read_locked
+    def get_pending_feedback(self, hospital_id: str, principal: User) -> list:
         """Retrieves all notes with AI feedback awaiting approval.
 
         Args:
             hospital_id (str): The ID of the hospital.
+            principal (User): The user making the request.
 
         Returns:
             list: A list of note dictionaries with pending feedback.
         """
         pending_feedback = []
         
-        # Get a set of assigned patient IDs for efficient filtering for clinicians.
+        # Use the maintained assignment index for efficient filtering for clinicians.
+        index = self._index(hospital_id)
         assigned_patient_ids = None
-        if self.current_user and self.current_user.role == 'clinician':
-            assigned_patients_data = self.get_all_patients(hospital_id)
-            assigned_patient_ids = {p['username'] for p in assigned_patients_data}
+        if principal and principal.role == 'clinician':
+            assigned_patient_ids = index.patients_for(principal.username)
 
         if hospital_id in self._data['hospitals']:
             for note in self._data['hospitals'][hospital_id]['notes']:
-                if note.get('ai_feedback') and note['ai_feedback']['status'] == 'pending':
+                feedback = getattr(note, 'ai_feedback', None)
+                if feedback and feedback['status'] == 'pending' and self._is_visible_note(index, note):
                     # Clinicians only see feedback for their assigned patients.
                     if assigned_patient_ids is not None:
-                        if note.get('patient_id') in assigned_patient_ids:
+                        if getattr(note, 'patient_id', None) in assigned_patient_ids:
                             pending_feedback.append(note)
                     else: # Admins see all pending feedback.
                         pending_feedback.append(note)
         return pending_feedback
 
+    @_read_locked
+    def get_notes_awaiting_feedback(self, hospital_id: str, principal: User) -> list:
+        """Retrieves the patient entries that could receive AI feedback but have none yet.
+
+        These are visible, non-private, patient-sourced notes without feedback; clinicians
+        only get those of their assigned patients.
+
+        Args:
+            hospital_id (str): The ID of the hospital.
+            principal (User): The user making the request.
+
+        Returns:
+            list: A list of note dictionaries.
+        """
+        index = self._index(hospital_id)
+        assigned_patient_ids = None
+        if principal and principal.role == 'clinician':
+            assigned_patient_ids = index.patients_for(principal.username)
+        awaiting = []
+        for note in self._data['hospitals'].get(hospital_id, {}).get('notes', []):
+            if getattr(note, 'source', None) != 'patient' or getattr(note, 'is_private', None) or getattr(note, 'ai_feedback', None):
+                continue
+            if not self._is_visible_note(index, note):
+                continue
+            if assigned_patient_ids is None or getattr(note, 'patient_id', None) in assigned_patient_ids:
+                awaiting.append(note)
+        return awaiting
+
+    def _summary_notes(self, hospital_id: str, patient_id: str) -> list:
+        """Returns the notes a patient's summary is built from, oldest first.
+
+        These are the patient's visible notes except private patient entries, ordered by
+        `(timestamp, note_id)`, the order a summary's watermark is compared in.
+        """
+        index = self._index(hospital_id)
+        notes = [
+            n for n in self._data['hospitals'].get(hospital_id, {}).get('notes', [])
+            if getattr(n, 'patient_id', None) == patient_id and self._is_visible_note(index, n)
+            and not (getattr(n, 'source', None) == 'patient' and getattr(n, 'is_private', None))
+        ]
+        return sorted(notes, key=lambda n: (getattr(n, 'timestamp', None) or '', str(getattr(n, 'note_id', None))))
+
+    @staticmethod
+    def _notes_after(notes: list, watermark) -> list:
+        """Returns the notes that sort after a summary's `[timestamp, note_id]` watermark."""
+        if not watermark:
+            return notes
+        return [n for n in notes if (getattr(n, 'timestamp', None) or '', str(getattr(n, 'note_id', None))) > tuple(watermark)]
+
+    def _may_summarize(self, hospital_id: str, patient_id: str, principal: User) -> bool:
+        """Checks that the principal is an admin or a clinician assigned to the patient."""
+        if not principal or principal.role not in ('admin', 'clinician'):
+            return False
+        index = self._index(hospital_id)
+        if index.is_deleted(patient_id, 'patient'):
+            return False
+        return principal.role == 'admin' or index.is_assigned(patient_id, principal.username)
+
+    @_read_locked
+    def get_patient_summary(self, hospital_id: str, patient_id: str, principal: User) -> dict:
+        """Retrieves the cached AI summary of a patient's history without calling the model.
+
+        Args:
+            hospital_id (str): The ID of the hospital.
+            patient_id (str): The ID of the patient.
+            principal (User): The user making the request; an admin or an assigned clinician.
+
+        Returns:
+            dict: The summary `text` (None if there is none yet), when it was `updated_at`,
+                  the number of `notes_covered`, and the number of `new_notes` added since;
+                  or None if the principal may not see the patient's summary.
+        """
+        if not self._may_summarize(hospital_id, patient_id, principal):
+            return None
+        summary = self._data['hospitals'].get(hospital_id, {}).get('summaries', {}).get(patient_id) or {}
+        new_notes = self._notes_after(self._summary_notes(hospital_id, patient_id), summary.get('watermark'))
+        return {
+            'text': summary.get('text'),
+            'updated_at': summary.get('updated_at'),
+            'notes_covered': summary.get('notes_covered', 0),
+            'new_notes': len(new_notes),
+        }
+
+    def update_patient_summary(self, hospital_id: str, patient_id: str, principal: User):
+        """Folds the notes added since a patient's cached summary into it.
+
+        Only the new notes are sent to the model, together with the previous summary, in
+        chunks of `SUMMARY_CHUNK_NOTES`; a first summary starts from the most recent
+        `SUMMARY_WINDOW_NOTES` notes. The summary and the watermark of the last note it covers
+        are stored with the hospital's encrypted data after each chunk, so an interrupted
+        update resumes where it stopped. Notes edited after they were summarized are not
+        revisited. Concurrent updates of the same patient share one run.
+
+        Args:
+            hospital_id (str): The ID of the hospital.
+            patient_id (str): The ID of the patient.
+            principal (User): The user making the request; an admin or an assigned clinician.
+
+        Returns:
+            bool or str: True if the summary is up to date, `AI_RATE_LIMITED` if a model call
+                         was rejected by the rate limiter, False otherwise.
+        """
+        with self._locks.read(hospital_id):
+            if not self._may_summarize(hospital_id, patient_id, principal):
+                return False
+        updated, _ = self._ai_flights.do(('summary', hospital_id, patient_id),
+                                         lambda: self._update_patient_summary(hospital_id, patient_id))
+        return updated
+
+    def _update_patient_summary(self, hospital_id: str, patient_id: str):
+        """Implements `update_patient_summary` for the single caller of a flight."""
+        with self._locks.read(hospital_id):
+            summary = dict(self._data['hospitals'].get(hospital_id, {}).get('summaries', {}).get(patient_id) or {})
+            new_notes = self._notes_after(self._summary_notes(hospital_id, patient_id), summary.get('watermark'))
+        if not summary.get('watermark'):
+            new_notes = new_notes[-SUMMARY_WINDOW_NOTES:]
+        for start in range(0, len(new_notes), SUMMARY_CHUNK_NOTES):
+            chunk = new_notes[start:start + SUMMARY_CHUNK_NOTES]
+            prompt_tokens = estimate_tokens(build_summary_prompt(summary.get('text'), chunk))
+            reserved = prompt_tokens + COMPLETION_TOKEN_ESTIMATE
+            admission = self._ai_limiter.admit(hospital_id, reserved)
+            if admission is None:
+                return AI_RATE_LIMITED
+            # The model call runs outside the transaction so a slow response never blocks other writers.
+            text = generate_summary(summary.get('text'), chunk, admit=admission.admit)
+            admission.settle(prompt_tokens, estimate_tokens(text) if text else 0, ok=bool(text))
+            if not text:
+                return False
+            summary = {
+                'text': text,
+                'watermark': [chunk[-1].get('timestamp', ''), str(chunk[-1].get('note_id'))],
+                'notes_covered': summary.get('notes_covered', 0) + len(chunk),
+                'updated_at': datetime.now().isoformat(),
+            }
+            with self._transaction(hospital_id):
+                hospital = self._data['hospitals'].get(hospital_id)
+                if hospital is None or self._index(hospital_id).is_deleted(patient_id, 'patient'):
+                    return False
+                summaries = hospital.setdefault('summaries', {})
+                stored = summaries.get(patient_id) or {}
+                if stored.get('watermark') and tuple(stored['watermark']) >= tuple(summary['watermark']):
+                    # Another process already summarized further; keep its result.
+                    return True
+                summaries[patient_id] = summary
+                self._save_data()
+        return True
+
+    @_transactional
     def approve_ai_feedback(self, note_id: str, hospital_id: str, edited_feedback_text: str) -> bool:
         """Approves AI-generated feedback for a note, updating its text.
 
@@ -309,15 +1053,17 @@ class CareLogService:
             bool: True if successful, False otherwise.
         """
         if hospital_id in self._data['hospitals']:
-            for note in self._data['hospitals'][hospital_id]['notes']:
+            for position, note in enumerate(self._data['hospitals'][hospital_id]['notes']):
                 if note['note_id'] == note_id:
                     if note.get('ai_feedback'):
                         note['ai_feedback']['text'] = edited_feedback_text
                         note['ai_feedback']['status'] = 'approved' 
+                        self._changed_segments(hospital_id, self._note_segment(position))
                         self._save_data()
                         return True
         return False
 
+    @_transactional
     def reject_ai_feedback(self, note_id: str, hospital_id: str) -> bool:
         """Rejects and deletes AI-generated feedback for a note.
 
@@ -329,14 +1075,16 @@ class CareLogService:
             bool: True if successful, False otherwise.
         """
         if hospital_id in self._data['hospitals']:
-            for note in self._data['hospitals'][hospital_id]['notes']:
+            for position, note in enumerate(self._data['hospitals'][hospital_id]['notes']):
                 if note.get('note_id') == note_id:
                     if 'ai_feedback' in note:
                         del note['ai_feedback']
+                        self._changed_segments(hospital_id, self._note_segment(position))
                         self._save_data()
                         return True
         return False
 
+    @_transactional
     def delete_note(self, note_id: str, hospital_id: str) -> bool:
         """Deletes a specific note.
 
@@ -353,28 +1101,26 @@ class CareLogService:
             return True
         return False
 
-    def get_all_patients(self, hospital_id: str) -> list:
+    @_read_locked
+    def get_all_patients(self, hospital_id: str, principal: User) -> list:
         """Retrieves a list of all patients in a hospital, respecting clinician assignments.
 
         Args:
             hospital_id (str): The ID of the hospital.
+            principal (User): The user making the request.
 
         Returns:
             list: A list of patient user data dictionaries.
         """
-        hospital_users = self._data['hospitals'].get(hospital_id, {}).get('users', {})
-        current_user = self.current_user
-        patient_list = []
-        for user_data in hospital_users.values():
-            if user_data.get('role') == 'patient':
-                # Clinicians only see patients they are assigned to.
-                if current_user.role == 'clinician':
-                    if current_user.username in user_data.get('assigned_clinicians', []):
-                        patient_list.append(user_data)
-                else: # Admins see all patients.
-                    patient_list.append(user_data)
-        return patient_list
-
+        index = self._index(hospital_id)
+        # Clinicians only see patients they are assigned to.
+        if principal and principal.role == 'clinician':
+            users = index.users
+            patient_keys = (f"{username}_patient" for username in index.patients_for(principal.username))
+            return [users[key] for key in patient_keys if key in users]
+        return index.records('patient') # Admins see all patients.
+
+    @_read_locked
     def get_all_users(self, hospital_id: str) -> dict:
         """Retrieves all users for a given hospital.
 
@@ -382,10 +1128,13 @@ class CareLogService:
             hospital_id (str): The ID of the hospital.
 
         Returns:
-            dict: A dictionary of user data.
+            dict: A copy of the dictionary of user data, safe to iterate while others write.
+                  Deleted users awaiting purge are left out.
         """
-        return self._data['hospitals'].get(hospital_id, {}).get('users', {})
+        users = self._data['hospitals'].get(hospital_id, {}).get('users', {})
+        return {key: data for key, data in users.items() if data.get('status') != DELETED_STATUS}
         
+    @_read_locked
     def get_user_by_username(self, hospital_id: str, username: str, role: str) -> dict:
         """Retrieves a single user's data by username and role.
 
@@ -398,18 +1147,26 @@ class CareLogService:
             dict: The user's data, or an empty dictionary if not found.
         """
         user_key = f"{username}_{role}"
-        return self._data['hospitals'].get(hospital_id, {}).get('users', {}).get(user_key, {})
+        user_data = self._data['hospitals'].get(hospital_id, {}).get('users', {}).get(user_key, {})
+        return {} if user_data.get('status') == DELETED_STATUS else user_data
 
     def get_hospital_dataset(self, hospital_id: str) -> dict:
         """Retrieves the entire dataset for a specific hospital.
 
+        Pending purges of deleted users are completed first, so exports never contain them.
+
         Args:
             hospital_id (str): The ID of the hospital.
 
         Returns:
-            dict: The hospital's dataset.
+            dict: A consistent copy of the hospital's dataset, as plain dictionaries.
         """
-        return self._data['hospitals'].get(hospital_id, {"users": {}, "notes": []})
+        with self._locks.read(hospital_id):
+            has_tombstones = bool(self._index(hospital_id).tombstones())
+        if has_tombstones:
+            self.purge_deleted_users(hospital_id)
+        with self._locks.read(hospital_id):
+            return to_plain(self._data['hospitals'].get(hospital_id, {"users": {}, "notes": []}))
 
     def get_all_hospitals(self) -> list:
         """Retrieves a list of all hospital IDs.
@@ -417,8 +1174,145 @@ class CareLogService:
         Returns:
             list: A list of hospital ID strings.
         """
-        return list(self._data['hospitals'].keys())
+        with self._locks.hospitals.read():
+            return list(self._data['hospitals'].keys())
+
+    @_transactional
+    def rekey_hospital(self, hospital_id: str) -> bool:
+        """Replaces a hospital's data key and re-encrypts only that hospital's data with it.
+
+        Args:
+            hospital_id (str): The ID of the hospital.
+
+        Returns:
+            bool: True if the hospital was re-keyed, False if it does not exist.
+        """
+        if hospital_id not in self._data['hospitals']:
+            return False
+        self._keyring.rekey(hospital_id)
+        self._save_data()
+        return True
+
+    def rotate_keys(self, data_keys: bool = True) -> dict:
+        """Starts an online key rotation.
+
+        Data keys that are not wrapped with the newest master key are re-wrapped and saved
+        right away; this is cheap, as no data is re-encrypted. If `data_keys` is set, every
+        hospital then gets a new data key and is re-encrypted by a background job, one
+        hospital per step with a pause between steps, so requests keep being served.
 
+        The rotation's progress is saved with the data (under `key_rotation`), so a restart
+        resumes it with the next pending hospital and every replica reports the same status.
+
+        Args:
+            data_keys (bool): Whether to replace the hospitals' data keys as well.
+
+        Returns:
+            dict: The rotation status, as returned by `get_key_rotation_status`.
+        """
+        with self._transaction():
+            rewrapped = self._keyring.rewrap()
+            hospitals = self.get_all_hospitals() if data_keys else []
+            started = datetime.now().isoformat()
+            # The status is replaced, never changed in place, so readers need no lock.
+            self._data['key_rotation'] = {
+                'rewrapped_keys': rewrapped,
+                'total': len(hospitals),
+                'done': 0,
+                'pending': hospitals,
+                'started_at': started,
+                'finished_at': None if hospitals else started,
+            }
+            self._save_data()
+        if hospitals:
+            self._schedule_rotation_step(delay=0.0)
+        return self.get_key_rotation_status()
+
+    def _schedule_rotation_step(self, delay: float = KEY_ROTATION_STEP_SECONDS):
+        """Queues the next step of the running key rotation."""
+        self._background.submit(('rotate-keys',), self._rotation_step, delay=delay, priority=KEY_ROTATION_PRIORITY)
+
+    def _rotation_step(self):
+        """Re-encrypts the next hospital of the running key rotation with a new data key.
+
+        The new key and the shortened pending list are saved in the same snapshot, so a
+        hospital is never re-keyed without its progress being recorded, or the reverse.
+        """
+        with self._transaction():
+            rotation = self._data.get('key_rotation')
+            if not rotation or not rotation['pending']:
+                return
+            hospital_id, pending = rotation['pending'][0], rotation['pending'][1:]
+            # Hospitals shredded since the rotation started are simply skipped.
+            if hospital_id in self._data['hospitals']:
+                with self._locks.write(hospital_id):
+                    self._keyring.rekey(hospital_id)
+            self._data['key_rotation'] = dict(
+                rotation, pending=pending, done=rotation['done'] + 1,
+                finished_at=None if pending else datetime.now().isoformat(),
+            )
+            self._save_data()
+        if pending:
+            self._schedule_rotation_step()
+
+    def get_key_rotation_status(self) -> dict:
+        """Reports the progress of the most recent key rotation.
+
+        Returns:
+            dict: `total` and `done` hospitals, the `pending` hospital IDs, the number of
+                  `rewrapped_keys`, and `started_at`/`finished_at` timestamps; or an empty
+                  dictionary if no rotation has been started.
+        """
+        rotation = self._data.get('key_rotation')
+        if rotation is None:
+            return {}
+        return dict(rotation, pending=list(rotation['pending']))
+
+    def retire_old_master_keys(self) -> bool:
+        """Removes every master key but the newest from the key file.
+
+        Refuses while any data key in use is still wrapped with an older master key, i.e.
+        until `rotate_keys` has re-wrapped them. Previous snapshot generations, which hold
+        the keys wrapped the old way, are discarded, as they could no longer be decrypted.
+
+        Returns:
+            bool: True if the old keys were retired, False if a data key still needs them.
+        """
+        with self._transaction():
+            try:
+                encryptor.retire_old_keys(self._keyring.wrapped_keys())
+            except ValueError as e:
+                print(f"Warning: Old master keys were not retired ({e}).")
+                return False
+            self._store.discard_previous_generations()
+        return True
+
+    def shred_hospital(self, hospital_id: str) -> bool:
+        """Irreversibly deletes a hospital by destroying its data key (crypto-shredding).
+
+        The hospital is removed from memory, its data key is forgotten, and previous snapshot
+        generations, which still hold the wrapped key, are discarded. Other hospitals are not
+        re-encrypted. Copies of older snapshots kept elsewhere (e.g. backups) remain readable
+        with the master key unless the key agent also destroys the hospital's key.
+
+        Args:
+            hospital_id (str): The ID of the hospital.
+
+        Returns:
+            bool: True if the hospital was shredded, False if it does not exist.
+        """
+        with self._transaction():
+            if hospital_id not in self._data['hospitals']:
+                return False
+            with self._locks.hospitals.write(), self._locks.write(hospital_id):
+                del self._data['hospitals'][hospital_id]
+                self._indexes.pop(hospital_id, None)
+            self._keyring.shred(hospital_id)
+            self._save_data()
+            self._store.discard_previous_generations()
+        return True
+
+    @_read_locked
     def get_pending_users(self, hospital_id: str, role: str) -> list:
         """Retrieves a list of users with a 'pending' status for a specific role.
 
@@ -429,13 +1323,9 @@ class CareLogService:
         Returns:
             list: A list of pending user data dictionaries.
         """
-        hospital_users = self._data['hospitals'].get(hospital_id, {}).get('users', {})
-        pending_users = []
-        for user_key, user_data in hospital_users.items():
-            if user_data.get('role') == role and user_data.get('status') == 'pending':
-                pending_users.append(user_data)
-        return pending_users
+        return self._index(hospital_id).records(role, 'pending')
 
+    @_transactional
     def approve_user(self, username: str, role: str, hospital_id: str) -> bool:
         """Approves a pending user, changing their status to 'approved'.
 
@@ -448,9 +1338,12 @@ class CareLogService:
             bool: True if successful, False otherwise.
         """
         hospital_users = self._data['hospitals'].get(hospital_id, {}).get('users', {})
+        index = self._index(hospital_id)
         user_key = f"{username}_{role}"
-        if user_key in hospital_users:
-            hospital_users[user_key]['status'] = 'approved'
+        if user_key in hospital_users and hospital_users[user_key].get('status') != DELETED_STATUS:
+            user_data = hospital_users[user_key]
+            index.update_status(user_key, user_data.get('role'), user_data.get('status'), 'approved')
+            user_data['status'] = 'approved'
             self._save_data()
             return True
         return False
@@ -467,9 +1360,19 @@ class CareLogService:
         Returns:
             bool: True if successful, False otherwise.
         """
+        password_fields = None
+        if 'new_password' in details and details['new_password']:
+            # Derive the new hash before taking the store lock; the KDF is deliberately slow.
+            password_fields = password_hasher.hash(details['new_password'])
+
+        with self._transaction(hospital_id):
+            return self._update_user_profile_locked(hospital_id, username, role, details, password_fields)
+
+    def _update_user_profile_locked(self, hospital_id: str, username: str, role: str, details: dict, password_fields: dict) -> bool:
+        """Implements `update_user_profile` once any new password is hashed and the store lock is held."""
         user_key = f"{username}_{role}"
         user_data = self._data['hospitals'].get(hospital_id, {}).get('users', {}).get(user_key)
-        if not user_data:
+        if not user_data or user_data.get('status') == DELETED_STATUS:
             return False
 
         # Update profile fields.
@@ -480,16 +1383,13 @@ class CareLogService:
         user_data['bio'] = details.get('bio', user_data.get('bio'))
 
         # Update password if a new one is provided.
-        if 'new_password' in details and details['new_password']:
-            salt = os.urandom(16).hex()
-            password_to_hash = salt + details['new_password']
-            password_hash = hashlib.sha256(password_to_hash.encode()).hexdigest()
-            user_data['salt'] = salt
-            user_data['password_hash'] = password_hash
+        if password_fields:
+            user_data.update(password_fields)
 
         self._save_data()
         return True
 
+    @_transactional
     def update_note(self, hospital_id: str, note_id: str, updated_data: dict) -> bool:
         """Updates the content of an existing note.
 
@@ -509,15 +1409,20 @@ class CareLogService:
                 return True
         return False
 
-    def delete_user(self, hospital_id: str, username: str, role: str) -> bool:
+    @_transactional
+    def delete_user(self, hospital_id: str, username: str, role: str, principal: User) -> bool:
         """Deletes a user and all their associated data.
 
-        This includes their notes, chat messages, and assignments.
+        The user is tombstoned immediately, which hides them, their notes, and their chat
+        messages from every read. The physical purge of their notes, chat messages, and
+        assignments runs later on the background worker, batched with any other deletions
+        made in the same hospital within `PURGE_DELAY_SECONDS`.
 
         Args:
             hospital_id (str): The ID of the hospital.
             username (str): The username of the user to delete.
             role (str): The role of the user to delete.
+            principal (User): The user making the request.
 
         Returns:
             bool: True if successful, False otherwise.
@@ -527,64 +1432,115 @@ class CareLogService:
             return False
 
         hospital_users = hospital.get('users', {})
+        index = self._index(hospital_id)
         user_key = f"{username}_{role}"
-        if user_key not in hospital_users:
+        user_data = hospital_users.get(user_key)
+        if not user_data or user_data.get('status') == DELETED_STATUS:
             return False
 
         # Prevent an admin from deleting their own account.
-        if self.current_user and self.current_user.username == username and self.current_user.role == role:
+        if principal and principal.username == username and principal.role == role:
             return False
 
-        del hospital_users[user_key]
+        index.tombstone(user_key, user_data)
+        user_data['status'] = DELETED_STATUS
+        user_data['deleted_at'] = datetime.now().isoformat()
+        self._save_data()
+        self._schedule_purge(hospital_id)
+        return True
 
-        # Clean up all associated data for the deleted user.
-        chats = hospital.setdefault('chats', {"general": {}, "direct": {}})
+    def _schedule_purge(self, hospital_id: str):
+        """Queues a purge of a hospital's deleted users; pending requests are coalesced."""
+        self._background.submit(('purge', hospital_id), lambda: self.purge_deleted_users(hospital_id), delay=PURGE_DELAY_SECONDS)
 
-        if role == 'patient':
-            # Remove patient's notes and chat history.
-            notes = hospital.get('notes', [])
-            hospital['notes'] = [n for n in notes if n.get('patient_id') != username]
-            chats.get('general', {}).pop(username, None)
-            chats.get('direct', {}).pop(username, None)
-        elif role == 'clinician':
-            # Remove clinician from patient assignments and delete their authored notes.
-            for data in hospital_users.values():
-                if data.get('role') == 'patient':
-                    assigned = data.get('assigned_clinicians', [])
-                    if assigned and username in assigned:
-                        assigned.remove(username)
-            notes = hospital.get('notes', [])
-            hospital['notes'] = [
-                n for n in notes
-                if not (n.get('author_id') == username and n.get('source') == 'clinician')
-            ]
-            # Remove clinician from all chat threads.
-            direct_threads = chats.get('direct', {})
-            for patient_username, threads in direct_threads.items():
-                if username in threads:
-                    del threads[username]
-            general_threads = chats.get('general', {})
-            for patient_username, messages in general_threads.items():
-                general_threads[patient_username] = [
-                    msg for msg in messages if msg.get('sender') != username
-                ]
-        else: # Admin
-            # Remove admin messages from all chat threads.
-            general_threads = chats.get('general', {})
+    @_transactional
+    def purge_deleted_users(self, hospital_id: str) -> int:
+        """Removes deleted users and all their associated data.
+
+        This includes their notes, chat messages, and assignments. Every deleted user of the
+        hospital is purged in a single pass over its notes and chat threads.
+
+        Args:
+            hospital_id (str): The ID of the hospital.
+
+        Returns:
+            int: The number of users purged.
+        """
+        purged = self._purge_deleted_users_locked(hospital_id)
+        if purged:
+            self._save_data()
+        return purged
+
+    def _purge_deleted_users_locked(self, hospital_id: str) -> int:
+        """Implements `purge_deleted_users` without saving; the hospital's write lock must be held."""
+        hospital = self._data['hospitals'].get(hospital_id)
+        if not hospital:
+            return 0
+        index = self._index(hospital_id)
+        tombstones = index.tombstones()
+        if not tombstones:
+            return 0
+
+        hospital_users = hospital['users']
+        deleted = [hospital_users[user_key] for user_key in tombstones]
+        patients = {u.get('username') for u in deleted if u.get('role') == 'patient'}
+        clinicians = {u.get('username') for u in deleted if u.get('role') == 'clinician'}
+        senders = {u.get('username') for u in deleted if u.get('role') != 'patient'}
+
+        # Remove patients' notes and clinicians' authored notes.
+        hospital['notes'] = [
+            n for n in hospital.get('notes', [])
+            if n.get('patient_id') not in patients
+            and not (n.get('source') == 'clinician' and n.get('author_id') in clinicians)
+        ]
+
+        # Remove clinicians from patient assignments (the index already excludes them).
+        if clinicians:
+            for patient_data in index.records('patient'):
+                assigned = patient_data.get('assigned_clinicians')
+                if assigned and not clinicians.isdisjoint(assigned):
+                    patient_data['assigned_clinicians'] = [c for c in assigned if c not in clinicians]
+
+        # Remove patients' chat history, clinicians' threads, and staff messages.
+        chats = hospital.setdefault('chats', {"general": {}, "direct": {}})
+        general_threads = chats.setdefault('general', {})
+        direct_threads = chats.setdefault('direct', {})
+        for patient_username in patients:
+            general_threads.pop(patient_username, None)
+            direct_threads.pop(patient_username, None)
+        if senders:
             for patient_username, messages in general_threads.items():
-                general_threads[patient_username] = [
-                    msg for msg in messages if msg.get('sender') != username
-                ]
-            direct_threads = chats.get('direct', {})
-            for patient_username, threads in direct_threads.items():
-                for clinician_username, messages in list(threads.items()):
-                    threads[clinician_username] = [
-                        msg for msg in messages if msg.get('sender') != username
-                    ]
+                general_threads[patient_username] = [msg for msg in messages if msg.get('sender') not in senders]
+            for threads in direct_threads.values():
+                for clinician_username in clinicians:
+                    threads.pop(clinician_username, None)
+                for clinician_username, messages in threads.items():
+                    threads[clinician_username] = [msg for msg in messages if msg.get('sender') not in senders]
 
-        self._save_data()
-        return True
+        # Remove patients' cached history summaries.
+        summaries = hospital.get('summaries', {})
+        for patient_username in patients:
+            summaries.pop(patient_username, None)
+
+        for user_key in tombstones:
+            index.remove_user(user_key, hospital_users.pop(user_key))
+        return len(tombstones)
+
+    def wait_for_background_jobs(self, timeout: float = None) -> bool:
+        """Runs queued background jobs (purges, speculative feedback) now and waits for them to finish.
+
+        Args:
+            timeout (float, optional): The maximum time to wait, in seconds.
+
+        Returns:
+            bool: True if all jobs finished, False on timeout.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        if not self._background.drain(timeout):
+            return False
+        return self._speculative.drain(None if deadline is None else max(0.0, deadline - time.monotonic()))
 
+    @_read_locked
     def get_all_clinicians(self, hospital_id: str) -> list:
         """Retrieves a list of all approved clinicians in a hospital.
 
@@ -594,9 +1550,9 @@ class CareLogService:
         Returns:
             list: A list of clinician user data dictionaries.
         """
-        hospital_users = self._data['hospitals'].get(hospital_id, {}).get('users', {})
-        return [data for data in hospital_users.values() if data.get('role') == 'clinician' and data.get('status') == 'approved']
+        return self._index(hospital_id).records('clinician', 'approved')
 
+    @_read_locked
     def get_assigned_clinicians_for_patient(self, hospital_id: str, patient_username: str) -> list:
         """Retrieves the list of clinicians assigned to a specific patient.
 
@@ -609,8 +1565,13 @@ class CareLogService:
         """
         patient_key = f"{patient_username}_patient"
         patient_data = self._data['hospitals'].get(hospital_id, {}).get('users', {}).get(patient_key, {})
-        return patient_data.get('assigned_clinicians', []) or []
+        index = self._index(hospital_id)
+        if index.is_deleted(patient_username, 'patient'):
+            return []
+        assigned = patient_data.get('assigned_clinicians', []) or []
+        return [c for c in assigned if not index.is_deleted(c, 'clinician')]
 
+    @_transactional
     def assign_clinician_to_patient(self, hospital_id: str, patient_username: str, clinician_username: str) -> bool:
         """Assigns a clinician to a patient.
 
@@ -624,15 +1585,20 @@ class CareLogService:
         """
         patient_key = f"{patient_username}_patient"
         patient_data = self._data['hospitals'].get(hospital_id, {}).get('users', {}).get(patient_key)
+        index = self._index(hospital_id)
+        if index.is_deleted(patient_username, 'patient') or index.is_deleted(clinician_username, 'clinician'):
+            return False
         if patient_data:
             if 'assigned_clinicians' not in patient_data:
                 patient_data['assigned_clinicians'] = []
             if clinician_username not in patient_data['assigned_clinicians']:
                 patient_data['assigned_clinicians'].append(clinician_username)
+                index.assign(patient_username, clinician_username)
                 self._save_data()
                 return True
         return False
 
+    @_transactional
     def unassign_clinician_from_patient(self, hospital_id: str, patient_username: str, clinician_username: str) -> bool:
         """Unassigns a clinician from a patient.
 
@@ -647,24 +1613,28 @@ class CareLogService:
         patient_key = f"{patient_username}_patient"
         patient_data = self._data['hospitals'].get(hospital_id, {}).get('users', {}).get(patient_key)
         if patient_data and 'assigned_clinicians' in patient_data:
+            index = self._index(hospital_id)
             if clinician_username in patient_data['assigned_clinicians']:
                 patient_data['assigned_clinicians'].remove(clinician_username)
+                index.unassign(patient_username, clinician_username)
                 self._save_data()
                 return True
         return False
 
-    def search_notes(self, hospital_id: str, patient_id: str, search_term: str) -> list:
+    @_read_locked
+    def search_notes(self, hospital_id: str, patient_id: str, search_term: str, principal: User) -> list:
         """Searches a patient's notes for a given term.
 
         Args:
             hospital_id (str): The ID of the hospital.
             patient_id (str): The ID of the patient.
             search_term (str): The term to search for.
+            principal (User): The user making the request.
 
         Returns:
             list: A list of matching note dictionaries.
         """
-        all_notes = self.get_notes_for_patient(hospital_id, patient_id)
+        all_notes = self.get_notes_for_patient(hospital_id, patient_id, principal)
         if not search_term:
             return all_notes
         
@@ -677,6 +1647,7 @@ class CareLogService:
 
         return [note for note in all_notes if note_matches(note)]
 
+    @_read_locked
     def get_pain_alerts(self, hospital_id: str) -> list:
         """Retrieves all active pain alerts for a hospital.
 
@@ -687,8 +1658,10 @@ class CareLogService:
             list: A list of alert dictionaries.
         """
         alerts = self._data['hospitals'].get(hospital_id, {}).get('alerts', [])
-        return alerts
+        index = self._index(hospital_id)
+        return [a for a in alerts if not index.is_deleted(a.get('patient_id'), 'patient')]
 
+    @_transactional
     def dismiss_alert(self, hospital_id: str, alert_id: str) -> bool:
         """Dismisses a pain alert.
 
@@ -702,4 +1675,61 @@ class CareLogService:
         alerts = self._data['hospitals'].get(hospital_id, {}).get('alerts', [])
         self._data['hospitals'][hospital_id]['alerts'] = [a for a in alerts if a.get('alert_id') != alert_id]
         self._save_data()
-        return True
\ No newline at end of file
+        return True
+
+    def get_load_metrics(self) -> dict:
+        """Reports how long the most recent snapshot load took, by phase.
+
+        Returns:
+            dict: The snapshot size in `bytes`, the number of `segments` and decoding
+                  `workers`, and `read_seconds` (reading and verifying the file),
+                  `decode_seconds` (decrypting and parsing), `merge_seconds`,
+                  `hydrate_seconds` (building records), and `total_seconds`, plus
+                  `pool_seconds` (starting the workers, before the load) when a pool was
+                  used at startup; or an empty dictionary if nothing has been loaded.
+        """
+        return dict(self._load_metrics)
+
+    def get_ai_usage(self, hospital_id: str = None) -> dict:
+        """Reports the language model usage counted by the rate limiter since startup.
+
+        Args:
+            hospital_id (str, optional): The hospital to report; all hospitals if omitted.
+
+        Returns:
+            dict: Counts of `requests`, estimated `prompt_tokens` and `completion_tokens`,
+                  `queued` requests and `queued_seconds`, `rejected` requests with the
+                  `retry_after_seconds` of the last rejection, `failures`, and the
+                  `last_request` time; or a dictionary of them by hospital ID.
+        """
+        return self._ai_limiter.usage(hospital_id)
+
+    def get_speculative_feedback_usage(self, hospital_id: str) -> dict:
+        """Reports today's speculative feedback spend of a hospital.
+
+        Args:
+            hospital_id (str): The ID of the hospital.
+
+        Returns:
+            dict: The `enabled` setting, the estimated `tokens` spent and `calls` made today,
+                  the calls `skipped` over the budget, and the daily token `limit`.
+        """
+        return dict(self._speculative_budget.usage(hospital_id), enabled=SPECULATIVE_FEEDBACK)
+
+    def get_model_client_metrics(self) -> dict:
+        """Reports the health of the language model client since startup.
+
+        Returns:
+            dict: The `ResilientProvider` metrics: call, retry, hedge, timeout, and failure
+                  counts, the circuit `breaker` state, and recent latency percentiles; empty
+                  until the first model call.
+        """
+        return client_metrics()
+
+    def get_lock_metrics(self) -> dict:
+        """Retrieves contention metrics for the hospital map lock and every hospital lock.
+
+        Returns:
+            dict: Per-lock acquisition counts, contended counts, and wait times in seconds.
+        """
+        return self._locks.metrics()
@@ -0,0 +1,155 @@
+"""
+This module provides a small background job runner for deferred maintenance work.
+
+It defines the `BackgroundWorker` class, which runs queued jobs on a single daemon thread:
+- Jobs are keyed; submitting a job whose key is already queued does not queue it again,
+  so bursts of requests for the same work are coalesced into one run.
+- Jobs may be delayed, which gives related requests time to be batched together.
+- Jobs run in priority order (lower numbers first), then in submission order; due jobs wait
+  in a heap keyed on `(priority, sequence)` and delayed ones in a heap keyed on their due time.
+- A worker may cap its pending jobs; submissions beyond the cap are dropped and counted.
+- `drain` runs everything that is queued, ignoring delays, which keeps tests deterministic.
+
+A job that raises is logged and dropped; it never stops the worker.
+"""
+# carelog/modules/background.py
+
+import heapq
+import itertools
+import threading
+import time
+import traceback
+
+
+class BackgroundWorker:
+    """Runs keyed, coalesced, optionally delayed jobs on a daemon thread."""
+
+    def __init__(self, name: str = 'carelog-background', max_pending: int = None):
+        """Initializes the worker; its thread is started on the first submission.
+
+        Args:
+            name (str): The name of the worker thread.
+            max_pending (int, optional): The most jobs that may wait at once; unlimited if None.
+        """
+        self.name = name
+        self.max_pending = max_pending
+        self._cond = threading.Condition()
+        # Due jobs as `(priority, sequence, key, job)`, and delayed ones as `(due, sequence, priority, key, job)`.
+        self._ready = []
+        self._delayed = []
+        self._queued = set()
+        self._sequence = itertools.count()
+        self._thread = None
+        self._running = 0
+        self._draining = 0
+        self._stopped = False
+        self._metrics = {'submitted': 0, 'coalesced': 0, 'dropped': 0, 'completed': 0, 'failed': 0}
+
+    def submit(self, key, job, delay: float = 0.0, priority: int = 0) -> bool:
+        """Queues a job unless one with the same key is already waiting.
+
+        Args:
+            key: Identifies the work; pending jobs with an equal key are coalesced.
+            job (callable): The function to run, called without arguments.
+            delay (float): Seconds to wait before the job may run.
+            priority (int): Lower values run first among jobs that are due.
+
+        Returns:
+            bool: True if the job was queued, False if it was coalesced, the queue is full, or
+                  the worker is stopped.
+        """
+        with self._cond:
+            if self._stopped:
+                return False
+            if key in self._queued:
+                self._metrics['coalesced'] += 1
+                return False
+            if self.max_pending is not None and len(self._queued) >= self.max_pending:
+                self._metrics['dropped'] += 1
+                return False
+            self._queued.add(key)
+            if delay > 0:
+                heapq.heappush(self._delayed, (time.monotonic() + delay, next(self._sequence), priority, key, job))
+            else:
+                heapq.heappush(self._ready, (priority, next(self._sequence), key, job))
+            self._metrics['submitted'] += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+            return True
+
+    def pending(self) -> int:
+        """Returns the number of queued jobs that have not started yet."""
+        with self._cond:
+            return len(self._queued)
+
+    def drain(self, timeout: float = None) -> bool:
+        """Runs all queued jobs immediately, regardless of their delay, and waits for them.
+
+        Args:
+            timeout (float, optional): The maximum time to wait, in seconds.
+
+        Returns:
+            bool: True if the queue is empty and no job is running, False on timeout.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._draining += 1
+            self._cond.notify_all()
+            try:
+                while self._queued or self._running:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+                return True
+            finally:
+                self._draining -= 1
+
+    def shutdown(self, timeout: float = None):
+        """Drains the queue and stops accepting new jobs."""
+        self.drain(timeout)
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+
+    def metrics(self) -> dict:
+        """Returns counts of submitted, coalesced, dropped, completed, and failed jobs, and the queue length."""
+        with self._cond:
+            return dict(self._metrics, pending=len(self._queued))
+
+    def _next_job(self):
+        """Waits for the next due job and removes it from the queue; returns None once stopped."""
+        with self._cond:
+            while True:
+                if self._stopped and not self._queued:
+                    return None
+                now = time.monotonic()
+                while self._delayed and (self._draining or self._delayed[0][0] <= now):
+                    _, sequence, priority, key, job = heapq.heappop(self._delayed)
+                    heapq.heappush(self._ready, (priority, sequence, key, job))
+                if self._ready:
+                    entry = heapq.heappop(self._ready)
+                    self._queued.discard(entry[2])
+                    self._running += 1
+                    return entry
+                self._cond.wait(self._delayed[0][0] - now if self._delayed else None)
+
+    def _run(self):
+        """The worker thread's main loop."""
+        while True:
+            entry = self._next_job()
+            if entry is None:
+                return
+            try:
+                entry[3]()
+                outcome = 'completed'
+            except Exception:
+                print(f"Warning: Background job {entry[2]!r} failed.")
+                traceback.print_exc()
+                outcome = 'failed'
+            with self._cond:
+                self._running -= 1
+                self._metrics[outcome] += 1
+                self._cond.notify_all()
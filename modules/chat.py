@@ -7,7 +7,9 @@ It provides functionalities for:
 - Ensuring the underlying data structures for chat are correctly initialized within the main data store.
 - Listing active chat threads for users.
 
-The `ChatService` is tightly integrated with the main `CareLogService` to access and persist chat data.
+The `ChatService` is tightly integrated with the main `CareLogService` to access and persist chat data;
+every write runs inside the service's store transaction, and reads hold the hospital's lock for reading
+without modifying the data store.
 """
 # carelog/modules/chat.py
 
@@ -17,6 +19,8 @@ from datetime import datetime
 import uuid
 from typing import Dict, List, Optional
 
+from modules.models import MessageRecord
+
 
 class ChatService:
     """Manages patient-clinician conversations, including general and direct channels."""
@@ -32,23 +36,36 @@ class ChatService:
     def _ensure_chat_store(self, hospital_id: str) -> Dict[str, Dict]:
         """Ensures the base chat structure exists for a hospital and returns it."""
         hospitals = self._service._data.setdefault('hospitals', {})
-        hospital = hospitals.setdefault(
-            hospital_id,
-            {
-                "users": {},
-                "notes": [],
-                "alerts": [],
-                "chats": {
-                    "general": {},
-                    "direct": {}
-                }
-            }
-        )
+        hospital = hospitals.get(hospital_id)
+        if hospital is None:
+            with self._service._locks.hospitals.write():
+                hospital = hospitals.setdefault(
+                    hospital_id,
+                    {
+                        "users": {},
+                        "notes": [],
+                        "alerts": [],
+                        "chats": {
+                            "general": {},
+                            "direct": {}
+                        }
+                    }
+                )
         chats = hospital.setdefault('chats', {})
         chats.setdefault('general', {})
         chats.setdefault('direct', {})
         return chats
 
+    def _get_chat_store(self, hospital_id: str) -> Dict[str, Dict]:
+        """Returns a hospital's chat structure without creating it (for read-only access)."""
+        hospital = self._service._data.get('hospitals', {}).get(hospital_id, {})
+        return hospital.get('chats', {})
+
+    @staticmethod
+    def _visible_messages(index, messages: List[Dict]) -> List[Dict]:
+        """Filters out messages from deleted users that are awaiting purge."""
+        return [m for m in messages if not index.is_deleted(m.get('sender'), m.get('sender_role'))]
+
     def _ensure_general_thread(self, hospital_id: str, patient_username: str) -> List[Dict]:
         """Ensures a general chat thread exists for a patient and returns it."""
         chats = self._ensure_chat_store(hospital_id)
@@ -86,16 +103,17 @@ class ChatService:
         if not text:
             return None
 
-        thread = self._ensure_general_thread(hospital_id, patient_username)
-        entry = self._build_message(
-            sender_username,
-            sender_role,
-            text,
-            channel="general",
-            patient_username=patient_username
-        )
-        thread.append(entry)
-        self._service._save_data()
+        with self._service._transaction(hospital_id):
+            thread = self._ensure_general_thread(hospital_id, patient_username)
+            entry = self._build_message(
+                sender_username,
+                sender_role,
+                text,
+                channel="general",
+                patient_username=patient_username
+            )
+            thread.append(entry)
+            self._service._save_data()
         return entry
 
     def clear_general_messages(self, hospital_id: str, patient_username: str) -> bool:
@@ -108,12 +126,13 @@ class ChatService:
         Returns:
             True if messages were cleared, False otherwise.
         """
-        chats = self._ensure_chat_store(hospital_id)
-        general = chats.setdefault('general', {})
-        if patient_username in general:
-            general[patient_username] = []
-            self._service._save_data()
-            return True
+        with self._service._transaction(hospital_id):
+            chats = self._ensure_chat_store(hospital_id)
+            general = chats.setdefault('general', {})
+            if patient_username in general:
+                general[patient_username] = []
+                self._service._save_data()
+                return True
         return False
 
     def get_general_messages(
@@ -132,7 +151,11 @@ class ChatService:
         Returns:
             A sorted list of message dictionaries.
         """
-        thread = list(self._ensure_general_thread(hospital_id, patient_username))
+        with self._service._locks.read(hospital_id):
+            index = self._service._index(hospital_id)
+            if index.is_deleted(patient_username, 'patient'):
+                return []
+            thread = self._visible_messages(index, self._get_chat_store(hospital_id).get('general', {}).get(patient_username, []))
         thread.sort(key=lambda item: item.get("timestamp", ""))
         if limit is not None:
             return thread[-limit:]
@@ -165,22 +188,23 @@ class ChatService:
         if not text:
             return None
 
-        # Ensure the clinician is assigned to the patient before allowing a direct message.
-        assigned = self._service.get_assigned_clinicians_for_patient(hospital_id, patient_username)
-        if assigned and clinician_username not in assigned:
-            return None
-
-        thread = self._ensure_direct_thread(hospital_id, patient_username, clinician_username)
-        entry = self._build_message(
-            sender_username,
-            sender_role,
-            text,
-            channel="direct",
-            patient_username=patient_username,
-            clinician_username=clinician_username
-        )
-        thread.append(entry)
-        self._service._save_data()
+        with self._service._transaction(hospital_id):
+            # Ensure the clinician is assigned to the patient before allowing a direct message.
+            assigned = self._service.get_assigned_clinicians_for_patient(hospital_id, patient_username)
+            if assigned and clinician_username not in assigned:
+                return None
+
+            thread = self._ensure_direct_thread(hospital_id, patient_username, clinician_username)
+            entry = self._build_message(
+                sender_username,
+                sender_role,
+                text,
+                channel="direct",
+                patient_username=patient_username,
+                clinician_username=clinician_username
+            )
+            thread.append(entry)
+            self._service._save_data()
         return entry
 
     def get_direct_messages(
@@ -201,7 +225,12 @@ class ChatService:
         Returns:
             A sorted list of message dictionaries.
         """
-        thread = list(self._ensure_direct_thread(hospital_id, patient_username, clinician_username))
+        with self._service._locks.read(hospital_id):
+            index = self._service._index(hospital_id)
+            if index.is_deleted(patient_username, 'patient') or index.is_deleted(clinician_username, 'clinician'):
+                return []
+            direct = self._get_chat_store(hospital_id).get('direct', {})
+            thread = self._visible_messages(index, direct.get(patient_username, {}).get(clinician_username, []))
         thread.sort(key=lambda item: item.get("timestamp", ""))
         if limit is not None:
             return thread[-limit:]
@@ -218,13 +247,14 @@ class ChatService:
         Returns:
             True if the thread was cleared, False otherwise.
         """
-        chats = self._ensure_chat_store(hospital_id)
-        direct = chats.setdefault('direct', {})
-        patient_threads = direct.setdefault(patient_username, {})
-        if clinician_username in patient_threads:
-            patient_threads[clinician_username] = []
-            self._service._save_data()
-            return True
+        with self._service._transaction(hospital_id):
+            chats = self._ensure_chat_store(hospital_id)
+            direct = chats.setdefault('direct', {})
+            patient_threads = direct.setdefault(patient_username, {})
+            if clinician_username in patient_threads:
+                patient_threads[clinician_username] = []
+                self._service._save_data()
+                return True
         return False
 
     def list_general_patients(self, hospital_id: str) -> List[str]:
@@ -236,12 +266,15 @@ class ChatService:
         Returns:
             A list of patient usernames.
         """
-        chats = self._ensure_chat_store(hospital_id)
-        general = chats.get('general', {})
         patients = []
-        for patient_username, messages in general.items():
-            last_ts = messages[-1].get("timestamp") if messages else ""
-            patients.append((patient_username, last_ts))
+        with self._service._locks.read(hospital_id):
+            index = self._service._index(hospital_id)
+            general = self._get_chat_store(hospital_id).get('general', {})
+            for patient_username, messages in general.items():
+                if index.is_deleted(patient_username, 'patient'):
+                    continue
+                last_ts = messages[-1].get("timestamp") if messages else ""
+                patients.append((patient_username, last_ts))
         patients.sort(key=lambda item: item[1] or "", reverse=True)
         return [username for username, _ in patients]
 
@@ -255,14 +288,15 @@ class ChatService:
         Returns:
             A list of patient usernames.
         """
-        chats = self._ensure_chat_store(hospital_id)
-        direct = chats.get('direct', {})
         patients = []
-        for patient_username, clinician_threads in direct.items():
-            if clinician_username in clinician_threads:
-                messages = clinician_threads[clinician_username]
-                last_ts = messages[-1].get("timestamp") if messages else ""
-                patients.append((patient_username, last_ts))
+        with self._service._locks.read(hospital_id):
+            index = self._service._index(hospital_id)
+            direct = self._get_chat_store(hospital_id).get('direct', {})
+            for patient_username, clinician_threads in direct.items():
+                if clinician_username in clinician_threads and not index.is_deleted(patient_username, 'patient'):
+                    messages = clinician_threads[clinician_username]
+                    last_ts = messages[-1].get("timestamp") if messages else ""
+                    patients.append((patient_username, last_ts))
         patients.sort(key=lambda item: item[1] or "", reverse=True)
         return [username for username, _ in patients]
 
@@ -276,15 +310,15 @@ class ChatService:
             **extra: Additional metadata to include in the message dictionary.
 
         Returns:
-            A dictionary representing the structured chat message.
+            A `MessageRecord` representing the structured chat message.
         """
         timestamp = datetime.utcnow().replace(microsecond=0).isoformat() + "Z"
-        message = {
+        message = MessageRecord.from_dict({
             "message_id": str(uuid.uuid4()),
             "timestamp": timestamp,
             "sender": sender_username,
             "sender_role": sender_role,
             "text": text
-        }
+        })
         message.update(extra)
         return message
\ No newline at end of file
@@ -6,42 +6,376 @@ the data at rest (`records.json`) is secure. The module is responsible for:
 - Generating a secret key for encryption if one does not already exist.
 - Storing and loading the secret key from a file named `secret.key`.
 - Providing a global `encryptor` object that can be used throughout the application
-  for consistent encryption and decryption operations.
+  for consistent encryption and decryption operations. It reads (or creates) the key file
+  on first use, not at import, so importing the application costs no file access.
+- Versioning the master key: `secret.key` holds one key per line, newest first. New data is
+  encrypted with the newest key and every listed key can decrypt (like `MultiFernet`), so a
+  key can be rotated in with `python -m modules.encryption rotate` without downtime.
+- Envelope encryption: a `KeyAgent` holds the master key and wraps per-hospital data keys,
+  which a `DataKeyring` creates, stores only in wrapped form, and caches unwrapped in memory.
+  A single hospital can then be re-keyed or crypto-shredded without re-encrypting the others.
 
 Security Note: The `secret.key` file is critical. It must be kept secure and should not be
 committed to version control. It is recommended to add `secret.key` to the `.gitignore` file.
 """
 # carelog/modules/encryption.py
 
-from cryptography.fernet import Fernet
+import os
+import sys
+import threading
+import uuid
 
-def write_key():
-    """Generates a new Fernet key and saves it to the 'secret.key' file."""
+from cryptography.fernet import Fernet, InvalidToken
+
+KEY_FILE = 'secret.key'
+
+# Owner of the data key that encrypts the container index and top-level fields.
+STORE_KEY_OWNER = ''
+
+
+def write_key(path: str = KEY_FILE):
+    """Generates a new Fernet key and saves it to the 'secret.key' file.
+
+    Args:
+        path (str): The key file to write.
+    """
     key = Fernet.generate_key()
-    with open("secret.key", "wb") as key_file:
+    with open(path, "wb") as key_file:
         key_file.write(key)
 
+def load_keys(path: str = KEY_FILE) -> list:
+    """Loads every master key from a key file, newest first.
+
+    Args:
+        path (str): The key file, holding one key per line.
+
+    Returns:
+        list: The keys as bytes.
+    """
+    with open(path, "rb") as key_file:
+        return [line.strip() for line in key_file.read().splitlines() if line.strip()]
+
 def load_key() -> bytes:
-    """Loads the Fernet key from the 'secret.key' file.
+    """Loads the newest Fernet key from the 'secret.key' file.
 
     Returns:
         bytes: The encryption key.
     """
-    return open("secret.key", "rb").read()
-
-# On first run, generate and save a key if it doesn't exist.
-# This ensures the application is ready to use immediately after setup.
-try:
-    key = load_key()
-except FileNotFoundError:
-    print("Encryption key not found. Generating a new one...")
-    write_key()
-    key = load_key()
-    print("New encryption key 'secret.key' has been generated.")
-
-# Create a global Fernet instance to be used for all encryption/decryption.
-encryptor = Fernet(key)
-
-# This allows the script to be run directly to generate a key if needed.
+    return load_keys()[0]
+
+
+class MasterKeys:
+    """The versioned master key, read from a key file.
+
+    Like `MultiFernet`, it encrypts with the newest key and decrypts with any listed key.
+    When a token matches none of them, the key file is re-read once, so a key rotated in by
+    another process is picked up without a restart. The key file is first read when a key
+    is needed, not when the object is created.
+    """
+
+    def __init__(self, path: str = KEY_FILE, create: bool = False):
+        """Initializes the keys without reading the key file.
+
+        Args:
+            path (str): The key file, holding one key per line, newest first.
+            create (bool): Whether to generate the key file on first use if it does not exist.
+        """
+        self.path = path
+        self.create = create
+        self._lock = threading.Lock()
+        self._fernets = None
+        self._stamp = None
+
+    @property
+    def versions(self) -> int:
+        """The number of key versions available for decryption."""
+        return len(self._loaded())
+
+    def _loaded(self) -> list:
+        """Returns the ciphers of every key, newest first, reading the key file on first use."""
+        fernets = self._fernets
+        if fernets is None:
+            self.reload()
+            fernets = self._fernets
+        return fernets
+
+    def reload(self) -> bool:
+        """Re-reads the key file if it changed.
+
+        Returns:
+            bool: True if the keys were reloaded.
+        """
+        if self.create and not os.path.exists(self.path):
+            with self._lock:
+                if not os.path.exists(self.path):
+                    print("Encryption key not found. Generating a new one...")
+                    write_key(self.path)
+                    print(f"New encryption key '{self.path}' has been generated.")
+        st = os.stat(self.path)
+        stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+        with self._lock:
+            if stamp == self._stamp:
+                return False
+            self._fernets = [Fernet(key) for key in load_keys(self.path)]
+            self._stamp = stamp
+            return True
+
+    def encrypt(self, data: bytes) -> bytes:
+        """Encrypts data with the newest key."""
+        return self._loaded()[0].encrypt(data)
+
+    def decrypt(self, token: bytes) -> bytes:
+        """Decrypts a token with whichever key encrypted it.
+
+        Raises:
+            InvalidToken: If no listed key can decrypt the token.
+        """
+        for attempt in range(2):
+            for fernet in self._loaded():
+                try:
+                    return fernet.decrypt(token)
+                except InvalidToken:
+                    continue
+            if attempt or not self.reload():
+                break
+        raise InvalidToken
+
+    def is_current(self, token: bytes) -> bool:
+        """Checks whether a token is encrypted with the newest key."""
+        try:
+            self._loaded()[0].decrypt(token)
+        except InvalidToken:
+            return False
+        return True
+
+    def rotate(self, token: bytes) -> bytes:
+        """Re-encrypts a token with the newest key."""
+        return self.encrypt(self.decrypt(token))
+
+    def add_key(self) -> bytes:
+        """Generates a new key, makes it the newest in the key file, and starts using it.
+
+        Returns:
+            bytes: The new key.
+        """
+        key = Fernet.generate_key()
+        self._write([key] + load_keys(self.path))
+        return key
+
+    def retire_old_keys(self, wrapped_keys):
+        """Removes every key but the newest from the key file.
+
+        Only do this once nothing encrypted with an older key remains, including older
+        snapshot generations and backups.
+
+        Args:
+            wrapped_keys: Every data key currently wrapped with the master key.
+
+        Raises:
+            ValueError: If any of `wrapped_keys` is still wrapped with an older key; the key
+                        file is then left unchanged.
+        """
+        stale = sum(1 for token in wrapped_keys if not self.is_current(token))
+        if stale:
+            raise ValueError(f"{stale} data keys are still wrapped with an older master key.")
+        self._write(load_keys(self.path)[:1])
+
+    def _write(self, keys: list):
+        """Atomically replaces the key file and reloads it."""
+        tmp_path = f"{self.path}.tmp-{os.getpid()}"
+        with open(tmp_path, "wb") as key_file:
+            key_file.write(b"\n".join(keys) + b"\n")
+            key_file.flush()
+            os.fsync(key_file.fileno())
+        os.replace(tmp_path, self.path)
+        self.reload()
+
+
+# Create a global instance to be used for all encryption/decryption. On first run, the key
+# is generated when it is first needed, so the application is ready to use immediately after
+# setup while tools that never encrypt anything do not touch the key file.
+encryptor = MasterKeys(os.path.abspath(KEY_FILE), create=True)
+
+
+class KeyAgent:
+    """A local stand-in for a key-management agent that holds the master key.
+
+    Only `wrap` and `unwrap` are used by the rest of the application, so this class can be
+    replaced by a client for an external agent or KMS and the master key kept off the app host.
+    """
+
+    def __init__(self, master):
+        """Initializes the agent.
+
+        Args:
+            master: The master cipher (e.g. the global `encryptor`).
+        """
+        self._master = master
+
+    def wrap(self, key: bytes) -> bytes:
+        """Encrypts a data key with the master key."""
+        return self._master.encrypt(key)
+
+    def unwrap(self, wrapped: bytes) -> bytes:
+        """Decrypts a data key (or a payload written before envelope encryption) with the master key."""
+        return self._master.decrypt(wrapped)
+
+    def rewrap(self, wrapped: bytes):
+        """Re-wraps a data key with the newest master key.
+
+        Returns:
+            bytes or None: The re-wrapped key, or None if it is already wrapped with the newest
+                           master key (or the master key is not versioned).
+        """
+        if not hasattr(self._master, 'is_current') or self._master.is_current(wrapped):
+            return None
+        return self._master.rotate(wrapped)
+
+
+class DataKeyring:
+    """Manages per-owner data keys (one per hospital, plus one for the store index).
+
+    Keys are identified by random key ids. Only their wrapped form is persisted, next to the
+    data they encrypt; unwrapped keys are cached as ciphers for the life of the process.
+    """
+
+    def __init__(self, agent: KeyAgent):
+        """Initializes an empty keyring.
+
+        Args:
+            agent (KeyAgent): The agent that wraps and unwraps data keys.
+        """
+        self.agent = agent
+        self._lock = threading.Lock()
+        self._wrapped = {}
+        self._owners = {}
+        self._keys = {}
+        self._ciphers = {}
+
+    def key_id(self, owner: str) -> str:
+        """Returns the id of an owner's current data key, creating the key if it has none.
+
+        Args:
+            owner (str): A hospital ID, or `STORE_KEY_OWNER`.
+
+        Returns:
+            str: The key id.
+        """
+        with self._lock:
+            key_id = self._owners.get(owner)
+            if key_id is None:
+                key = Fernet.generate_key()
+                key_id = uuid.uuid4().hex
+                self._wrapped[key_id] = self.agent.wrap(key)
+                self._keys[key_id] = key
+                self._ciphers[key_id] = Fernet(key)
+                self._owners[owner] = key_id
+            return key_id
+
+    def key(self, key_id: str) -> bytes:
+        """Returns an unwrapped data key, unwrapping it on first use.
+
+        Raises:
+            ValueError: If the key is unknown, e.g. because it was shredded.
+        """
+        key = self._keys.get(key_id)
+        if key is None:
+            wrapped = self._wrapped.get(key_id)
+            if wrapped is None:
+                raise ValueError(f"Data key '{key_id}' is not available.")
+            key = self.agent.unwrap(wrapped)
+            with self._lock:
+                key = self._keys.setdefault(key_id, key)
+        return key
+
+    def cipher(self, key_id: str):
+        """Returns the cipher for a data key, unwrapping the key on first use.
+
+        Raises:
+            ValueError: If the key is unknown, e.g. because it was shredded.
+        """
+        cipher = self._ciphers.get(key_id)
+        if cipher is None:
+            cipher = Fernet(self.key(key_id))
+            with self._lock:
+                cipher = self._ciphers.setdefault(key_id, cipher)
+        return cipher
+
+    def owner_cipher(self, owner: str):
+        """Returns the cipher for an owner's current data key, creating the key if needed."""
+        return self.cipher(self.key_id(owner))
+
+    def load(self, wrapped: dict, owners: dict = None):
+        """Adopts the keys stored with a loaded snapshot.
+
+        Args:
+            wrapped (dict): Wrapped keys by key id.
+            owners (dict, optional): Current key ids by owner; replaces the owners known so far.
+        """
+        with self._lock:
+            self._wrapped.update(wrapped)
+            if owners is not None:
+                self._owners = dict(owners)
+
+    def export(self, owners) -> tuple:
+        """Returns the keys to store with a snapshot that contains data of the given owners.
+
+        Args:
+            owners: The owners whose current keys are in use.
+
+        Returns:
+            tuple: `(wrapped, owners)` dictionaries, as accepted by `load`.
+        """
+        with self._lock:
+            current = {owner: self._owners[owner] for owner in owners if owner in self._owners}
+            return {key_id: self._wrapped[key_id] for key_id in current.values()}, current
+
+    def wrapped_keys(self) -> list:
+        """Returns the wrapped form of every owner's current data key."""
+        with self._lock:
+            return [self._wrapped[key_id] for key_id in self._owners.values() if key_id in self._wrapped]
+
+    def rekey(self, owner: str) -> str:
+        """Replaces an owner's data key; data written afterwards is encrypted with the new key."""
+        with self._lock:
+            self._owners.pop(owner, None)
+        return self.key_id(owner)
+
+    def rewrap(self) -> int:
+        """Re-wraps every data key that is not wrapped with the newest master key.
+
+        The data keys themselves are unchanged, so no data has to be re-encrypted.
+
+        Returns:
+            int: The number of keys re-wrapped.
+        """
+        with self._lock:
+            wrapped = dict(self._wrapped)
+        rewrapped = {key_id: self.agent.rewrap(token) for key_id, token in wrapped.items()}
+        rewrapped = {key_id: token for key_id, token in rewrapped.items() if token is not None}
+        with self._lock:
+            self._wrapped.update(rewrapped)
+        return len(rewrapped)
+
+    def shred(self, owner: str) -> bool:
+        """Forgets an owner's data key, wrapped and unwrapped, so its data can no longer be decrypted."""
+        with self._lock:
+            key_id = self._owners.pop(owner, None)
+            if key_id is None:
+                return False
+            self._wrapped.pop(key_id, None)
+            self._keys.pop(key_id, None)
+            self._ciphers.pop(key_id, None)
+            return True
+
+
+# This allows the script to be run directly to generate a key, or to rotate in a new one.
 if __name__ == '__main__':
-    print("This script manages the encryption key. If 'secret.key' is not present, it will be created.")
+    encryptor.reload()
+    if sys.argv[1:] == ['rotate']:
+        encryptor.add_key()
+        print(f"A new master key was added to '{KEY_FILE}'; {encryptor.versions} key versions are available. "
+              "Run `CareLogService.rotate_keys()` to re-wrap and re-encrypt existing data.")
+    else:
+        print("This script manages the encryption key. If 'secret.key' is not present, it will be created. "
+              "Run it with 'rotate' to add a new master key.")
@@ -2,30 +2,108 @@
 This module provides an interface to the Google Gemini large language model.
 
 It is responsible for:
-- Configuring the Gemini API with the necessary credentials from Streamlit secrets.
-- Initializing the generative model.
+- Selecting the language model provider (see `modules.llm`): by default the Gemini API,
+  configured from Streamlit secrets on the first request, or any other configured provider
+  such as the local stand-in server of `modules.llm_stub`. The provider is wrapped by
+  `modules.resilience` so every call has a deadline, retries, and a circuit breaker.
 - Providing a function `generate_feedback` that constructs a prompt from patient data
-  and calls the Gemini API to generate empathetic and useful feedback.
+  and calls the model to generate empathetic and useful feedback.
+- Providing the fallback tiers used when that model is slow or down:
+  `generate_fallback_feedback`, which sends the same prompt to a smaller or cheaper model
+  (`CARELOG_LLM_FALLBACK_MODEL`), and `template_feedback`, which builds a short
+  deterministic message from the scores without any model.
+- Providing `generate_feedback_batch`, which packs several entries into one structured
+  prompt, so the instructions are sent once per batch instead of once per note, and parses
+  the per-entry feedback back out of the response.
+- Providing `generate_summary`, which updates a rolling summary of a patient's history for
+  clinicians from the previous summary and only the notes added since.
 
 This abstracts the AI integration, making it easy to call from other parts of the application.
 """
+# carelog/modules/gemini.py
 
-import streamlit as st
-import google.generativeai as genai
+import os
+import re
+import threading
 
-# Configure the Gemini API using the key stored in Streamlit secrets.
-# This is the recommended way to handle sensitive keys in a Streamlit app.
-genai.configure(api_key=st.secrets["GEMINI_API_KEY"])
+from modules.llm import ModelProvider, configured_provider
+from modules.resilience import ResilientProvider, configured_resilience
 
-# Initialize the generative model. 'gemma-3-27b-it' is specified as the model to use.
-model = genai.GenerativeModel('gemma-3-27b-it')
+# A stand-in model (anything with `generate_content(prompt)`) may be assigned here, e.g. by
+# tests; it takes precedence over the configured provider.
+model = None
 
-def generate_feedback(patient_notes: str, mood: int, pain: int, appetite: int) -> str | None:
-    """Generates AI-powered feedback for a patient based on their daily entry.
+# Entries packed into one batched request.
+FEEDBACK_BATCH_SIZE = 5
+_BATCH_RESPONSE = re.compile(r'<feedback id="(\d+)">(.*?)</feedback>', re.DOTALL)
+
+# The configured provider, created on first use by `get_provider`. Creating it imports
+# nothing and reads no secrets, so importing this module (as every worker and CLI tool does
+# through `modules.auth`) stays cheap.
+provider = None
+_provider_lock = threading.Lock()
+# The fallback model's provider, created on first use if `CARELOG_LLM_FALLBACK_MODEL` is set.
+fallback_provider = None
+# The longest a fallback call may take, in seconds.
+FALLBACK_DEADLINE_SECONDS = float(os.environ.get('CARELOG_LLM_FALLBACK_DEADLINE') or 10.0)
+
+
+def get_provider():
+    """Returns the provider used for feedback, creating the configured one on first use."""
+    global provider
+    if model is not None:
+        return ModelProvider(model)
+    if provider is None:
+        with _provider_lock:
+            if provider is None:
+                provider = ResilientProvider(configured_provider(), **configured_resilience())
+    return provider
+
+
+def get_fallback_provider():
+    """Returns the provider of the fallback model, or None if no fallback model is configured."""
+    global fallback_provider
+    if model is not None:
+        # A stand-in model replaces every remote model.
+        return None
+    if fallback_provider is None:
+        fallback_model = os.environ.get('CARELOG_LLM_FALLBACK_MODEL')
+        if not fallback_model:
+            return None
+        with _provider_lock:
+            if fallback_provider is None:
+                options = dict(configured_resilience(), deadline=FALLBACK_DEADLINE_SECONDS)
+                fallback_provider = ResilientProvider(configured_provider(fallback_model), **options)
+    return fallback_provider
+
+
+def _generate(target, prompt: str, **options) -> str:
+    """Calls a provider, passing `deadline` and `admit` options only to a `ResilientProvider`.
+
+    Options that are None are dropped; other providers (a stand-in model, or a bare provider
+    set by a benchmark) make exactly one request and take no options.
+    """
+    options = {name: value for name, value in options.items() if value is not None}
+    if isinstance(target, ResilientProvider):
+        return target.generate(prompt, **options)
+    return target.generate(prompt)
+
+
+def fallback_configured() -> bool:
+    """Checks whether a fallback model is configured, without creating its provider."""
+    return model is None and bool(os.environ.get('CARELOG_LLM_FALLBACK_MODEL'))
 
-    This function constructs a detailed prompt that includes the patient's self-reported
-    metrics and narrative notes. It then sends this prompt to the Gemini model and
-    returns the generated text.
+
+def client_metrics() -> dict:
+    """Returns the metrics of the configured provider, or an empty dictionary before its first use."""
+    current = provider
+    if current is None or not callable(getattr(current, 'metrics', None)):
+        return {}
+    return current.metrics()
+
+
+def build_feedback_prompt(patient_notes: str, mood: int, pain: int, appetite: int) -> str:
+    """Builds the prompt sent to the model for a patient's daily entry.
 
     Args:
         patient_notes: The narrative notes provided by the patient.
@@ -34,12 +112,11 @@ def generate_feedback(patient_notes: str, mood: int, pain: int, appetite: int) -
         appetite: The patient's self-reported appetite score (0-10).
 
     Returns:
-        The generated feedback as a string, or None if an error occurs.
+        The prompt text.
     """
-
     # The prompt is carefully engineered to guide the AI to provide empathetic,
     # encouraging, and safe feedback suitable for a healthcare context.
-    prompt = f"""
+    return f"""
     You are an AI in a hospital that gives feedback to patients based on their notes. 
     The patient reported the following:
     - Mood: {mood}/10
@@ -56,11 +133,230 @@ def generate_feedback(patient_notes: str, mood: int, pain: int, appetite: int) -
     Feedback:
     """
 
+
+def generate_feedback(patient_notes: str, mood: int, pain: int, appetite: int,
+                      deadline: float = None, admit=None) -> str | None:
+    """Generates AI-powered feedback for a patient based on their daily entry.
+
+    This function constructs a detailed prompt that includes the patient's self-reported
+    metrics and narrative notes. It then sends this prompt to the configured model and
+    returns the generated text.
+
+    Args:
+        patient_notes: The narrative notes provided by the patient.
+        mood: The patient's self-reported mood score (0-10).
+        pain: The patient's self-reported pain score (0-10).
+        appetite: The patient's self-reported appetite score (0-10).
+        deadline (float, optional): The longest the call may take, in seconds, if shorter
+            than the provider's own deadline.
+        admit (callable, optional): Asked before every retry or hedged request, e.g.
+            `Admission.admit` of the rate limiter; returning False skips it.
+
+    Returns:
+        The generated feedback as a string, or None if an error occurs.
+    """
+    prompt = build_feedback_prompt(patient_notes, mood, pain, appetite)
+
     try:
-        # Call the Gemini API to generate content based on the prompt.
-        response = model.generate_content(prompt)
-        return response.text
+        # Call the configured model provider to generate content based on the prompt.
+        return _generate(get_provider(), prompt, deadline=deadline, admit=admit)
     except Exception as e:
+        # Providers raise `LLMError`; anything else (e.g. a bad configuration) is reported too.
         # In a production environment, this error should be logged more robustly.
-        print(f"Error generating feedback from Gemini API: {e}")
-        return None
\ No newline at end of file
+        print(f"Error generating feedback from the language model: {e}")
+        return None
+
+
+def build_batch_prompt(entries: list) -> str:
+    """Builds one prompt asking for feedback on several daily entries.
+
+    Args:
+        entries (list): `(patient_notes, mood, pain, appetite)` tuples.
+
+    Returns:
+        The prompt text; entries are numbered from 1 in `<entry id="...">` tags.
+    """
+    blocks = []
+    for number, (patient_notes, mood, pain, appetite) in enumerate(entries, 1):
+        # Angle brackets are escaped so a note cannot close its tag or forge a response block.
+        text = str(patient_notes or '').replace('<', '&lt;').replace('>', '&gt;')
+        blocks.append(f'<entry id="{number}">\n- Mood: {mood}/10\n- Pain: {pain}/10\n'
+                      f'- Appetite: {appetite}/10\nPatient Notes:\n{text}\n</entry>')
+    entries_text = '\n'.join(blocks)
+    return f"""
+    You are an AI in a hospital that gives feedback to patients based on their notes.
+    Below are {len(entries)} separate daily entries, each with the patient's mood, pain and
+    appetite (0-10) and their notes. Treat every entry independently.
+
+    For each entry, provide useful feedback and things that the patient can do to make themselves
+    feel better. Be kind and encouraging. Do not assume things. Write one paragraph of around
+    200 words per entry. Answer with exactly one <feedback id="N">paragraph</feedback> block per
+    entry, using the entry's id, and nothing else.
+
+{entries_text}
+    """
+
+
+def parse_batch_response(text: str, count: int) -> list:
+    """Extracts the per-entry feedback from a response to `build_batch_prompt`.
+
+    Args:
+        text (str): The model's response.
+        count (int): The number of entries in the prompt.
+
+    Returns:
+        list: The feedback for entries 1 to `count`; None where the response has no usable
+              block for an entry.
+    """
+    results = [None] * count
+    for number, paragraph in _BATCH_RESPONSE.findall(text or ''):
+        index = int(number) - 1
+        paragraph = paragraph.strip()
+        if 0 <= index < count and paragraph and results[index] is None:
+            results[index] = paragraph
+    return results
+
+
+def generate_feedback_batch(entries: list, admit=None) -> list:
+    """Generates feedback for several daily entries with one model call.
+
+    Args:
+        entries (list): `(patient_notes, mood, pain, appetite)` tuples.
+        admit (callable, optional): Asked before every retry or hedged request.
+
+    Returns:
+        list: The feedback for each entry, in order. An entry is None if its feedback could
+              not be parsed from the response, or every entry is None if the call failed;
+              callers fall back to `generate_feedback` for those.
+    """
+    if not entries:
+        return []
+    try:
+        response = _generate(get_provider(), build_batch_prompt(entries), admit=admit)
+    except Exception as e:
+        print(f"Error generating batched feedback from the language model: {e}")
+        return [None] * len(entries)
+    return parse_batch_response(response, len(entries))
+
+
+def build_summary_prompt(previous_summary: str, notes: list) -> str:
+    """Builds the prompt that folds new notes into a patient's rolling summary.
+
+    Args:
+        previous_summary (str): The summary of the earlier notes, or None for a first summary.
+        notes (list): The new note dictionaries, oldest first.
+
+    Returns:
+        The prompt text.
+    """
+    lines = []
+    for note in notes:
+        kind = "Patient entry" if note.get('source') == 'patient' else "Clinical note"
+        line = (f"- [{note.get('timestamp', '')}] {kind}: mood {note.get('mood', 'N/A')}/10, "
+                f"pain {note.get('pain', 'N/A')}/10, appetite {note.get('appetite', 'N/A')}/10. "
+                f"Notes: {note.get('notes') or 'none'}")
+        if note.get('diagnoses'):
+            line += f" Diagnoses: {note['diagnoses']}"
+        lines.append(line)
+    new_entries = '\n'.join(lines)
+    return f"""
+    You are an AI assistant that keeps a rolling summary of a hospital patient's recent history
+    for their care team.
+
+    Current summary of earlier entries:
+    {previous_summary or "None yet."}
+
+    New entries since that summary, oldest first:
+{new_entries}
+
+    Write the updated summary in at most 150 words: trends in mood, pain and appetite, notable
+    events, diagnoses, and concerns to follow up. Keep the important points of the current
+    summary and drop details the new entries make outdated. Do not assume things. Only print
+    the summary and nothing else.
+    """
+
+
+def generate_summary(previous_summary: str, notes: list, admit=None) -> str | None:
+    """Updates a patient's rolling summary with new notes.
+
+    Args:
+        previous_summary (str): The summary of the earlier notes, or None for a first summary.
+        notes (list): The new note dictionaries, oldest first.
+        admit (callable, optional): Asked before every retry or hedged request.
+
+    Returns:
+        The updated summary as a string, or None if an error occurs.
+    """
+    try:
+        return _generate(get_provider(), build_summary_prompt(previous_summary, notes), admit=admit)
+    except Exception as e:
+        print(f"Error generating a summary from the language model: {e}")
+        return None
+
+
+def generate_fallback_feedback(patient_notes: str, mood: int, pain: int, appetite: int,
+                               deadline: float = None, admit=None) -> str | None:
+    """Generates feedback with the fallback model, for when the primary model failed.
+
+    Args:
+        patient_notes: The narrative notes provided by the patient.
+        mood: The patient's self-reported mood score (0-10).
+        pain: The patient's self-reported pain score (0-10).
+        appetite: The patient's self-reported appetite score (0-10).
+        deadline (float, optional): The longest the call may take, in seconds.
+        admit (callable, optional): Asked before every retry or hedged request.
+
+    Returns:
+        The generated feedback as a string, or None if no fallback model is configured or
+        an error occurs.
+    """
+    fallback = get_fallback_provider()
+    if fallback is None:
+        return None
+    try:
+        return _generate(fallback, build_feedback_prompt(patient_notes, mood, pain, appetite),
+                         deadline=deadline, admit=admit)
+    except Exception as e:
+        print(f"Error generating feedback from the fallback language model: {e}")
+        return None
+
+
+def template_feedback(mood: int, pain: int, appetite: int) -> str:
+    """Builds short, supportive feedback from a patient's scores without a language model.
+
+    The message is deterministic and only uses the scores, so it is always available; it is
+    the last tier of feedback generation and is reviewed by a clinician like any other.
+
+    Args:
+        mood: The patient's self-reported mood score (0-10).
+        pain: The patient's self-reported pain score (0-10).
+        appetite: The patient's self-reported appetite score (0-10).
+
+    Returns:
+        The feedback paragraph.
+    """
+    sentences = ["Thank you for taking the time to record how you are feeling today."]
+    if mood <= 3:
+        sentences.append("It sounds like today has been hard. Talking with someone you trust, or with your "
+                         "care team, about how you feel can help, and you do not have to manage it alone.")
+    elif mood >= 7:
+        sentences.append("It is good to hear that your mood is positive; keep doing the things that help you feel this way.")
+    else:
+        sentences.append("Small things such as a short walk, some fresh air, or a call with a friend can lift your mood.")
+    if pain >= 7:
+        sentences.append("Your pain is high, so please let your care team know straight away so they can help "
+                         "you manage it.")
+    elif pain >= 4:
+        sentences.append("Resting, changing position, and taking any pain relief as prescribed may ease your pain; "
+                         "tell your care team if it gets worse.")
+    else:
+        sentences.append("It is good that your pain is low today.")
+    if appetite <= 3:
+        sentences.append("Try small, light meals or snacks through the day and keep sipping water, even if you "
+                         "are not hungry.")
+    elif appetite >= 7:
+        sentences.append("Your appetite is good, which helps your recovery; keep eating regular, balanced meals.")
+    else:
+        sentences.append("Regular meals and plenty of fluids will help keep your strength up.")
+    sentences.append("Your care team will read your entry and is here to support you.")
+    return " ".join(sentences)
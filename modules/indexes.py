@@ -0,0 +1,156 @@
+"""
+This module provides in-memory secondary indexes over a hospital's user records.
+
+It defines the `HospitalIndex` class, which maps each role, and each (role, status) pair,
+to the keys of the matching users, and indexes clinician assignments in both directions
+(clinician -> patients and patient -> clinicians). User listings and assignment lookups
+cost time proportional to their result rather than to the size of the hospital.
+
+Users whose `status` is `DELETED_STATUS` are tombstones awaiting a background purge: they
+are left out of the role and assignment indexes, so they vanish from listings at once,
+and they are tracked under the (role, 'deleted') key so the purge can find them.
+
+Indexes are derived data: they are never persisted, they are built from the user
+dictionary on first use, and `CareLogService` keeps them up to date as it writes. Key
+sets are dictionaries with `None` values, which keeps them in insertion order so
+listings come back in the same order as the underlying user dictionary.
+"""
+# carelog/modules/indexes.py
+
+from typing import Dict, Iterable
+
+DELETED_STATUS = 'deleted'
+
+
+class HospitalIndex:
+    """Role, (role, status), and assignment indexes over one hospital's `users` dictionary."""
+
+    def __init__(self, users: dict):
+        """Builds the index from a hospital's user records.
+
+        Args:
+            users (dict): The hospital's user records, keyed by `username_role`.
+        """
+        self.users = users
+        self.size = 0
+        self.by_role: Dict[str, Dict[str, None]] = {}
+        self.by_role_status: Dict[tuple, Dict[str, None]] = {}
+        self.patients_of: Dict[str, Dict[str, None]] = {}
+        self.clinicians_of: Dict[str, Dict[str, None]] = {}
+        for user_key, user_data in users.items():
+            self.add_user(user_key, user_data)
+        # Patients may still list a tombstoned clinician until the purge has run.
+        for clinician_key in self.keys('clinician', DELETED_STATUS):
+            self._drop_assignments('clinician', users[clinician_key].get('username'))
+
+    def is_current(self, users: dict) -> bool:
+        """Checks whether the index still describes the given user dictionary.
+
+        A different dictionary (e.g. after a reload) or a different number of users
+        (e.g. a record added without going through the service) means it must be rebuilt.
+
+        Args:
+            users (dict): The hospital's current user records.
+
+        Returns:
+            bool: True if the index can be used as is.
+        """
+        return users is self.users and len(users) == self.size
+
+    def add_user(self, user_key: str, user_data: dict):
+        """Indexes a newly added user record."""
+        role, status = user_data.get('role'), user_data.get('status')
+        self.by_role_status.setdefault((role, status), {})[user_key] = None
+        self.size += 1
+        if status == DELETED_STATUS:
+            return
+        self.by_role.setdefault(role, {})[user_key] = None
+        if role == 'patient':
+            for clinician_username in user_data.get('assigned_clinicians') or []:
+                self.assign(user_data.get('username'), clinician_username)
+
+    def remove_user(self, user_key: str, user_data: dict):
+        """Removes a deleted user record from the index."""
+        role, status = user_data.get('role'), user_data.get('status')
+        self.by_role.get(role, {}).pop(user_key, None)
+        self.by_role_status.get((role, status), {}).pop(user_key, None)
+        self._drop_assignments(role, user_data.get('username'))
+        self.size -= 1
+
+    def tombstone(self, user_key: str, user_data: dict):
+        """Hides a user from every listing and assignment lookup ahead of its purge.
+
+        Must be called before the record's status is changed to `DELETED_STATUS`.
+        """
+        role = user_data.get('role')
+        self.by_role.get(role, {}).pop(user_key, None)
+        self.update_status(user_key, role, user_data.get('status'), DELETED_STATUS)
+        self._drop_assignments(role, user_data.get('username'))
+
+    def _drop_assignments(self, role: str, username: str):
+        """Removes every assignment of a patient or clinician from the index."""
+        if role == 'patient':
+            for clinician_username in list(self.clinicians_of.get(username, {})):
+                self.unassign(username, clinician_username)
+        elif role == 'clinician':
+            for patient_username in list(self.patients_of.get(username, {})):
+                self.unassign(patient_username, username)
+
+    def is_deleted(self, username: str, role: str) -> bool:
+        """Checks whether a user is a tombstone awaiting purge."""
+        return f"{username}_{role}" in self.by_role_status.get((role, DELETED_STATUS), {})
+
+    def tombstones(self) -> list:
+        """Returns the keys of every tombstoned user."""
+        return [
+            user_key
+            for (role, status), user_keys in self.by_role_status.items() if status == DELETED_STATUS
+            for user_key in user_keys
+        ]
+
+    def update_status(self, user_key: str, role: str, old_status: str, new_status: str):
+        """Moves a user between (role, status) sets after a status change."""
+        self.by_role_status.get((role, old_status), {}).pop(user_key, None)
+        self.by_role_status.setdefault((role, new_status), {})[user_key] = None
+
+    def assign(self, patient_username: str, clinician_username: str):
+        """Records that a clinician is assigned to a patient."""
+        self.patients_of.setdefault(clinician_username, {})[patient_username] = None
+        self.clinicians_of.setdefault(patient_username, {})[clinician_username] = None
+
+    def unassign(self, patient_username: str, clinician_username: str):
+        """Records that a clinician is no longer assigned to a patient."""
+        patients = self.patients_of.get(clinician_username, {})
+        patients.pop(patient_username, None)
+        if not patients:
+            self.patients_of.pop(clinician_username, None)
+        clinicians = self.clinicians_of.get(patient_username, {})
+        clinicians.pop(clinician_username, None)
+        if not clinicians:
+            self.clinicians_of.pop(patient_username, None)
+
+    def is_assigned(self, patient_username: str, clinician_username: str) -> bool:
+        """Checks whether a clinician is assigned to a patient."""
+        return clinician_username in self.clinicians_of.get(patient_username, {})
+
+    def patients_for(self, clinician_username: str) -> Iterable[str]:
+        """Returns the usernames of the patients assigned to a clinician, in assignment order."""
+        return self.patients_of.get(clinician_username, {})
+
+    def keys(self, role: str, status: str = None) -> Iterable[str]:
+        """Returns the keys of the users with a role, and optionally a status.
+
+        Args:
+            role (str): The role to match.
+            status (str, optional): The status to match. Any status if omitted.
+
+        Returns:
+            Iterable[str]: The matching user keys, in insertion order.
+        """
+        if status is None:
+            return self.by_role.get(role, {})
+        return self.by_role_status.get((role, status), {})
+
+    def records(self, role: str, status: str = None) -> list:
+        """Returns the user records with a role, and optionally a status."""
+        return [self.users[user_key] for user_key in self.keys(role, status)]
@@ -0,0 +1,266 @@
+"""
+This module provides the provider layer between the application and a large language model.
+
+Every provider exposes the same small interface, `generate(prompt) -> str`, raising
+`LLMError` when the model cannot answer, so the rest of the application does not depend on
+a particular client library:
+- `GeminiProvider` calls the Google Gemini API through `google.generativeai`, configured
+  from Streamlit secrets. The client is created on first use and reused for every call.
+- `HTTPProvider` posts prompts as JSON to an HTTP endpoint, such as the local stand-in
+  server in `modules.llm_stub`, over a pool of persistent connections.
+- `ModelProvider` adapts any object with a `generate_content(prompt)` method, e.g. a
+  stand-in model in tests.
+
+Deadlines, retries, hedging, and circuit breaking are added around a provider by
+`modules.resilience.ResilientProvider`.
+
+The provider used by `modules.gemini` is chosen with environment variables:
+`CARELOG_LLM_PROVIDER` (`gemini` or `http`), `CARELOG_LLM_MODEL`, `CARELOG_LLM_TIMEOUT`
+(seconds), and, for `http`, `CARELOG_LLM_URL` and `CARELOG_LLM_POOL_SIZE`.
+"""
+# carelog/modules/llm.py
+
+import json
+import os
+import queue
+import threading
+from urllib.parse import urlsplit
+
+DEFAULT_PROVIDER = 'gemini'
+DEFAULT_MODEL = 'gemma-3-27b-it'
+DEFAULT_TIMEOUT_SECONDS = 30.0
+DEFAULT_HTTP_URL = 'http://127.0.0.1:8765/generate'
+DEFAULT_POOL_SIZE = 4
+
+
+class LLMError(RuntimeError):
+    """Raised when a provider cannot produce a response (network error, timeout, or error status)."""
+
+    def __init__(self, message: str, retryable: bool = True):
+        """Initializes the error.
+
+        Args:
+            message (str): The description of the failure.
+            retryable (bool): Whether the same request may succeed if sent again; False when
+                the provider rejected the request itself.
+        """
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class ModelProvider:
+    """Adapts an object with a `generate_content(prompt)` method, such as a `GenerativeModel`."""
+    name = 'model'
+
+    def __init__(self, model):
+        """Initializes the provider.
+
+        Args:
+            model: The model; `generate_content` must return an object with a `text` attribute.
+        """
+        self.model = model
+
+    def generate(self, prompt: str) -> str:
+        """Generates a response to a prompt."""
+        return self.model.generate_content(prompt).text
+
+    def close(self):
+        """Releases the provider's resources (nothing to release here)."""
+
+
+class GeminiProvider:
+    """Calls the Google Gemini API.
+
+    The API key is read from Streamlit secrets, the recommended way to handle sensitive keys
+    in a Streamlit app. Both libraries are imported, and the client configured, on the first
+    call, so creating the provider is free.
+    """
+    name = 'gemini'
+
+    def __init__(self, model: str = DEFAULT_MODEL, timeout: float = DEFAULT_TIMEOUT_SECONDS):
+        """Initializes the provider.
+
+        Args:
+            model (str): The model name.
+            timeout (float): The request timeout in seconds.
+        """
+        self.model = model
+        self.timeout = timeout
+        self._client = None
+        self._lock = threading.Lock()
+
+    def client(self):
+        """Returns the `GenerativeModel`, configuring the API on first use."""
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    import streamlit as st
+                    import google.generativeai as genai
+
+                    genai.configure(api_key=st.secrets["GEMINI_API_KEY"])
+                    self._client = genai.GenerativeModel(self.model)
+        return self._client
+
+    def generate(self, prompt: str) -> str:
+        """Generates a response to a prompt.
+
+        Raises:
+            LLMError: If the API call fails or times out.
+        """
+        try:
+            response = self.client().generate_content(prompt, request_options={'timeout': self.timeout})
+            return response.text
+        except Exception as e:
+            raise LLMError(f"Gemini API call failed: {e}") from e
+
+    def close(self):
+        """Drops the client; the next call configures a new one."""
+        self._client = None
+
+
+class HTTPProvider:
+    """Posts prompts to an HTTP endpoint that answers with JSON.
+
+    The request body is `{"model": ..., "prompt": ...}` and a successful response is
+    `{"text": ...}`. Connections are kept alive and reused across calls and threads, up to
+    `pool_size` idle connections.
+    """
+    name = 'http'
+
+    def __init__(self, url: str = DEFAULT_HTTP_URL, model: str = DEFAULT_MODEL,
+                 timeout: float = DEFAULT_TIMEOUT_SECONDS, pool_size: int = DEFAULT_POOL_SIZE):
+        """Initializes the provider without connecting.
+
+        Args:
+            url (str): The endpoint, e.g. `http://127.0.0.1:8765/generate`.
+            model (str): The model name sent with each request.
+            timeout (float): The connect and read timeout in seconds.
+            pool_size (int): The maximum number of idle connections kept open.
+        """
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            raise ValueError(f"Unsupported LLM endpoint '{url}'.")
+        self.url = url
+        self.model = model
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self._secure = parts.scheme == 'https'
+        self._host = parts.hostname
+        self._port = parts.port
+        self._path = parts.path or '/'
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self.metrics = {'requests': 0, 'errors': 0, 'connections_opened': 0}
+
+    def _count(self, metric: str):
+        with self._lock:
+            self.metrics[metric] += 1
+
+    def _connect(self):
+        """Returns an idle connection and whether it was reused, opening one if none is idle."""
+        try:
+            return self._idle.get_nowait(), True
+        except queue.Empty:
+            pass
+        import http.client
+
+        self._count('connections_opened')
+        connection_class = http.client.HTTPSConnection if self._secure else http.client.HTTPConnection
+        return connection_class(self._host, self._port, timeout=self.timeout), False
+
+    def _release(self, connection):
+        """Returns a connection to the pool, or closes it if the pool is full."""
+        if self._idle.qsize() < self.pool_size:
+            self._idle.put(connection)
+        else:
+            connection.close()
+
+    def generate(self, prompt: str) -> str:
+        """Generates a response to a prompt.
+
+        A request that fails on a reused connection, which the server may have closed in the
+        meantime, is retried on a new connection.
+
+        Raises:
+            LLMError: If the request fails, times out, or returns an error status.
+        """
+        # Imported here (it also loads the email and ssl packages) so the app only pays for it
+        # when this provider is in use.
+        import http.client
+
+        self._count('requests')
+        body = json.dumps({'model': self.model, 'prompt': prompt}).encode()
+        headers = {'Content-Type': 'application/json'}
+        while True:
+            connection, reused = self._connect()
+            try:
+                connection.request('POST', self._path, body, headers)
+                response = connection.getresponse()
+                payload = response.read()
+            except (OSError, http.client.HTTPException) as e:
+                connection.close()
+                if reused and not isinstance(e, TimeoutError):
+                    continue
+                self._count('errors')
+                raise LLMError(f"LLM endpoint '{self.url}' failed: {e!r}") from e
+            break
+        if response.will_close:
+            connection.close()
+        else:
+            self._release(connection)
+        if response.status != 200:
+            self._count('errors')
+            # Other client errors mean the request itself was rejected; sending it again won't help.
+            retryable = response.status >= 500 or response.status in (408, 429)
+            raise LLMError(f"LLM endpoint '{self.url}' returned HTTP {response.status}.", retryable)
+        try:
+            return json.loads(payload)['text']
+        except (ValueError, KeyError, TypeError) as e:
+            self._count('errors')
+            raise LLMError(f"LLM endpoint '{self.url}' returned an invalid response.") from e
+
+    def close(self):
+        """Closes every idle connection."""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+PROVIDERS = {provider.name: provider for provider in (GeminiProvider, HTTPProvider)}
+
+
+def get_provider(name: str, **options):
+    """Creates a provider by name.
+
+    Args:
+        name (str): The provider name ('gemini' or 'http').
+        **options: Keyword arguments for the provider (e.g. `model`, `timeout`, `url`).
+
+    Returns:
+        The provider instance.
+
+    Raises:
+        ValueError: If the provider is unknown.
+    """
+    if name not in PROVIDERS:
+        raise ValueError(f"Unsupported LLM provider '{name}'. Available: {', '.join(PROVIDERS)}.")
+    return PROVIDERS[name](**options)
+
+
+def configured_provider(model: str = None):
+    """Creates the provider selected by the `CARELOG_LLM_*` environment variables.
+
+    Args:
+        model (str, optional): The model name, instead of `CARELOG_LLM_MODEL`.
+    """
+    name = os.environ.get('CARELOG_LLM_PROVIDER') or DEFAULT_PROVIDER
+    options = {
+        'model': model or os.environ.get('CARELOG_LLM_MODEL') or DEFAULT_MODEL,
+        'timeout': float(os.environ.get('CARELOG_LLM_TIMEOUT') or DEFAULT_TIMEOUT_SECONDS),
+    }
+    if name == HTTPProvider.name:
+        options['url'] = os.environ.get('CARELOG_LLM_URL') or DEFAULT_HTTP_URL
+        options['pool_size'] = int(os.environ.get('CARELOG_LLM_POOL_SIZE') or DEFAULT_POOL_SIZE)
+    return get_provider(name, **options)
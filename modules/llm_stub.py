@@ -0,0 +1,151 @@
+"""
+This module provides a local HTTP stand-in for the language model, for load tests and offline use.
+
+`StubLLMServer` answers the requests of `modules.llm.HTTPProvider` with a short canned
+feedback paragraph (one per entry for batched prompts) after a configurable latency (plus
+random jitter and a per-output-token delay), and fails a configurable fraction of requests
+with an HTTP error status, so the AI path can be load-tested and the application run
+without network access or an API key:
+
+    python -m modules.llm_stub [port] [latency_seconds] [failure_rate]
+    CARELOG_LLM_PROVIDER=http CARELOG_LLM_URL=http://127.0.0.1:8765/generate streamlit run main.py
+"""
+# carelog/modules/llm_stub.py
+
+import json
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STUB_RESPONSE = ("Thank you for taking the time to share how you are feeling today. "
+                 "Small steps such as resting, staying hydrated, and eating light, regular meals "
+                 "can help, and your care team is here to support you.")
+_BATCH_ENTRY = re.compile(r'<entry id="(\d+)">')
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    """Handles one request to the stub server."""
+    protocol_version = 'HTTP/1.1'  # Keep connections alive, like a real API endpoint.
+    disable_nagle_algorithm = True  # Headers and body are written separately.
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            request = json.loads(self.rfile.read(length) or b'{}')
+            prompt = request['prompt']
+        except (ValueError, KeyError, TypeError):
+            self._reply(400, {'error': 'Expected a JSON body with a "prompt".'})
+            return
+        entries = _BATCH_ENTRY.findall(prompt)
+        if entries:
+            text = '\n'.join(f'<feedback id="{entry}">{STUB_RESPONSE}</feedback>' for entry in entries)
+        else:
+            text = STUB_RESPONSE
+        delay, failed = server.next_outcome(len(text) // 4)
+        if delay:
+            time.sleep(delay)
+        if failed:
+            self._reply(server.failure_status, {'error': 'Simulated model failure.'})
+            return
+        self._reply(200, {'model': request.get('model'), 'text': text, 'prompt_characters': len(prompt)})
+
+    def _reply(self, status: int, body: dict):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        """Silences the per-request access log."""
+
+
+class StubLLMServer(ThreadingHTTPServer):
+    """A threaded HTTP server that simulates a language model's latency and failures."""
+    daemon_threads = True
+    request_queue_size = 128  # Accept bursts of new connections without dropping any.
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 8765, latency: float = 0.0,
+                 jitter: float = 0.0, failure_rate: float = 0.0, failure_status: int = 503,
+                 seed: int = None, token_latency: float = 0.0):
+        """Binds the server without starting it.
+
+        Args:
+            host (str): The interface to listen on.
+            port (int): The port to listen on; 0 picks a free port.
+            latency (float): The base delay of each response in seconds.
+            jitter (float): The maximum random delay added to `latency`, in seconds.
+            failure_rate (float): The fraction of requests (0 to 1) answered with `failure_status`.
+            failure_status (int): The HTTP status of simulated failures.
+            seed (int, optional): Seeds the random jitter and failures for repeatable runs.
+            token_latency (float): Seconds added per generated token (about four characters),
+                as a model's response time grows with the length of its answer.
+        """
+        super().__init__((host, port), _StubHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.token_latency = token_latency
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.metrics = {'requests': 0, 'failures': 0}
+
+    @property
+    def url(self) -> str:
+        """The endpoint to pass to `HTTPProvider`."""
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/generate"
+
+    def next_outcome(self, tokens: int = 0) -> tuple:
+        """Draws the delay and failure of the next response and counts it.
+
+        Args:
+            tokens (int): The length of the response in tokens.
+
+        Returns:
+            tuple: `(delay_seconds, failed)`.
+        """
+        with self._lock:
+            delay = self.latency + self._random.uniform(0, self.jitter) + tokens * self.token_latency
+            failed = self._random.random() < self.failure_rate
+            self.metrics['requests'] += 1
+            self.metrics['failures'] += failed
+        return delay, failed
+
+    def handle_error(self, request, client_address):
+        """Ignores clients that disconnect before their response, e.g. after a client-side timeout."""
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    def start(self) -> str:
+        """Serves requests in a background thread and returns the endpoint URL."""
+        self._thread = threading.Thread(target=self.serve_forever, name='llm-stub', daemon=True)
+        self._thread.start()
+        return self.url
+
+    def stop(self):
+        """Stops serving and closes the listening socket."""
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    server = StubLLMServer(port=int(args[0]) if args else 8765,
+                           latency=float(args[1]) if len(args) > 1 else 0.5,
+                           failure_rate=float(args[2]) if len(args) > 2 else 0.0)
+    print(f"Stub language model listening on {server.url} "
+          f"(latency {server.latency}s, failure rate {server.failure_rate}).")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
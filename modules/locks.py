@@ -0,0 +1,208 @@
+"""
+This module provides the reader-writer locks that protect the in-memory data store.
+
+Streamlit runs every session's script on its own thread, and all sessions share one
+`CareLogService`. This module defines:
+- `RWLock`, a writer-preferring reader-writer lock that records contention metrics
+  (acquisitions, how many had to wait, and for how long).
+- `HospitalLocks`, a registry holding one `RWLock` per hospital plus one for the hospital
+  map itself, so reads of different hospitals never block each other and writes are
+  isolated per tenant.
+"""
+# carelog/modules/locks.py
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict
+
+
+class RWLock:
+    """A reentrant, writer-preferring reader-writer lock with contention metrics.
+
+    Any number of threads may hold the lock for reading at once; a writer has it
+    exclusively. New readers wait while a writer is waiting, so writers are not starved.
+    A thread may re-acquire a lock it already holds, and a writer may also take the lock
+    for reading. Upgrading a read lock to a write lock is not supported.
+    """
+
+    def __init__(self, name: str = ''):
+        """Initializes the lock.
+
+        Args:
+            name (str): A label used in metrics.
+        """
+        self.name = name
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._reader_threads: Dict[int, int] = {}
+        self._writer = None
+        self._writer_depth = 0
+        self._writers_waiting = 0
+        self._metrics = {
+            'read_acquisitions': 0,
+            'write_acquisitions': 0,
+            'read_contended': 0,
+            'write_contended': 0,
+            'read_wait_seconds': 0.0,
+            'write_wait_seconds': 0.0,
+            'max_wait_seconds': 0.0,
+        }
+
+    def acquire_read(self):
+        """Acquires the lock for reading."""
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me or me in self._reader_threads:
+                # Reentrant acquisition never waits (waiting here could deadlock).
+                self._reader_threads[me] = self._reader_threads.get(me, 0) + 1
+                self._readers += 1
+                self._metrics['read_acquisitions'] += 1
+                return
+            if self._writer is not None or self._writers_waiting:
+                started = time.perf_counter()
+                while self._writer is not None or self._writers_waiting:
+                    self._cond.wait()
+                self._record_wait('read', time.perf_counter() - started)
+            self._reader_threads[me] = 1
+            self._readers += 1
+            self._metrics['read_acquisitions'] += 1
+
+    def release_read(self):
+        """Releases a read acquisition held by the calling thread."""
+        me = threading.get_ident()
+        with self._cond:
+            count = self._reader_threads.get(me)
+            if not count:
+                raise RuntimeError("Cannot release a read lock that is not held.")
+            if count == 1:
+                del self._reader_threads[me]
+            else:
+                self._reader_threads[me] = count - 1
+            self._readers -= 1
+            if self._readers == 0:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        """Acquires the lock for writing."""
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me:
+                self._writer_depth += 1
+                self._metrics['write_acquisitions'] += 1
+                return
+            if me in self._reader_threads:
+                raise RuntimeError("Cannot upgrade a read lock to a write lock.")
+            if self._writer is not None or self._readers:
+                started = time.perf_counter()
+                self._writers_waiting += 1
+                try:
+                    while self._writer is not None or self._readers:
+                        self._cond.wait()
+                finally:
+                    self._writers_waiting -= 1
+                self._record_wait('write', time.perf_counter() - started)
+            self._writer = me
+            self._writer_depth = 1
+            self._metrics['write_acquisitions'] += 1
+
+    def release_write(self):
+        """Releases a write acquisition held by the calling thread."""
+        with self._cond:
+            if self._writer != threading.get_ident():
+                raise RuntimeError("Cannot release a write lock that is not held.")
+            self._writer_depth -= 1
+            if self._writer_depth == 0:
+                self._writer = None
+                self._cond.notify_all()
+
+    @contextmanager
+    def read(self):
+        """Context manager that holds the lock for reading."""
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def write(self):
+        """Context manager that holds the lock for writing."""
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
+
+    def _record_wait(self, mode: str, waited: float):
+        """Records a contended acquisition; the condition lock must be held."""
+        self._metrics[f'{mode}_contended'] += 1
+        self._metrics[f'{mode}_wait_seconds'] += waited
+        self._metrics['max_wait_seconds'] = max(self._metrics['max_wait_seconds'], waited)
+
+    def metrics(self) -> dict:
+        """Returns a snapshot of the lock's contention metrics.
+
+        Returns:
+            dict: Acquisition counts, contended counts, and wait times in seconds.
+        """
+        with self._cond:
+            return dict(self._metrics)
+
+
+class HospitalLocks:
+    """Holds one `RWLock` per hospital, plus one guarding the hospital map."""
+
+    def __init__(self):
+        """Initializes the registry with the hospital map lock."""
+        self.hospitals = RWLock('hospitals')
+        self._locks: Dict[str, RWLock] = {}
+        self._registry_lock = threading.Lock()
+
+    def for_hospital(self, hospital_id: str) -> RWLock:
+        """Returns the lock for a hospital, creating it on first use.
+
+        Args:
+            hospital_id (str): The ID of the hospital.
+
+        Returns:
+            RWLock: The hospital's lock.
+        """
+        lock = self._locks.get(hospital_id)
+        if lock is None:
+            with self._registry_lock:
+                lock = self._locks.setdefault(hospital_id, RWLock(f'hospital:{hospital_id}'))
+        return lock
+
+    def read(self, hospital_id: str):
+        """Context manager that holds a hospital's lock for reading."""
+        return self.for_hospital(hospital_id).read()
+
+    def write(self, hospital_id: str):
+        """Context manager that holds a hospital's lock for writing."""
+        return self.for_hospital(hospital_id).write()
+
+    @contextmanager
+    def read_all(self, hospital_ids):
+        """Holds the hospital map and the given hospitals for reading, in a fixed order.
+
+        Args:
+            hospital_ids: The IDs of the hospitals to lock.
+        """
+        with self.hospitals.read():
+            locks = [self.for_hospital(hospital_id) for hospital_id in sorted(hospital_ids)]
+            acquired = []
+            try:
+                for lock in locks:
+                    lock.acquire_read()
+                    acquired.append(lock)
+                yield
+            finally:
+                for lock in reversed(acquired):
+                    lock.release_read()
+
+    def metrics(self) -> dict:
+        """Returns contention metrics for every lock, keyed by lock name."""
+        with self._registry_lock:
+            locks = [self.hospitals] + list(self._locks.values())
+        return {lock.name: lock.metrics() for lock in locks}
@@ -4,10 +4,23 @@ This module defines the primary data models for the CareLog application.
 These classes are used to structure the data that is managed by the `CareLogService`
 and stored in the application's database. They provide a clear and consistent
 representation of the core entities within the system.
+
+Stored users, notes, and chat messages are held in memory as compact `__slots__` records
+(`UserRecord`, `NoteRecord`, `MessageRecord`) instead of one dictionary per record. The
+records implement the mapping protocol, so code written against the persisted JSON
+dictionaries keeps working, and they convert back to plain dictionaries for persistence
+and export. A mapping lookup runs Python code for every read, though; loops over a whole
+hospital's records read fields with `getattr(record, field, None)` instead, which reads the
+slot directly, is as fast as a dictionary lookup, and returns None for an absent field
+like `get` does. Low-cardinality string fields (roles, statuses, sources, user and hospital IDs)
+are interned as records are built, so the thousands of notes and messages that repeat the
+same few values share one string object each instead of one copy per record.
 """
 # carelog/modules/models.py
 
+from collections.abc import Mapping, MutableMapping
 from datetime import datetime
+import sys
 import uuid
 
 class User:
@@ -24,6 +37,8 @@ class User:
         pronouns (str): The user's preferred pronouns.
         bio (str): A short biography for the user.
     """
+    __slots__ = ('user_id', 'username', 'password_hash', 'role', 'full_name', 'dob', 'sex', 'pronouns', 'bio')
+
     def __init__(self, username, password_hash, role, full_name, dob, sex, pronouns, bio, user_id=None):
         self.user_id = user_id or username
         self.username = username
@@ -53,6 +68,11 @@ class PatientNote:
         is_private (bool): If True, the note is visible only to the patient.
         hidden_from_patient (bool): If True, the note is visible only to clinicians.
     """
+    __slots__ = (
+        'note_id', 'hospital_id', 'patient_id', 'author_id', 'timestamp', 'mood', 'pain',
+        'appetite', 'notes', 'diagnoses', 'source', 'is_private', 'hidden_from_patient'
+    )
+
     def __init__(self, patient_id, author_id, mood, pain, appetite, notes, diagnoses, source, hospital_id, is_private=False, hidden_from_patient=False, note_id=None, timestamp=None):
         # A unique ID is generated if one is not provided.
         self.note_id = note_id or str(uuid.uuid4())
@@ -68,4 +88,200 @@ class PatientNote:
         self.diagnoses = diagnoses
         self.source = source
         self.is_private = is_private
-        self.hidden_from_patient = hidden_from_patient
\ No newline at end of file
+        self.hidden_from_patient = hidden_from_patient
+
+    def to_record(self) -> 'NoteRecord':
+        """Returns the note as the record stored in a hospital's `notes` list."""
+        return NoteRecord.from_dict({field: getattr(self, field) for field in self.__slots__})
+
+
+class Record(MutableMapping):
+    """Base class for compact records that behave like the dictionaries they replace.
+
+    Subclasses list their known keys in `FIELDS`, which become slots; a key that is absent
+    is simply an unset slot. Any other keys found in the persisted data are kept in a
+    small overflow dictionary, so no information is lost on a round trip.
+    """
+    __slots__ = ('_extra',)
+    FIELDS = ()
+    # Fields whose string values (or lists of strings) repeat across records and are interned.
+    INTERNED = frozenset()
+    _FIELD_SET = frozenset()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._FIELD_SET = frozenset(cls.FIELDS)
+
+    def __init__(self, data=(), **kwargs):
+        self._extra = None
+        self.update(data, **kwargs)
+
+    @classmethod
+    def from_dict(cls, data: Mapping, intern: bool = True) -> 'Record':
+        """Builds a record from a persisted dictionary.
+
+        Args:
+            data (Mapping): The record's keys and values.
+            intern (bool): Whether to intern the values of the `INTERNED` fields.
+
+        Returns:
+            Record: The new record.
+        """
+        record = cls.__new__(cls)
+        record._extra = None
+        fields = cls._FIELD_SET
+        interned = cls.INTERNED if intern else ()
+        for key, value in data.items():
+            if key in interned:
+                value = _intern(value)
+            if key in fields:
+                setattr(record, key, value)
+            else:
+                if record._extra is None:
+                    record._extra = {}
+                record._extra[key] = value
+        return record
+
+    def to_dict(self) -> dict:
+        """Returns the record as a plain dictionary (the persisted format)."""
+        return dict(self.items())
+
+    def __getitem__(self, key):
+        if key in self._FIELD_SET:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        if self._extra is None:
+            raise KeyError(key)
+        return self._extra[key]
+
+    def __setitem__(self, key, value):
+        if key in self._FIELD_SET:
+            setattr(self, key, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __delitem__(self, key):
+        if key in self._FIELD_SET:
+            try:
+                delattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        elif self._extra is None or key not in self._extra:
+            raise KeyError(key)
+        else:
+            del self._extra[key]
+            if not self._extra:
+                self._extra = None
+
+    def __iter__(self):
+        for field in self.FIELDS:
+            if hasattr(self, field):
+                yield field
+        if self._extra:
+            yield from self._extra
+
+    def __len__(self):
+        present = sum(1 for field in self.FIELDS if hasattr(self, field))
+        return present + (len(self._extra) if self._extra else 0)
+
+    def __contains__(self, key):
+        if key in self._FIELD_SET:
+            return hasattr(self, key)
+        return self._extra is not None and key in self._extra
+
+    def get(self, key, default=None):
+        if key in self._FIELD_SET:
+            return getattr(self, key, default)
+        if self._extra is None:
+            return default
+        return self._extra.get(key, default)
+
+    def copy(self) -> 'Record':
+        """Returns a shallow copy of the record."""
+        return type(self).from_dict(self)
+
+    def __reduce__(self):
+        return (type(self).from_dict, (self.to_dict(),))
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+
+def _intern(value):
+    """Interns a string, or the strings of a list, leaving other values unchanged."""
+    if type(value) is str:
+        return sys.intern(value)
+    if type(value) is list:
+        return [sys.intern(item) if type(item) is str else item for item in value]
+    return value
+
+
+class UserRecord(Record):
+    """A stored user account (one entry of a hospital's `users` dictionary)."""
+    FIELDS = (
+        'username', 'password_hash', 'role', 'salt', 'kdf', 'status', 'full_name', 'dob',
+        'sex', 'pronouns', 'bio', 'assigned_clinicians', 'deleted_at'
+    )
+    INTERNED = frozenset(('username', 'role', 'status', 'sex', 'pronouns', 'assigned_clinicians'))
+    __slots__ = FIELDS
+
+
+class NoteRecord(Record):
+    """A stored patient note (one entry of a hospital's `notes` list)."""
+    FIELDS = PatientNote.__slots__ + ('ai_feedback',)
+    INTERNED = frozenset(('hospital_id', 'patient_id', 'author_id', 'source'))
+    __slots__ = FIELDS
+
+
+class MessageRecord(Record):
+    """A stored chat message (one entry of a general or direct chat thread)."""
+    FIELDS = (
+        'message_id', 'timestamp', 'sender', 'sender_role', 'text', 'channel',
+        'patient_username', 'clinician_username'
+    )
+    INTERNED = frozenset(('sender', 'sender_role', 'channel', 'patient_username', 'clinician_username'))
+    __slots__ = FIELDS
+
+
+def hydrate_hospital(hospital_data: dict, intern: bool = True):
+    """Replaces a loaded hospital's user, note, and message dictionaries with records, in place.
+
+    Args:
+        hospital_data (dict): One hospital as parsed from the persisted JSON.
+        intern (bool): Whether to intern low-cardinality string fields.
+    """
+    users = hospital_data.get('users')
+    if users:
+        for user_key, user_data in users.items():
+            users[user_key] = UserRecord.from_dict(user_data, intern)
+    notes = hospital_data.get('notes')
+    if notes:
+        hospital_data['notes'] = [NoteRecord.from_dict(note, intern) for note in notes]
+    chats = hospital_data.get('chats') or {}
+    general = chats.get('general') or {}
+    for patient_username, messages in general.items():
+        general[patient_username] = [MessageRecord.from_dict(m, intern) for m in messages]
+    direct = chats.get('direct') or {}
+    for threads in direct.values():
+        for clinician_username, messages in threads.items():
+            threads[clinician_username] = [MessageRecord.from_dict(m, intern) for m in messages]
+
+
+def json_default(value):
+    """`json.dumps` hook that serializes records in their persisted dictionary form."""
+    if isinstance(value, Record):
+        return value.to_dict()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def to_plain(value):
+    """Returns a deep copy of stored data with every record converted to a plain dictionary."""
+    if isinstance(value, Mapping):
+        return {key: to_plain(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [to_plain(item) for item in value]
+    return value
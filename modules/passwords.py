@@ -0,0 +1,197 @@
+"""
+This module provides password hashing and verification for the CareLog application.
+
+It defines the `PasswordHasher` class, which is responsible for:
+- Deriving password hashes with a memory-hard KDF (scrypt, or PBKDF2 where scrypt is
+  unavailable) and recording the parameters used alongside each hash.
+- Verifying passwords against both current and legacy (salted SHA-256) user records, and
+  reporting when a record should be transparently re-hashed with the current parameters.
+- Running the expensive derivations on a bounded thread pool, so a burst of logins does
+  not stall the Streamlit threads that serve other sessions. scrypt and PBKDF2 release
+  the GIL while they run, so the pool uses every CPU without forking the server.
+- Calibrating KDF parameters to a target latency on the current machine.
+
+A user record stores the hash as `password_hash`, the random `salt`, and a `kdf` dictionary
+with the algorithm and its parameters. Records without a `kdf` entry are legacy records.
+"""
+# carelog/modules/passwords.py
+
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+
+if hasattr(hashlib, 'scrypt'):
+    DEFAULT_PARAMS = {'algorithm': 'scrypt', 'n': 2 ** 14, 'r': 8, 'p': 1, 'dklen': 32}
+else:  # Python builds linked against an OpenSSL without scrypt.
+    DEFAULT_PARAMS = {'algorithm': 'pbkdf2_sha256', 'iterations': 600_000, 'dklen': 32}
+
+
+def derive_key(password: str, salt: str, params: dict) -> str:
+    """Derives a password hash with the given KDF parameters.
+
+    Args:
+        password (str): The plaintext password.
+        salt (str): The hex-encoded salt.
+        params (dict): The KDF parameter record.
+
+    Returns:
+        str: The hex-encoded derived key.
+
+    Raises:
+        ValueError: If the algorithm is not supported.
+    """
+    algorithm = params.get('algorithm')
+    if algorithm == 'scrypt':
+        n, r, p = params['n'], params['r'], params['p']
+        return hashlib.scrypt(
+            password.encode(), salt=bytes.fromhex(salt), n=n, r=r, p=p,
+            maxmem=256 * n * r + 1024 * 1024, dklen=params.get('dklen', 32)
+        ).hex()
+    if algorithm == 'pbkdf2_sha256':
+        return hashlib.pbkdf2_hmac(
+            'sha256', password.encode(), bytes.fromhex(salt), params['iterations'],
+            dklen=params.get('dklen', 32)
+        ).hex()
+    raise ValueError(f"Unsupported password KDF '{algorithm}'.")
+
+
+def _legacy_hash(password: str, salt: str) -> str:
+    """Computes the legacy `sha256(salt + password)` hash."""
+    return hashlib.sha256((salt + password).encode()).hexdigest()
+
+
+def _params_from_env() -> dict:
+    """Reads KDF parameters from `CARELOG_PASSWORD_KDF` (a JSON object), if set."""
+    configured = os.environ.get('CARELOG_PASSWORD_KDF')
+    if not configured:
+        return dict(DEFAULT_PARAMS)
+    return json.loads(configured)
+
+
+class PasswordHasher:
+    """Hashes and verifies passwords, executing the KDF in a shared thread pool."""
+
+    def __init__(self, params: dict = None, max_workers: int = None):
+        """Initializes the hasher.
+
+        Args:
+            params (dict, optional): KDF parameters for new hashes. Defaults to `DEFAULT_PARAMS`.
+            max_workers (int, optional): Size of the thread pool. 0 derives keys in the
+                calling thread. Defaults to the number of CPUs.
+        """
+        self.params = dict(params or DEFAULT_PARAMS)
+        self.max_workers = (os.cpu_count() or 1) if max_workers is None else max_workers
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def _run(self, password: str, salt: str, params: dict) -> str:
+        """Derives a key in the thread pool, or inline if no pool is available."""
+        pool = self._get_pool()
+        if pool is None:
+            return derive_key(password, salt, params)
+        return pool.submit(derive_key, password, salt, params).result()
+
+    def _get_pool(self):
+        """Lazily starts the thread pool on first use."""
+        if self.max_workers == 0:
+            return None
+        with self._pool_lock:
+            if self._pool is None:
+                # Threads rather than processes: forking the multi-threaded server can copy
+                # locks held by other threads into the child, and hashlib releases the GIL
+                # for the whole derivation anyway.
+                from concurrent.futures import ThreadPoolExecutor
+
+                self._pool = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix='carelog-kdf'
+                )
+            return self._pool
+
+    def hash(self, password: str) -> dict:
+        """Hashes a password with a fresh salt and the current parameters.
+
+        Args:
+            password (str): The plaintext password.
+
+        Returns:
+            dict: The `password_hash`, `salt`, and `kdf` fields to store on the user record.
+        """
+        salt = os.urandom(16).hex()
+        return {
+            'password_hash': self._run(password, salt, self.params),
+            'salt': salt,
+            'kdf': dict(self.params),
+        }
+
+    def verify(self, password: str, record: dict) -> tuple:
+        """Verifies a password against a stored user record.
+
+        Args:
+            password (str): The plaintext password to check.
+            record (dict): The stored user record.
+
+        Returns:
+            tuple: `(matches, upgrade)`, where `upgrade` holds replacement hash fields
+                   when the record uses a legacy or outdated KDF, and is None otherwise.
+        """
+        salt = record.get('salt')
+        stored_hash = record.get('password_hash') or ''
+        params = record.get('kdf')
+        if params:
+            candidate = self._run(password, salt, params)
+        else:
+            candidate = _legacy_hash(password, salt)
+        if not hmac.compare_digest(candidate, stored_hash):
+            return False, None
+        if params == self.params:
+            return True, None
+        return True, self.hash(password)
+
+    def shutdown(self):
+        """Stops the worker threads, if they were started."""
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+
+
+def calibrate(target_ms: float = 250.0, algorithm: str = None, max_cost: int = 2 ** 20) -> tuple:
+    """Chooses KDF parameters whose single-hash latency is close to a target.
+
+    The work factor (scrypt `n` or PBKDF2 iterations) is doubled until one derivation on
+    this machine takes at least `target_ms`, then the closest measured value is kept.
+
+    Args:
+        target_ms (float): The desired time for one hash, in milliseconds.
+        algorithm (str, optional): 'scrypt' or 'pbkdf2_sha256'. Defaults to the default algorithm.
+        max_cost (int): Upper bound for scrypt `n` (PBKDF2 iterations are bounded at 1000x this).
+
+    Returns:
+        tuple: `(params, measured_ms)`, the chosen parameter record and its measured latency.
+    """
+    algorithm = algorithm or DEFAULT_PARAMS['algorithm']
+    if algorithm == 'scrypt':
+        params, cost_key, cost, limit = {'algorithm': 'scrypt', 'n': 2 ** 10, 'r': 8, 'p': 1, 'dklen': 32}, 'n', 2 ** 10, max_cost
+    else:
+        params, cost_key, cost, limit = {'algorithm': 'pbkdf2_sha256', 'iterations': 10_000, 'dklen': 32}, 'iterations', 10_000, max_cost * 1000
+    salt = os.urandom(16).hex()
+    best = None
+    while cost <= limit:
+        params[cost_key] = cost
+        start = time.perf_counter()
+        derive_key('calibration-password', salt, params)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if best is None or abs(elapsed_ms - target_ms) < abs(best[1] - target_ms):
+            best = (cost, elapsed_ms)
+        if elapsed_ms >= target_ms:
+            break
+        cost *= 2
+    params[cost_key], measured_ms = best
+    return params, measured_ms
+
+
+# Shared hasher used by the application; its thread pool is started on first use.
+password_hasher = PasswordHasher(_params_from_env())
@@ -0,0 +1,326 @@
+"""
+This module provides rate limiting and usage accounting for calls to the language model.
+
+A `RateLimiter` keeps token buckets for requests per minute and (estimated) model tokens
+per minute, both globally and for each hospital, so a burst of feedback requests is spread
+out instead of exhausting the model quota and then failing every call:
+- A call is admitted once every bucket has room. If a bucket is short, the caller waits
+  (queues) for it to refill, up to `max_wait` seconds; a call that would have to wait
+  longer is rejected at once, and the time after which it may succeed is recorded.
+- Token use is reserved up front from an estimate and settled once the response is known.
+- `admit` returns an `Admission` for a call, which also meters the retries and hedged
+  requests `modules.resilience` may send for it: each takes its own slot without queueing,
+  and is skipped when none is free.
+- Per-hospital usage counters (requests, tokens, queued and rejected calls, failures) are
+  kept for the admin page.
+
+A `DailyBudget` caps optional, speculative model spend per hospital per calendar day.
+
+Limits are read from the environment: `CARELOG_LLM_RPM` and `CARELOG_LLM_TPM` (global),
+`CARELOG_LLM_HOSPITAL_RPM` and `CARELOG_LLM_HOSPITAL_TPM` (per hospital), and
+`CARELOG_LLM_MAX_WAIT` (seconds); a limit of 0 disables it. They apply per process, so with
+several app replicas each one should get its share of the quota.
+"""
+# carelog/modules/ratelimit.py
+
+import os
+import threading
+import time
+from datetime import date
+
+# Defaults match the free tier of the Gemini API for Gemma models.
+DEFAULT_LIMITS = {
+    'requests_per_minute': 30,
+    'tokens_per_minute': 15000,
+    'hospital_requests_per_minute': 10,
+    'hospital_tokens_per_minute': 5000,
+}
+DEFAULT_MAX_WAIT_SECONDS = 10.0
+# Expected completion size used to reserve tokens before a call (a paragraph of ~200 words).
+COMPLETION_TOKEN_ESTIMATE = 300
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimates the number of model tokens in a text (about four characters per token)."""
+    return len(text or '') // 4 + 1
+
+
+class TokenBucket:
+    """A bucket of `capacity` units that refills continuously at `per_minute` units a minute."""
+
+    def __init__(self, per_minute: float, capacity: float = None):
+        """Initializes a full bucket.
+
+        Args:
+            per_minute (float): The refill rate.
+            capacity (float, optional): The largest burst; defaults to one minute's worth.
+        """
+        self.rate = per_minute / 60.0
+        self.capacity = capacity or per_minute
+        self.level = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Returns how many seconds until `amount` units are available (0 if they are now).
+
+        Amounts larger than the capacity only wait for a full bucket, so they are never
+        blocked forever.
+        """
+        self._refill(now)
+        shortfall = min(amount, self.capacity) - self.level
+        return max(0.0, shortfall / self.rate)
+
+    def consume(self, amount: float):
+        """Takes units from the bucket; the level may go negative (debt repaid by the refill)."""
+        self.level -= amount
+
+    def refund(self, amount: float):
+        """Returns units to the bucket, up to its capacity."""
+        self.level = min(self.capacity, self.level + amount)
+
+
+def _new_usage() -> dict:
+    return {'requests': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'queued': 0,
+            'queued_seconds': 0.0, 'rejected': 0, 'failures': 0, 'retry_after_seconds': 0.0,
+            'last_request': None}
+
+
+class RateLimiter:
+    """Admits model calls within global and per-hospital request and token rates."""
+
+    def __init__(self, limits: dict = None, max_wait: float = DEFAULT_MAX_WAIT_SECONDS):
+        """Initializes the limiter.
+
+        Args:
+            limits (dict, optional): Per-minute limits with the keys of `DEFAULT_LIMITS`;
+                missing keys use the defaults and 0 or None disables a limit.
+            max_wait (float): The longest a call may queue before it is rejected.
+        """
+        self.limits = dict(DEFAULT_LIMITS, **(limits or {}))
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._global = self._new_buckets('')
+        self._hospitals = {}
+        self._usage = {}
+
+    def _new_buckets(self, prefix: str) -> dict:
+        buckets = {}
+        for unit in ('requests', 'tokens'):
+            per_minute = self.limits.get(f'{prefix}{unit}_per_minute')
+            if per_minute:
+                buckets[unit] = TokenBucket(per_minute)
+        return buckets
+
+    def _buckets(self, hospital_id: str) -> list:
+        """Returns the buckets a call of a hospital draws from, as `(unit, bucket)` pairs."""
+        hospital = self._hospitals.get(hospital_id)
+        if hospital is None:
+            hospital = self._hospitals[hospital_id] = self._new_buckets('hospital_')
+        return list(self._global.items()) + list(hospital.items())
+
+    def _usage_of(self, hospital_id: str) -> dict:
+        usage = self._usage.get(hospital_id)
+        if usage is None:
+            usage = self._usage[hospital_id] = _new_usage()
+        return usage
+
+    def acquire(self, hospital_id: str, tokens: int, max_wait: float = None) -> bool:
+        """Admits one call, queueing until every bucket has room.
+
+        Args:
+            hospital_id (str): The hospital making the call.
+            tokens (int): The tokens to reserve (prompt plus expected completion).
+            max_wait (float, optional): The longest this call may queue, instead of `max_wait`.
+
+        Returns:
+            bool: True if the call may proceed, False if it was rejected because it would
+                  have to wait longer than `max_wait`.
+        """
+        max_wait = self.max_wait if max_wait is None else max_wait
+        start = time.monotonic()
+        queued = False
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                amounts = {'requests': 1, 'tokens': tokens}
+                buckets = self._buckets(hospital_id)
+                wait = max([bucket.wait_time(amounts[unit], now) for unit, bucket in buckets], default=0.0)
+                usage = self._usage_of(hospital_id)
+                if wait <= 0:
+                    for unit, bucket in buckets:
+                        bucket.consume(amounts[unit])
+                    usage['requests'] += 1
+                    if queued:
+                        usage['queued'] += 1
+                        usage['queued_seconds'] += now - start
+                    usage['last_request'] = time.time()
+                    return True
+                if now - start + wait > max_wait:
+                    usage['rejected'] += 1
+                    usage['retry_after_seconds'] = wait
+                    return False
+            queued = True
+            time.sleep(wait)
+
+    def settle(self, hospital_id: str, reserved: int, prompt_tokens: int, completion_tokens: int,
+               ok: bool = True):
+        """Records the outcome of an admitted call and corrects its token reservation.
+
+        Args:
+            hospital_id (str): The hospital that made the call.
+            reserved (int): The tokens passed to `acquire`.
+            prompt_tokens (int): The tokens sent.
+            completion_tokens (int): The tokens received (0 if the call failed).
+            ok (bool): Whether the call succeeded.
+        """
+        difference = reserved - prompt_tokens - completion_tokens
+        with self._lock:
+            for unit, bucket in self._buckets(hospital_id):
+                if unit != 'tokens':
+                    continue
+                if difference > 0:
+                    bucket.refund(difference)
+                else:
+                    bucket.consume(-difference)
+            usage = self._usage_of(hospital_id)
+            usage['prompt_tokens'] += prompt_tokens
+            usage['completion_tokens'] += completion_tokens
+            usage['failures'] += not ok
+
+    def admit(self, hospital_id: str, tokens: int, max_wait: float = None):
+        """Admits one call like `acquire` and returns its `Admission`, or None if it was rejected."""
+        if not self.acquire(hospital_id, tokens, max_wait):
+            return None
+        return Admission(self, hospital_id, tokens)
+
+    def usage(self, hospital_id: str = None) -> dict:
+        """Returns usage counters since the process started.
+
+        Args:
+            hospital_id (str, optional): The hospital to report; all hospitals if omitted.
+
+        Returns:
+            dict: The counters of one hospital (`requests`, `prompt_tokens`,
+                  `completion_tokens`, `queued`, `queued_seconds`, `rejected`, `failures`,
+                  `retry_after_seconds` of the last rejection, and `last_request` as a Unix
+                  time), or a dictionary of them by hospital ID.
+        """
+        with self._lock:
+            if hospital_id is not None:
+                return dict(self._usage.get(hospital_id) or _new_usage())
+            return {hid: dict(usage) for hid, usage in self._usage.items()}
+
+
+class Admission:
+    """An admitted call and the extra requests (retries and hedges) admitted for it."""
+
+    def __init__(self, limiter: RateLimiter, hospital_id: str, tokens: int):
+        """Initializes the admission of a call that reserved `tokens`."""
+        self.limiter = limiter
+        self.hospital_id = hospital_id
+        self.tokens = tokens
+        self.extra = 0
+
+    def admit(self) -> bool:
+        """Admits one more request for the call if there is room now; it never queues."""
+        if not self.limiter.acquire(self.hospital_id, self.tokens, max_wait=0):
+            return False
+        self.extra += 1
+        return True
+
+    def settle(self, prompt_tokens: int, completion_tokens: int, ok: bool = True):
+        """Settles the call and its extra requests.
+
+        The extra requests are counted with their prompt and an estimated completion, and
+        their reservations are kept: a losing hedge or an attempt abandoned at the deadline
+        may still be running, and its use cannot be measured.
+        """
+        self.limiter.settle(self.hospital_id, self.tokens, prompt_tokens, completion_tokens, ok)
+        for _ in range(self.extra):
+            self.limiter.settle(self.hospital_id, self.tokens, prompt_tokens, self.tokens - prompt_tokens)
+
+
+class DailyBudget:
+    """Caps the estimated tokens spent per hospital per day on optional work."""
+
+    def __init__(self, tokens_per_day: int):
+        """Initializes the budget.
+
+        Args:
+            tokens_per_day (int): The tokens each hospital may spend per calendar day; 0
+                allows nothing.
+        """
+        self.tokens_per_day = tokens_per_day
+        self._lock = threading.Lock()
+        self._spend = {}
+
+    def _spend_of(self, hospital_id: str) -> dict:
+        today = date.today().isoformat()
+        spend = self._spend.get(hospital_id)
+        if spend is None or spend['day'] != today:
+            spend = self._spend[hospital_id] = {'day': today, 'tokens': 0, 'calls': 0, 'skipped': 0}
+        return spend
+
+    def try_spend(self, hospital_id: str, tokens: int) -> bool:
+        """Charges tokens to today's budget of a hospital if they fit.
+
+        Args:
+            hospital_id (str): The hospital spending the tokens.
+            tokens (int): The estimated tokens of the call.
+
+        Returns:
+            bool: True if the tokens were charged, False if they would exceed the budget.
+        """
+        with self._lock:
+            spend = self._spend_of(hospital_id)
+            if spend['tokens'] + tokens > self.tokens_per_day:
+                spend['skipped'] += 1
+                return False
+            spend['tokens'] += tokens
+            spend['calls'] += 1
+            return True
+
+    def exhausted(self, hospital_id: str) -> bool:
+        """Checks whether a hospital has spent today's whole budget, counting a skipped call if so.
+
+        Args:
+            hospital_id (str): The hospital about to queue optional work.
+
+        Returns:
+            bool: True if no tokens are left today, so the work should not be queued.
+        """
+        with self._lock:
+            spend = self._spend_of(hospital_id)
+            if spend['tokens'] < self.tokens_per_day:
+                return False
+            spend['skipped'] += 1
+            return True
+
+    def usage(self, hospital_id: str) -> dict:
+        """Returns today's `tokens`, `calls`, and `skipped` calls of a hospital, and the `limit`."""
+        with self._lock:
+            return dict(self._spend_of(hospital_id), limit=self.tokens_per_day)
+
+
+def configured_limits() -> dict:
+    """Returns the limits set by the `CARELOG_LLM_*` environment variables, over the defaults."""
+    variables = {
+        'requests_per_minute': 'CARELOG_LLM_RPM',
+        'tokens_per_minute': 'CARELOG_LLM_TPM',
+        'hospital_requests_per_minute': 'CARELOG_LLM_HOSPITAL_RPM',
+        'hospital_tokens_per_minute': 'CARELOG_LLM_HOSPITAL_TPM',
+    }
+    limits = dict(DEFAULT_LIMITS)
+    for name, variable in variables.items():
+        if os.environ.get(variable):
+            limits[name] = float(os.environ[variable])
+    return limits
+
+
+def configured_max_wait() -> float:
+    """Returns the longest queueing time, from `CARELOG_LLM_MAX_WAIT` if set."""
+    return float(os.environ.get('CARELOG_LLM_MAX_WAIT') or DEFAULT_MAX_WAIT_SECONDS)
@@ -0,0 +1,315 @@
+"""
+This module makes calls to the language model bounded in time and tolerant of a degraded provider.
+
+`ResilientProvider` wraps any provider of `modules.llm` and keeps its `generate(prompt)`
+interface, adding:
+- A deadline for the whole call, including retries, so a Streamlit session thread is never
+  pinned by a hung request. Each attempt runs on a daemon thread and is abandoned (not
+  interrupted) once the deadline passes; the provider's own timeout then ends it.
+- Retries of failed attempts with capped exponential backoff and full jitter, so clients
+  that failed together do not retry together. Errors marked as not retryable (such as a
+  rejected request) are raised at once.
+- Optional hedging: when an attempt is slower than a percentile of recent latencies, one
+  duplicate request is sent and the first answer wins. This trims the latency tail at the
+  cost of extra model calls, so it is off by default.
+- A `CircuitBreaker` that, after several consecutive failures, fails calls immediately for
+  a cool-down period and then lets a single trial call through to probe the provider.
+
+Every request after the first (a retry or a hedge) is a separate model call. Callers that
+meter model calls pass an `admit` hook to `generate`, which is asked before each of them;
+when it refuses, the retry or hedge is skipped (see `modules.ratelimit.Admission`).
+
+The settings are read from the environment by `configured_resilience`:
+`CARELOG_LLM_DEADLINE` (seconds), `CARELOG_LLM_RETRIES`, `CARELOG_LLM_HEDGE_PERCENTILE`
+(0 to 1; 0 disables hedging), `CARELOG_LLM_BREAKER_FAILURES`, and
+`CARELOG_LLM_BREAKER_RESET` (seconds).
+"""
+# carelog/modules/resilience.py
+
+import os
+import queue
+import random
+import threading
+import time
+from collections import deque
+
+from modules.llm import LLMError
+
+DEFAULT_DEADLINE_SECONDS = 25.0
+DEFAULT_RETRIES = 2
+DEFAULT_BACKOFF_SECONDS = 0.5
+DEFAULT_MAX_BACKOFF_SECONDS = 8.0
+DEFAULT_HEDGE_PERCENTILE = 0.0
+DEFAULT_BREAKER_FAILURES = 5
+DEFAULT_BREAKER_RESET_SECONDS = 30.0
+# Successful latencies kept to compute the hedging delay and the reported percentiles.
+LATENCY_WINDOW = 200
+# Hedging waits for this many samples so one fast call does not set the delay.
+MIN_HEDGE_SAMPLES = 20
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(LLMError):
+    """Raised without calling the provider while the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """Stops calling a failing provider for a while after consecutive failures."""
+
+    def __init__(self, failure_threshold: int = DEFAULT_BREAKER_FAILURES,
+                 reset_seconds: float = DEFAULT_BREAKER_RESET_SECONDS):
+        """Initializes a closed breaker.
+
+        Args:
+            failure_threshold (int): Consecutive failed attempts that open the breaker; 0
+                disables it.
+            reset_seconds (float): How long the breaker stays open before a trial call.
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = CLOSED
+        self.failures = 0
+        self.opened = 0
+        self._opened_at = 0.0
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Checks whether a call may go to the provider.
+
+        While open, calls are refused until `reset_seconds` have passed; then one trial call
+        is allowed (half-open) and the others are refused until it finishes.
+        """
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self._opened_at >= self.reset_seconds:
+                self.state = HALF_OPEN
+                self._trial = False
+            if self.state == HALF_OPEN:
+                if self._trial:
+                    return False
+                self._trial = True
+            return self.state != OPEN
+
+    def record_success(self):
+        """Closes the breaker and resets the failure count."""
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self._trial = False
+
+    def record_failure(self):
+        """Counts a failed attempt, opening the breaker at the threshold or after a failed trial."""
+        with self._lock:
+            self.failures += 1
+            if not self.failure_threshold:
+                return
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self.opened += 1
+                self.state = OPEN
+                self._opened_at = time.monotonic()
+                self._trial = False
+
+    def retry_after(self) -> float:
+        """Returns the seconds until an open breaker allows a trial call (0 if it is not open)."""
+        with self._lock:
+            if self.state != OPEN:
+                return 0.0
+            return max(0.0, self.reset_seconds - (time.monotonic() - self._opened_at))
+
+
+def _percentile(values, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class ResilientProvider:
+    """Adds a deadline, jittered retries, optional hedging, and a circuit breaker to a provider."""
+
+    def __init__(self, provider, deadline: float = DEFAULT_DEADLINE_SECONDS, retries: int = DEFAULT_RETRIES,
+                 backoff: float = DEFAULT_BACKOFF_SECONDS, max_backoff: float = DEFAULT_MAX_BACKOFF_SECONDS,
+                 hedge_percentile: float = DEFAULT_HEDGE_PERCENTILE, breaker: CircuitBreaker = None,
+                 seed: int = None):
+        """Initializes the wrapper.
+
+        Args:
+            provider: The provider to call; anything with `generate(prompt)` and `close()`.
+            deadline (float): The longest a call may take in seconds, retries included.
+            retries (int): Further attempts after a failed one.
+            backoff (float): The base delay before the first retry; it doubles per retry.
+            max_backoff (float): The longest delay before a retry.
+            hedge_percentile (float): Sends a duplicate request when an attempt is slower
+                than this percentile (0 to 1) of recent latencies; 0 disables hedging.
+            breaker (CircuitBreaker, optional): The circuit breaker; a default one if omitted.
+            seed (int, optional): Seeds the backoff jitter for repeatable runs.
+        """
+        self.provider = provider
+        self.name = getattr(provider, 'name', 'model')
+        self.deadline = deadline
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.hedge_percentile = hedge_percentile
+        self.breaker = breaker or CircuitBreaker()
+        self._random = random.Random(seed)
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._lock = threading.Lock()
+        self._metrics = {'calls': 0, 'attempts': 0, 'retries': 0, 'hedges': 0, 'hedge_wins': 0,
+                         'timeouts': 0, 'failures': 0, 'short_circuited': 0, 'throttled': 0}
+
+    def _count(self, metric: str):
+        with self._lock:
+            self._metrics[metric] += 1
+
+    def _hedge_delay(self):
+        """Returns the latency after which an attempt is hedged, or None if hedging is off."""
+        if not self.hedge_percentile:
+            return None
+        with self._lock:
+            if len(self._latencies) < MIN_HEDGE_SAMPLES:
+                return None
+            return _percentile(self._latencies, self.hedge_percentile)
+
+    def _launch(self, prompt: str, results: queue.Queue, hedge: bool):
+        """Starts one attempt on a daemon thread that puts `(hedge, text, error)` on `results`."""
+        self._count('attempts')
+
+        def attempt():
+            try:
+                results.put((hedge, self.provider.generate(prompt), None))
+            except Exception as e:
+                results.put((hedge, None, e))
+
+        threading.Thread(target=attempt, name='llm-attempt', daemon=True).start()
+
+    def _attempt(self, prompt: str, deadline: float, admit=None) -> str:
+        """Runs one attempt, hedged if it is slow, and returns the first successful answer.
+
+        Raises:
+            TimeoutError: If the deadline passes first.
+            Exception: The error of the attempt (or of both requests, if hedged).
+        """
+        results = queue.Queue()
+        start = time.monotonic()
+        self._launch(prompt, results, hedge=False)
+        outstanding = 1
+        hedge_at = self._hedge_delay()
+        hedge_at = start + hedge_at if hedge_at is not None else None
+        error = None
+        while outstanding:
+            now = time.monotonic()
+            wait_until = min(deadline, hedge_at) if hedge_at is not None else deadline
+            try:
+                hedged, text, error = results.get(timeout=max(0.0, wait_until - now))
+            except queue.Empty:
+                if hedge_at is not None and time.monotonic() < deadline:
+                    hedge_at = None
+                    if admit is not None and not admit():
+                        self._count('throttled')
+                        continue
+                    self._count('hedges')
+                    self._launch(prompt, results, hedge=True)
+                    outstanding += 1
+                    continue
+                raise TimeoutError("no response before the deadline")
+            outstanding -= 1
+            if error is None:
+                with self._lock:
+                    self._latencies.append(time.monotonic() - start)
+                    self._metrics['hedge_wins'] += hedged
+                return text
+        raise error
+
+    def generate(self, prompt: str, deadline: float = None, admit=None) -> str:
+        """Generates a response to a prompt within the deadline.
+
+        Args:
+            prompt (str): The prompt.
+            deadline (float, optional): A shorter deadline for this call, in seconds, e.g.
+                what is left of a caller's latency budget.
+            admit (callable, optional): Called without arguments before every retry and
+                hedge; returning False skips it. The first attempt is the caller's to meter.
+
+        Raises:
+            CircuitOpenError: If the circuit breaker is open.
+            LLMError: If every attempt failed or the deadline passed.
+        """
+        self._count('calls')
+        deadline = time.monotonic() + min(self.deadline, deadline if deadline is not None else self.deadline)
+        last_error = None
+        for attempt in range(self.retries + 1):
+            if not self.breaker.allow():
+                self._count('short_circuited')
+                raise CircuitOpenError(f"The {self.name} provider is unavailable; retry in "
+                                       f"{self.breaker.retry_after():.0f}s.") from last_error
+            if attempt:
+                if admit is not None and not admit():
+                    self._count('throttled')
+                    break
+                self._count('retries')
+            try:
+                text = self._attempt(prompt, deadline, admit)
+            except TimeoutError as e:
+                self._count('timeouts')
+                self._count('failures')
+                self.breaker.record_failure()
+                raise LLMError(f"The {self.name} provider timed out: {e}.") from e
+            except Exception as e:
+                last_error = e
+                if not getattr(e, 'retryable', True):
+                    # The provider answered, it rejected this request; it is not degraded.
+                    self.breaker.record_success()
+                    break
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+                return text
+            # Full jitter: a random delay up to the capped exponential backoff.
+            delay = self._random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+            if attempt == self.retries or time.monotonic() + delay >= deadline:
+                break
+            time.sleep(delay)
+        self._count('failures')
+        if isinstance(last_error, LLMError):
+            raise last_error
+        raise LLMError(f"The {self.name} provider failed: {last_error!r}") from last_error
+
+    def metrics(self) -> dict:
+        """Returns call counters, the breaker state, and recent latency percentiles.
+
+        Returns:
+            dict: Counts of `calls`, `attempts`, `retries`, `hedges`, `hedge_wins`,
+                  `timeouts`, `failures`, `short_circuited` calls, and retries and hedges
+                  `throttled` by the `admit` hook; the `breaker` state,
+                  how often it `breaker_opened`, and its `retry_after_seconds`; and the
+                  `p50_seconds` and `p95_seconds` of recent successful calls (None without
+                  samples).
+        """
+        with self._lock:
+            metrics = dict(self._metrics)
+            latencies = list(self._latencies)
+        metrics['breaker'] = self.breaker.state
+        metrics['breaker_opened'] = self.breaker.opened
+        metrics['retry_after_seconds'] = self.breaker.retry_after()
+        metrics['p50_seconds'] = _percentile(latencies, 0.5) if latencies else None
+        metrics['p95_seconds'] = _percentile(latencies, 0.95) if latencies else None
+        return metrics
+
+    def close(self):
+        """Closes the wrapped provider."""
+        self.provider.close()
+
+
+def configured_resilience() -> dict:
+    """Returns the `ResilientProvider` options set by the `CARELOG_LLM_*` environment variables."""
+    return {
+        'deadline': float(os.environ.get('CARELOG_LLM_DEADLINE') or DEFAULT_DEADLINE_SECONDS),
+        'retries': int(os.environ.get('CARELOG_LLM_RETRIES') or DEFAULT_RETRIES),
+        'hedge_percentile': float(os.environ.get('CARELOG_LLM_HEDGE_PERCENTILE') or DEFAULT_HEDGE_PERCENTILE),
+        'breaker': CircuitBreaker(
+            int(os.environ.get('CARELOG_LLM_BREAKER_FAILURES') or DEFAULT_BREAKER_FAILURES),
+            float(os.environ.get('CARELOG_LLM_BREAKER_RESET') or DEFAULT_BREAKER_RESET_SECONDS)),
+    }
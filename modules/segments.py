@@ -0,0 +1,503 @@
+"""
+This module provides the segmented, encrypted container format for the application's data file.
+
+Instead of encrypting the whole dataset as a single token, the dataset is split into
+segments that are serialized and encrypted independently:
+- one `meta` segment per hospital, holding its users, alerts, and any other fields;
+- `notes` segments per hospital, each holding a batch of consecutive notes;
+- `chats` segments per hospital, each holding the general and direct threads of a batch
+  of patients;
+- a `summaries` segment per hospital that has cached patient-history summaries, so
+  updating a summary does not re-encrypt the hospital's users;
+- a `top` segment for any top-level fields besides `hospitals`.
+
+Each hospital's segments are encrypted with that hospital's own data key from a
+`modules.encryption.DataKeyring` (envelope encryption). The container starts with a
+plaintext header line, followed by the wrapped data keys (identified by random key ids),
+an index encrypted with the store's data key, and the segment tokens. The index records
+where each segment lives, which key encrypts it, and which patients it covers, and is
+encrypted itself so that no usernames or hospital IDs are stored in the clear. A reader
+decrypts the index and then only the segments it needs: the service reloads only the
+hospitals whose segments another process rewrote, and one patient's notes can be read
+without decrypting the rest of the hospital.
+
+Segments can be decrypted and parsed in parallel by a process pool (`open_pool`), one task
+per segment; the reassembly into a dataset stays in the calling process.
+
+`SegmentWriter` remembers the plaintext and token of every segment it has written, so a
+save that names what changed only serializes and re-encrypts those segments; appending a
+note rewrites the hospital's last note batch and the index, not the whole store.
+"""
+# carelog/modules/segments.py
+
+import hashlib
+import time
+
+from cryptography.fernet import Fernet
+
+from modules.encryption import STORE_KEY_OWNER
+from modules.serialization import decode_payload, encode_payload
+
+CONTAINER_MAGIC = b'CARELOG-SEGMENTS'
+CONTAINER_VERSION = 2
+# Notes per `notes` segment; a save re-encrypts at least one batch of the hospital written to.
+NOTE_BATCH_SIZE = 1000
+# Patients per `chats` segment.
+CHAT_BATCH_SIZE = 100
+
+
+def is_segmented(payload: bytes) -> bool:
+    """Checks whether a snapshot payload is a segmented container (rather than a single token)."""
+    return payload.startswith(CONTAINER_MAGIC)
+
+
+def open_segment(key: bytes, token: bytes):
+    """Decrypts and decodes one segment.
+
+    This is a module-level function so it can be executed in worker processes.
+
+    Args:
+        key (bytes): The unwrapped data key of the segment.
+        token (bytes): The encrypted segment.
+
+    Returns:
+        The decoded segment.
+    """
+    return decode_payload(Fernet(key).decrypt(token))
+
+
+def open_pool(workers: int):
+    """Starts a process pool for decoding segments, with all of its workers running.
+
+    Workers are started by a fork server (or spawned where there is none) rather than
+    forked from the caller, so they begin from a clean interpreter and never inherit a lock
+    held by another thread of the server. They are all started before the pool is returned,
+    so a caller that opens the pool before taking its locks pays the start-up time outside them.
+
+    Args:
+        workers (int): The number of worker processes.
+
+    Returns:
+        ProcessPoolExecutor or None: The pool, or None if `workers` is below 2 or processes
+                                     cannot be started on this platform.
+    """
+    if workers < 2:
+        return None
+    try:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+        # A task that finds no idle worker starts a new one, so this starts all of them.
+        list(pool.map(int, range(workers)))
+        return pool
+    except (OSError, NotImplementedError) as e:
+        print(f"Warning: Segment decoding pool unavailable ({e}). Decoding inline.")
+        return None
+
+
+def split_hospital(hospital_id: str, hospital: dict, note_batch: int = NOTE_BATCH_SIZE,
+                   chat_batch: int = CHAT_BATCH_SIZE) -> list:
+    """Lists a hospital's segments without building them.
+
+    Args:
+        hospital_id (str): The ID of the hospital.
+        hospital (dict): The hospital's data.
+        note_batch (int): The number of notes per `notes` segment.
+        chat_batch (int): The number of patients per `chats` segment.
+
+    Returns:
+        list: `(key, build)` pairs in container order, where `key` is
+              `(hospital_id, kind, batch)` and `build()` returns the segment's
+              `(value, patients)`, so segments that are not needed are never sliced.
+    """
+    segments = [((hospital_id, 'meta', 0), lambda: (
+        {key: value for key, value in hospital.items() if key not in ('notes', 'chats', 'summaries')}, []
+    ))]
+    summaries = hospital.get('summaries')
+    if summaries:
+        segments.append(((hospital_id, 'summaries', 0), lambda: (summaries, sorted(summaries))))
+    notes = hospital.get('notes')
+    if notes is not None:
+        def note_chunk(start):
+            chunk = notes[start:start + note_batch]
+            return chunk, sorted({note.get('patient_id') for note in chunk if note.get('patient_id')})
+        for batch, start in enumerate(range(0, len(notes), note_batch)):
+            segments.append(((hospital_id, 'notes', batch), lambda start=start: note_chunk(start)))
+        if not notes:
+            segments.append(((hospital_id, 'notes', 0), lambda: ([], [])))
+    chats = hospital.get('chats')
+    if chats is not None:
+        general, direct = chats.get('general', {}), chats.get('direct', {})
+        patients = list(dict.fromkeys(list(general) + list(direct)))
+
+        def chat_chunk(batch, start):
+            names = patients[start:start + chat_batch]
+            chunk = {
+                'general': {name: general[name] for name in names if name in general},
+                'direct': {name: direct[name] for name in names if name in direct},
+            }
+            if batch == 0:
+                chunk.update({key: value for key, value in chats.items() if key not in ('general', 'direct')})
+            return chunk, names
+        for batch, start in enumerate(range(0, max(len(patients), 1), chat_batch)):
+            segments.append(((hospital_id, 'chats', batch), lambda batch=batch, start=start: chat_chunk(batch, start)))
+    return segments
+
+
+def split_dataset(data: dict, note_batch: int = NOTE_BATCH_SIZE, chat_batch: int = CHAT_BATCH_SIZE) -> list:
+    """Splits a dataset into segments.
+
+    Args:
+        data (dict): The dataset, with hospitals under the `hospitals` key.
+        note_batch (int): The number of notes per `notes` segment.
+        chat_batch (int): The number of patients per `chats` segment.
+
+    Returns:
+        list: `(key, value, patients)` tuples, where `key` is `(hospital_id, kind, batch)`
+              and `patients` lists the patient usernames the segment covers.
+    """
+    segments = []
+    top = {key: value for key, value in data.items() if key != 'hospitals'}
+    if top:
+        segments.append(((None, 'top', 0), top, []))
+    for hospital_id, hospital in data.get('hospitals', {}).items():
+        for key, build in split_hospital(hospital_id, hospital, note_batch, chat_batch):
+            segments.append((key,) + build())
+    return segments
+
+
+def merge_segment(data: dict, entry: dict, value):
+    """Merges a decoded segment back into a dataset being reassembled.
+
+    Args:
+        data (dict): The dataset being rebuilt; modified in place.
+        entry (dict): The segment's index entry.
+        value: The decoded segment.
+    """
+    kind = entry['kind']
+    if kind == 'top':
+        data.update(value)
+        return
+    hospital = data.setdefault('hospitals', {}).setdefault(entry['hospital'], {})
+    if kind == 'meta':
+        hospital.update(value)
+    elif kind == 'notes':
+        hospital.setdefault('notes', []).extend(value)
+    elif kind == 'summaries':
+        hospital.setdefault('summaries', {}).update(value)
+    elif kind == 'chats':
+        chats = hospital.setdefault('chats', {'general': {}, 'direct': {}})
+        for key, part in value.items():
+            if key in ('general', 'direct'):
+                chats.setdefault(key, {}).update(part)
+            else:
+                chats[key] = part
+
+
+class SegmentWriter:
+    """Builds segmented containers, re-serializing and re-encrypting only the segments that changed.
+
+    The writer keeps the serialized plaintext of every segment it has encoded, and the token
+    of every segment it has written or adopted from a loaded container. `encode` is told
+    which hospitals, or which of their segments, changed since the previous call, and reuses
+    the plaintext of all others without reading them; `seal` reuses the token of every
+    segment whose plaintext and data key are unchanged.
+    """
+
+    def __init__(self, note_batch: int = NOTE_BATCH_SIZE, chat_batch: int = CHAT_BATCH_SIZE):
+        """Initializes the writer with empty caches.
+
+        Args:
+            note_batch (int): The number of notes per `notes` segment.
+            chat_batch (int): The number of patients per `chats` segment.
+        """
+        self.note_batch = note_batch
+        self.chat_batch = chat_batch
+        self._cache = {}
+        self._plaintexts = {}
+        self._settings = None
+        self.metrics = {'writes': 0, 'segments_serialized': 0, 'segments_encrypted': 0, 'segments_reused': 0}
+
+    def encode(self, data: dict, codec: str = 'json', compression: str = None, level: int = None,
+               changes: dict = None) -> list:
+        """Splits and serializes a dataset; this is the part that must see a consistent dataset.
+
+        Args:
+            data (dict): The dataset to encode.
+            codec (str): The serialization codec for every segment.
+            compression (str, optional): The compressor for every segment.
+            level (int, optional): The compression level.
+            changes (dict, optional): What changed since the previous call, by owner (a
+                hospital ID, or None for the top-level fields): None if anything of the owner
+                may have changed, or a set of `(kind, batch)` pairs, where a batch of None
+                stands for every batch of that kind. Owners that are not listed are reused
+                as they were, unless they were never encoded. Omit it to serialize everything.
+
+        Returns:
+            list: `(key, plaintext, patients)` tuples, ready for `seal`.
+        """
+        settings = (codec, compression, level)
+        previous = self._plaintexts if settings == self._settings else {}
+        plaintexts, encoded = {}, []
+        top = {key: value for key, value in data.items() if key != 'hospitals'}
+        owners = [(None, [((None, 'top', 0), lambda: (top, []))])] if top else []
+        owners += [(hospital_id, hospital) for hospital_id, hospital in data.get('hospitals', {}).items()]
+        for owner, hospital in owners:
+            cached = previous.get(owner)
+            if cached is not None and changes is not None and owner not in changes:
+                plaintexts[owner] = cached
+                encoded.extend((key, plaintext, patients) for key, (plaintext, patients) in cached.items())
+                continue
+            marked = None if changes is None else changes.get(owner)
+            segments = hospital if owner is None else split_hospital(owner, hospital, self.note_batch, self.chat_batch)
+            current = {}
+            for key, build in segments:
+                _, kind, batch = key
+                reusable = (cached is not None and key in cached and marked is not None
+                            and (kind, batch) not in marked and (kind, None) not in marked)
+                if reusable:
+                    current[key] = cached[key]
+                else:
+                    value, patients = build()
+                    current[key] = (encode_payload(value, codec, compression, level), patients)
+                    self.metrics['segments_serialized'] += 1
+                encoded.append((key,) + current[key])
+            plaintexts[owner] = current
+        self._plaintexts, self._settings = plaintexts, settings
+        return encoded
+
+    def seal(self, encoded: list, keyring) -> bytes:
+        """Encrypts encoded segments with their hospitals' data keys and assembles the container.
+
+        Segments whose plaintext and data key are unchanged since the previous call reuse
+        their token; plaintext reused by `encode` is recognized without hashing it again.
+
+        Args:
+            encoded (list): The output of `encode`.
+            keyring (DataKeyring): Provides each hospital's data key, and the store key that
+                                   encrypts the index.
+
+        Returns:
+            bytes: The container payload.
+        """
+        cache, tokens, entries, offset = {}, [], [], 0
+        owners = {STORE_KEY_OWNER}
+        index_cipher = keyring.owner_cipher(STORE_KEY_OWNER)
+        for key, plaintext, patients in encoded:
+            hospital_id, kind, batch = key
+            owner = STORE_KEY_OWNER if hospital_id is None else hospital_id
+            owners.add(owner)
+            key_id = keyring.key_id(owner)
+            cached = self._cache.get(key)
+            if cached is not None and cached[3] is plaintext and cached[1] == key_id:
+                digest = cached[0]
+            else:
+                digest = hashlib.blake2b(plaintext, digest_size=16).digest()
+            if cached is not None and cached[:2] == (digest, key_id):
+                token = cached[2]
+                self.metrics['segments_reused'] += 1
+            else:
+                token = keyring.cipher(key_id).encrypt(plaintext)
+                self.metrics['segments_encrypted'] += 1
+            cache[key] = (digest, key_id, token, plaintext)
+            entries.append({
+                'hospital': hospital_id, 'kind': kind, 'batch': batch, 'key': key_id,
+                'offset': offset, 'length': len(token), 'patients': patients,
+            })
+            tokens.append(token)
+            offset += len(token)
+        self._cache = cache
+        self.metrics['writes'] += 1
+        wrapped, key_owners = keyring.export(owners)
+        keys = encode_payload({
+            'store': key_owners[STORE_KEY_OWNER],
+            'keys': {key_id: token.decode('ascii') for key_id, token in wrapped.items()},
+        })
+        index = index_cipher.encrypt(encode_payload({'owners': key_owners, 'segments': entries}))
+        header = b'%s %d %d %d\n' % (CONTAINER_MAGIC, CONTAINER_VERSION, len(keys), len(index))
+        return b''.join([header, keys, index] + tokens)
+
+    def unchanged(self, reader: 'SegmentReader') -> set:
+        """Returns the owners whose segments in a container are exactly the ones this writer last wrote or adopted.
+
+        Args:
+            reader (SegmentReader): The container to compare.
+
+        Returns:
+            set: Hospital IDs, and None for the top-level fields, whose segments need not be
+                 decrypted because their data is already held by the caller.
+        """
+        found, differ = {}, set()
+        for entry in reader.entries:
+            owner = entry['hospital']
+            key = (owner, entry['kind'], entry['batch'])
+            found.setdefault(owner, set()).add(key)
+            cached = self._cache.get(key)
+            if cached is None or 'key' not in entry or cached[1] != entry['key'] or cached[2] != reader.token(entry):
+                differ.add(owner)
+        cached_keys = {}
+        for key in self._cache:
+            cached_keys.setdefault(key[0], set()).add(key)
+        return {owner for owner, keys in found.items() if owner not in differ and keys == cached_keys.get(owner)}
+
+    def adopt(self, reader: 'SegmentReader'):
+        """Remembers the tokens of a container that was just loaded, as if this writer had written it.
+
+        Segments whose token matches the cached one keep their cached plaintext digest, so
+        they are still reused by the next `seal`; the others are re-encrypted on their next
+        write, as their plaintext is not known.
+
+        Args:
+            reader (SegmentReader): The loaded container.
+        """
+        cache = {}
+        for entry in reader.entries:
+            if 'key' not in entry:
+                continue
+            key = (entry['hospital'], entry['kind'], entry['batch'])
+            token = reader.token(entry)
+            cached = self._cache.get(key)
+            if cached is not None and cached[1] == entry['key'] and cached[2] == token:
+                cache[key] = cached
+            else:
+                cache[key] = (None, entry['key'], token, None)
+        self._cache = cache
+
+    def write(self, data: dict, keyring, codec: str = 'json', compression: str = None, level: int = None) -> bytes:
+        """Encodes and seals a dataset in one step.
+
+        Args:
+            data (dict): The dataset to write.
+            keyring (DataKeyring): Provides the data keys.
+            codec (str): The serialization codec for every segment.
+            compression (str, optional): The compressor for every segment.
+            level (int, optional): The compression level.
+
+        Returns:
+            bytes: The container payload.
+        """
+        return self.seal(self.encode(data, codec, compression, level), keyring)
+
+
+class SegmentReader:
+    """Reads a segmented container, decrypting only the segments that are requested."""
+
+    def __init__(self, payload: bytes, keyring):
+        """Parses the container header, adopts its wrapped data keys, and decrypts its index.
+
+        Args:
+            payload (bytes): The container payload.
+            keyring (DataKeyring): Receives the container's wrapped keys and unwraps them
+                                   through its key agent. Version 1 containers, whose
+                                   segments are encrypted with the master key itself, are
+                                   decrypted by the agent directly.
+
+        Raises:
+            ValueError: If the container is malformed, truncated, has an unsupported version,
+                        or needs a data key that is not available.
+        """
+        header, newline, rest = payload.partition(b'\n')
+        parts = header.split(b' ')
+        if not newline or len(parts) < 3 or parts[0] != CONTAINER_MAGIC:
+            raise ValueError("Segmented container header is malformed.")
+        try:
+            version, lengths = int(parts[1]), [int(part) for part in parts[2:]]
+        except ValueError:
+            raise ValueError("Segmented container header is malformed.") from None
+        if version not in (1, CONTAINER_VERSION) or len(lengths) != version:
+            raise ValueError(f"Unsupported segmented container version {version}.")
+        self.keyring = keyring
+        if version == 1:
+            index_length = lengths[0]
+            index = decode_payload(keyring.agent.unwrap(bytes(rest[:index_length])))
+        else:
+            keys_length, index_length = lengths
+            keys = decode_payload(bytes(rest[:keys_length]))
+            rest = rest[keys_length:]
+            keyring.load({key_id: token.encode('ascii') for key_id, token in keys['keys'].items()})
+            index = decode_payload(keyring.cipher(keys['store']).decrypt(bytes(rest[:index_length])))
+            keyring.load({}, index['owners'])
+        self._body = memoryview(rest)[index_length:]
+        self.entries = index['segments']
+        self.timings = {}
+        end = max((entry['offset'] + entry['length'] for entry in self.entries), default=0)
+        if end > len(self._body):
+            raise ValueError("Segmented container is truncated.")
+
+    def find(self, hospital_id: str = None, kind: str = None, patient: str = None) -> list:
+        """Returns the index entries matching all of the given filters.
+
+        Args:
+            hospital_id (str, optional): Only segments of this hospital.
+            kind (str, optional): Only segments of this kind ('meta', 'notes', 'chats', 'summaries',
+                or 'top').
+            patient (str, optional): Only segments covering this patient, plus the hospital's
+                                     `meta` segment, which covers every user.
+
+        Returns:
+            list: The matching index entries, in container order.
+        """
+        return [
+            entry for entry in self.entries
+            if (hospital_id is None or entry['hospital'] == hospital_id)
+            and (kind is None or entry['kind'] == kind)
+            and (patient is None or entry['kind'] == 'meta' or patient in entry['patients'])
+        ]
+
+    def token(self, entry: dict) -> bytes:
+        """Returns the encrypted token of a segment."""
+        return bytes(self._body[entry['offset']:entry['offset'] + entry['length']])
+
+    def plaintext(self, entry: dict) -> bytes:
+        """Decrypts a segment with its data key and returns its serialized payload."""
+        if 'key' not in entry:
+            return self.keyring.agent.unwrap(self.token(entry))
+        return self.keyring.cipher(entry['key']).decrypt(self.token(entry))
+
+    def read(self, entry: dict):
+        """Decrypts and decodes a single segment."""
+        return decode_payload(self.plaintext(entry))
+
+    def load(self, entries: list = None, pool=None) -> dict:
+        """Decrypts segments and reassembles them into a dataset.
+
+        The time spent is recorded in `timings`: `decode` (decrypting and parsing, in the
+        pool if one is given) and `merge` (reassembling the segments).
+
+        Args:
+            entries (list, optional): The index entries to load; all of them if omitted.
+            pool (Executor, optional): Decrypts and parses segments in parallel, one task per segment.
+
+        Returns:
+            dict: The (partial) dataset, with hospitals under the `hospitals` key.
+        """
+        entries = self.entries if entries is None else entries
+        start = time.perf_counter()
+        if pool is None:
+            values = [self.read(entry) for entry in entries]
+        else:
+            futures = [
+                pool.submit(open_segment, self.keyring.key(entry['key']), self.token(entry))
+                if 'key' in entry else None
+                for entry in entries
+            ]
+            values = [
+                self.read(entry) if future is None else future.result()
+                for entry, future in zip(entries, futures)
+            ]
+        decoded = time.perf_counter()
+        data = {'hospitals': {}}
+        for entry, value in zip(entries, values):
+            merge_segment(data, entry, value)
+        self.timings = {'decode': decoded - start, 'merge': time.perf_counter() - decoded}
+        return data
+
+    def patient_notes(self, hospital_id: str, patient: str) -> list:
+        """Returns one patient's notes, decrypting only the note batches that contain them."""
+        notes = []
+        for entry in self.find(hospital_id, 'notes', patient):
+            notes.extend(note for note in self.read(entry) if note.get('patient_id') == patient)
+        return notes
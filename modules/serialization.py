@@ -0,0 +1,261 @@
+"""
+This module provides the serialization codecs for the application's data file.
+
+It defines a small codec layer between the in-memory dataset and the bytes that are
+encrypted into `records.json`:
+- `JsonCodec`, compact JSON without indentation or padding whitespace (the default).
+- `MsgpackCodec`, a binary MessagePack encoding, available when the optional `msgpack`
+  package is installed.
+- A versioned header in front of every encoded payload that names the codec, so
+  `decode_payload` detects the format automatically and a deployment can switch codecs
+  without converting its data first. Payloads without a header are read as the legacy
+  pretty-printed JSON.
+- An optional compression stage (`zlib` or `lzma`, with a configurable level) applied to
+  the encoded body before encryption, and recorded in the same header.
+
+The codec and compression used for new writes are chosen with the `CARELOG_CODEC` and
+`CARELOG_COMPRESSION` (for example `zlib`, `zlib:9`, or `none`) environment variables.
+"""
+# carelog/modules/serialization.py
+
+import json
+import lzma
+import os
+import zlib
+
+from modules.models import json_default
+
+try:
+    import msgpack
+except ImportError:  # The binary codec is optional.
+    msgpack = None
+
+PAYLOAD_MAGIC = b'CARELOG-DATA'
+PAYLOAD_VERSION = 1
+DEFAULT_CODEC = 'json'
+DEFAULT_COMPRESSION = 'zlib'
+
+
+class JsonCodec:
+    """Encodes data as compact UTF-8 JSON."""
+    name = 'json'
+
+    def encode(self, data) -> bytes:
+        """Serializes data, including stored records, to bytes."""
+        return json.dumps(data, separators=(',', ':'), ensure_ascii=False, default=json_default).encode()
+
+    def decode(self, body: bytes):
+        """Parses bytes produced by `encode`."""
+        return json.loads(body)
+
+
+class MsgpackCodec:
+    """Encodes data as MessagePack."""
+    name = 'msgpack'
+
+    def encode(self, data) -> bytes:
+        """Serializes data, including stored records, to bytes."""
+        return msgpack.packb(data, default=json_default, use_bin_type=True)
+
+    def decode(self, body: bytes):
+        """Parses bytes produced by `encode`."""
+        return msgpack.unpackb(body, raw=False, strict_map_key=False)
+
+
+CODECS = {codec.name: codec for codec in (JsonCodec(), MsgpackCodec())}
+
+
+def available_codecs() -> list:
+    """Returns the names of the codecs that can be used in this environment."""
+    return [name for name in CODECS if name != 'msgpack' or msgpack is not None]
+
+
+def get_codec(name: str):
+    """Returns a codec by name.
+
+    Args:
+        name (str): The codec name ('json' or 'msgpack').
+
+    Returns:
+        The codec instance.
+
+    Raises:
+        ValueError: If the codec is unknown or its optional dependency is not installed.
+    """
+    if name not in available_codecs():
+        raise ValueError(f"Unsupported data codec '{name}'. Available: {', '.join(available_codecs())}.")
+    return CODECS[name]
+
+
+def configured_codec() -> str:
+    """Returns the codec for new writes, from `CARELOG_CODEC` if set.
+
+    The setting is checked when it is read, at startup, rather than at the first save: an
+    unknown codec, or one whose optional dependency is not installed, falls back to the
+    default with a warning.
+    """
+    name = (os.environ.get('CARELOG_CODEC') or DEFAULT_CODEC).strip().lower()
+    try:
+        get_codec(name)
+    except ValueError as e:
+        print(f"Warning: {e} Writing '{DEFAULT_CODEC}' instead.")
+        return DEFAULT_CODEC
+    return name
+
+
+class ZlibCompressor:
+    """Compresses with zlib (DEFLATE); fast, with a good ratio on note and message text."""
+    name = 'zlib'
+    default_level = 6
+    levels = range(-1, 10)
+
+    def compress(self, body: bytes, level: int) -> bytes:
+        """Compresses an encoded body at the given level (1-9)."""
+        return zlib.compress(body, level)
+
+    def decompress(self, body: bytes) -> bytes:
+        """Restores a body produced by `compress`."""
+        return zlib.decompress(body)
+
+
+class LzmaCompressor:
+    """Compresses with LZMA; slower than zlib, for smaller files and backups."""
+    name = 'lzma'
+    default_level = 1
+    levels = range(0, 10)
+
+    def compress(self, body: bytes, level: int) -> bytes:
+        """Compresses an encoded body at the given preset (0-9)."""
+        return lzma.compress(body, preset=level)
+
+    def decompress(self, body: bytes) -> bytes:
+        """Restores a body produced by `compress`."""
+        return lzma.decompress(body)
+
+
+COMPRESSORS = {compressor.name: compressor for compressor in (ZlibCompressor(), LzmaCompressor())}
+
+
+def get_compressor(name: str):
+    """Returns a compressor by name.
+
+    Args:
+        name (str): The compressor name ('zlib' or 'lzma').
+
+    Returns:
+        The compressor instance.
+
+    Raises:
+        ValueError: If the compressor is unknown.
+    """
+    if name not in COMPRESSORS:
+        raise ValueError(f"Unsupported data compression '{name}'. Available: none, {', '.join(COMPRESSORS)}.")
+    return COMPRESSORS[name]
+
+
+def parse_compression(setting: str) -> tuple:
+    """Parses a compression setting such as 'zlib', 'zlib:9', or 'none'.
+
+    Args:
+        setting (str): The setting to parse.
+
+    Returns:
+        tuple: `(name, level)`, or `(None, None)` when compression is disabled.
+
+    Raises:
+        ValueError: If the compressor is unknown or the level is not an integer in its range.
+    """
+    name, _, level = setting.strip().lower().partition(':')
+    if name in ('', 'none', 'off'):
+        return None, None
+    compressor = get_compressor(name)
+    try:
+        value = int(level) if level else compressor.default_level
+    except ValueError:
+        raise ValueError(f"Invalid compression level '{level}'.") from None
+    if value not in compressor.levels:
+        raise ValueError(f"Compression level {value} is out of range for {name} "
+                         f"({compressor.levels.start}..{compressor.levels.stop - 1}).")
+    return name, value
+
+
+def configured_compression() -> tuple:
+    """Returns `(name, level)` for new writes, from `CARELOG_COMPRESSION` if set.
+
+    Like `configured_codec`, the setting is checked at startup: an unknown compressor or an
+    out-of-range level falls back to the default with a warning, instead of failing the
+    import or every later save.
+    """
+    try:
+        return parse_compression(os.environ.get('CARELOG_COMPRESSION') or DEFAULT_COMPRESSION)
+    except ValueError as e:
+        name, level = parse_compression(DEFAULT_COMPRESSION)
+        print(f"Warning: {e} Using '{name}:{level}' instead.")
+        return name, level
+
+
+def encode_payload(data, codec: str = DEFAULT_CODEC, compression: str = None, level: int = None) -> bytes:
+    """Serializes data with a codec, optionally compresses it, and prefixes the versioned header.
+
+    Args:
+        data: The dataset to serialize.
+        codec (str): The name of the codec to use.
+        compression (str, optional): The name of the compressor to apply, or None for none.
+        level (int, optional): The compression level; the compressor's default if omitted.
+
+    Returns:
+        bytes: The header line followed by the encoded body.
+    """
+    encoder = get_codec(codec)
+    body = encoder.encode(data)
+    fields = [b'codec=' + encoder.name.encode()]
+    if compression is not None:
+        compressor = get_compressor(compression)
+        level = compressor.default_level if level is None else level
+        body = compressor.compress(body, level)
+        fields.append(b'compression=%s level=%d' % (compressor.name.encode(), level))
+    header = b'%s %d %s\n' % (PAYLOAD_MAGIC, PAYLOAD_VERSION, b' '.join(fields))
+    return header + body
+
+
+def parse_header(raw: bytes) -> tuple:
+    """Splits an encoded payload into its header fields and body.
+
+    Args:
+        raw (bytes): The decrypted payload.
+
+    Returns:
+        tuple: `(fields, body)`, where `fields` maps header keys to values. Legacy payloads
+               without a header are reported as `{'codec': 'json'}`.
+
+    Raises:
+        ValueError: If the header is malformed or has an unsupported version.
+    """
+    if not raw.startswith(PAYLOAD_MAGIC):
+        return {'codec': 'json'}, raw
+    header, newline, body = raw.partition(b'\n')
+    parts = header.decode('ascii', errors='replace').split(' ')
+    if not newline or len(parts) < 2:
+        raise ValueError("Data payload header is malformed.")
+    if parts[1] != str(PAYLOAD_VERSION):
+        raise ValueError(f"Unsupported data payload version {parts[1]}.")
+    fields = dict(part.partition('=')[::2] for part in parts[2:])
+    return fields, body
+
+
+def decode_payload(raw: bytes):
+    """Parses a payload written by `encode_payload`, or a legacy JSON payload.
+
+    Args:
+        raw (bytes): The decrypted payload.
+
+    Returns:
+        The decoded dataset.
+
+    Raises:
+        ValueError: If the header is invalid or names an unavailable codec or compressor.
+    """
+    fields, body = parse_header(raw)
+    if fields.get('compression'):
+        body = get_compressor(fields['compression']).decompress(body)
+    return get_codec(fields.get('codec', 'json')).decode(body)
@@ -0,0 +1,85 @@
+"""
+This module provides single-flight execution: coalescing concurrent calls for the same work.
+
+`SingleFlight.do(key, func)` runs `func` unless a call with an equal key is already in
+progress, in which case the caller waits for that call and receives its result (or its
+exception) instead. Once a call finishes its key is forgotten, so later calls run again;
+caching results is left to the caller. It is used to make a burst of identical AI feedback
+requests (two clinicians, or one double-click replayed by Streamlit reruns) cost one model
+call and one write.
+"""
+# carelog/modules/singleflight.py
+
+import threading
+
+
+class _Call:
+    """A call in progress and, once it has finished, its outcome."""
+    __slots__ = ('done', 'result', 'error', 'followers')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+
+
+class SingleFlight:
+    """Runs at most one call per key at a time and shares its outcome with concurrent callers."""
+
+    def __init__(self):
+        """Initializes an empty set of calls in progress."""
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._metrics = {'calls': 0, 'shared': 0}
+
+    def do(self, key, func) -> tuple:
+        """Runs `func`, or waits for the call already in progress for `key`.
+
+        Args:
+            key: Identifies the work; must be hashable.
+            func (callable): The function to run, called without arguments.
+
+        Returns:
+            tuple: `(result, shared)`, where `shared` is True if the result came from a call
+                   started by another caller.
+
+        Raises:
+            Exception: Whatever `func` raised, in the caller that ran it and in every caller
+                       that waited for it.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                self._metrics['calls'] += 1
+                leader = True
+            else:
+                call.followers += 1
+                self._metrics['shared'] += 1
+                leader = False
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        try:
+            call.result = func()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def in_flight(self) -> int:
+        """Returns the number of calls in progress."""
+        with self._lock:
+            return len(self._calls)
+
+    def metrics(self) -> dict:
+        """Returns the number of calls run and of callers that shared another caller's call."""
+        with self._lock:
+            return dict(self._metrics)
@@ -0,0 +1,329 @@
+"""
+This module provides crash-safe, generational persistence for the application's data file.
+
+It defines the `SnapshotStore` class, which is responsible for:
+- Writing snapshots atomically (temporary file, fsync, then rename) so a crash mid-write
+  can never leave a truncated `records.json` behind.
+- Retaining a fixed number of previous snapshot generations next to the data file.
+- Prefixing every snapshot with a small header holding its generation number and a
+  SHA-256 checksum of the payload, so torn or corrupted files are detected cheaply.
+- Recovering on startup by picking the newest valid generation, only falling back to
+  older generations when the newer ones fail validation.
+- Serializing writers across processes with an advisory file lock, and exposing a cheap
+  version stamp so a process can detect that another one has written a newer snapshot.
+
+The store deals only in opaque payload bytes; encryption and serialization are handled
+by the caller.
+"""
+# carelog/modules/storage.py
+
+import hashlib
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to in-process locking only.
+    fcntl = None
+
+SNAPSHOT_MAGIC = b'CARELOG-SNAPSHOT'
+SNAPSHOT_VERSION = 1
+DEFAULT_GENERATIONS = 3
+
+
+class SnapshotError(ValueError):
+    """Raised when a snapshot file is truncated or fails its checksum."""
+
+
+def _fsync_directory(directory: str):
+    """Flushes a directory entry to disk so a completed rename survives a crash."""
+    try:
+        fd = os.open(directory or '.', os.O_RDONLY)
+    except (OSError, AttributeError):
+        return  # Not supported on this platform (e.g. Windows).
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def build_snapshot(payload: bytes, generation: int) -> bytes:
+    """Prefixes a payload with the snapshot header.
+
+    Args:
+        payload (bytes): The (already encrypted) data to store.
+        generation (int): The monotonically increasing generation number.
+
+    Returns:
+        bytes: The header line followed by the payload.
+    """
+    checksum = hashlib.sha256(payload).hexdigest()
+    header = b'%s %d %d %d %s\n' % (SNAPSHOT_MAGIC, SNAPSHOT_VERSION, generation, len(payload), checksum.encode())
+    return header + payload
+
+
+def parse_snapshot(raw: bytes) -> tuple:
+    """Splits a snapshot file into its generation number and verified payload.
+
+    Files written before snapshots had headers are accepted as generation 0 without
+    a checksum, so existing data files keep loading.
+
+    Args:
+        raw (bytes): The full contents of a snapshot file.
+
+    Returns:
+        tuple: A `(generation, payload)` pair.
+
+    Raises:
+        SnapshotError: If the header is malformed, the payload is truncated, or the
+                       checksum does not match.
+    """
+    if not raw.startswith(SNAPSHOT_MAGIC):
+        return 0, raw.strip()
+    header, newline, payload = raw.partition(b'\n')
+    if not newline:
+        raise SnapshotError("Snapshot header is incomplete.")
+    try:
+        _, version, generation, length, checksum = header.split(b' ')
+        version, generation, length = int(version), int(generation), int(length)
+    except ValueError as exc:
+        raise SnapshotError("Snapshot header is malformed.") from exc
+    if version != SNAPSHOT_VERSION:
+        raise SnapshotError(f"Unsupported snapshot version {version}.")
+    if len(payload) != length:
+        raise SnapshotError("Snapshot payload is truncated.")
+    if hashlib.sha256(payload).hexdigest().encode() != checksum:
+        raise SnapshotError("Snapshot checksum mismatch.")
+    return generation, payload
+
+
+class FileLock:
+    """A reentrant lock that is held across threads of this process and other processes.
+
+    Threads are serialized with an `RLock`; other processes are excluded with an advisory
+    `flock` on a sidecar lock file, taken by the outermost acquisition only.
+    """
+
+    def __init__(self, path: str):
+        """Initializes the lock.
+
+        Args:
+            path (str): The path of the lock file (created on first use).
+        """
+        self.path = path
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    def acquire(self):
+        """Acquires the lock, blocking until it is available."""
+        self._thread_lock.acquire()
+        if self._depth == 0 and fcntl is not None:
+            try:
+                fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            except OSError:
+                self._thread_lock.release()
+                raise
+            self._fd = fd
+        self._depth += 1
+
+    def release(self):
+        """Releases one level of the lock."""
+        self._depth -= 1
+        if self._depth == 0 and self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+        self._thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+class SnapshotStore:
+    """Stores opaque payloads as atomically written, checksummed snapshot generations.
+
+    The newest snapshot always lives at `path`; older generations are kept as
+    `path.1` (previous) up to `path.N`.
+    """
+
+    def __init__(self, path: str, generations: int = DEFAULT_GENERATIONS):
+        """Initializes the store.
+
+        Args:
+            path (str): The path of the current snapshot file.
+            generations (int): How many previous generations to retain.
+        """
+        self.path = path
+        self.generations = max(0, generations)
+        self.generation = 0
+        self.lock = FileLock(f"{path}.lock")
+        self._stamp = None
+
+    def generation_path(self, index: int) -> str:
+        """Returns the file path of a generation (0 is the current snapshot)."""
+        return self.path if index == 0 else f"{self.path}.{index}"
+
+    def stamp(self):
+        """Returns a cheap version stamp of the current snapshot file.
+
+        Snapshots are always renamed into place, so any write by any process changes the
+        file's inode, modification time, or size.
+
+        Returns:
+            tuple or None: `(inode, mtime_ns, size)`, or None if the file does not exist.
+        """
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def read_generation(self) -> int:
+        """Reads only the header of the current snapshot and returns its generation.
+
+        Returns:
+            int: The generation number, or 0 if the file is missing or has no header.
+        """
+        try:
+            with open(self.path, 'rb') as f:
+                header = f.readline()
+        except FileNotFoundError:
+            return 0
+        if not header.startswith(SNAPSHOT_MAGIC):
+            return 0
+        try:
+            return int(header.split(b' ')[2])
+        except (IndexError, ValueError):
+            return 0
+
+    def has_changed(self) -> bool:
+        """Checks whether another process has written a newer snapshot since our last load or write.
+
+        This costs a single `stat` call unless the stamp differs, in which case the
+        snapshot header is read to compare generation numbers.
+
+        Returns:
+            bool: True if the snapshot on disk is newer than the one held in memory.
+        """
+        stamp = self.stamp()
+        if stamp == self._stamp:
+            return False
+        if stamp is None:
+            return False
+        return self.read_generation() != self.generation or self.generation == 0
+
+    def load(self, decode):
+        """Loads the newest snapshot that passes validation.
+
+        Generations are tried newest first and the search stops at the first one that
+        verifies and decodes, so older generations are only read during recovery.
+        Snapshots that are truncated or fail their checksum are moved aside rather than
+        left to be overwritten by the next write.
+
+        Errors raised by `decode` are not treated as damage: a payload that passed its
+        checksum but does not decrypt or parse points at a wrong key or configuration, and
+        moving every generation aside would then lose the data. They reach the caller.
+
+        Args:
+            decode (callable): Turns a payload into the loaded value.
+
+        Returns:
+            The decoded value of the newest valid generation, or None if there is none.
+        """
+        with self.lock:
+            return self._load_locked(decode)
+
+    def _load_locked(self, decode):
+        """Implements `load` while the store lock is held."""
+        self._stamp = self.stamp()
+        for index in range(self.generations + 1):
+            candidate = self.generation_path(index)
+            try:
+                with open(candidate, 'rb') as f:
+                    raw = f.read()
+            except FileNotFoundError:
+                continue
+            try:
+                generation, payload = parse_snapshot(raw)
+            except SnapshotError as e:
+                print(f"Warning: Snapshot '{candidate}' is invalid ({e!r}).")
+                self._quarantine(candidate)
+                continue
+            value = decode(payload)
+            self.generation = max(self.generation, generation)
+            if index:
+                print(f"Warning: Recovered data from older snapshot '{candidate}'.")
+            return value
+        return None
+
+    def write(self, payload: bytes) -> int:
+        """Atomically writes a new snapshot generation.
+
+        The payload is written to a temporary file and fsynced before the existing
+        generations are rotated and the new file is renamed into place, so a crash at
+        any point leaves at least one complete snapshot on disk.
+
+        Args:
+            payload (bytes): The data to store.
+
+        Returns:
+            int: The generation number that was written.
+        """
+        with self.lock:
+            return self._write_locked(payload)
+
+    def _write_locked(self, payload: bytes) -> int:
+        """Implements `write` while the store lock is held."""
+        # Never reuse a generation number that another process has already written.
+        generation = max(self.generation, self.read_generation()) + 1
+        directory = os.path.dirname(os.path.abspath(self.path))
+        tmp_path = f"{self.path}.tmp-{os.getpid()}"
+        with open(tmp_path, 'wb') as f:
+            f.write(build_snapshot(payload, generation))
+            f.flush()
+            os.fsync(f.fileno())
+
+        # Shift older generations up by one, dropping the oldest.
+        for index in range(self.generations, 0, -1):
+            source = self.generation_path(index - 1)
+            if os.path.exists(source):
+                os.replace(source, self.generation_path(index))
+        os.replace(tmp_path, self.path)
+        _fsync_directory(directory)
+        self.generation = generation
+        self._stamp = self.stamp()
+        return generation
+
+    def discard_previous_generations(self):
+        """Deletes every retained previous generation, keeping only the current snapshot."""
+        with self.lock:
+            for index in range(1, self.generations + 1):
+                try:
+                    os.remove(self.generation_path(index))
+                except FileNotFoundError:
+                    pass
+            _fsync_directory(os.path.dirname(os.path.abspath(self.path)))
+
+    def _quarantine(self, path: str):
+        """Renames an invalid snapshot so it is kept for inspection but never loaded again.
+
+        The name carries a counter after the timestamp, so snapshots quarantined within the
+        same second never replace one another.
+        """
+        prefix = f"{path}.corrupt-{time.strftime('%Y%m%d%H%M%S')}"
+        counter = 0
+        while os.path.exists(f"{prefix}-{counter}"):
+            counter += 1
+        try:
+            os.replace(path, f"{prefix}-{counter}")
+        except OSError:
+            pass
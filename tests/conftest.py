@@ -11,6 +11,7 @@ It includes logic to:
   interfere with each other or with production data.
 """
 import base64
+import hashlib
 import os
 import sys
 import types
@@ -34,26 +35,29 @@ def _ensure_dummy_fernet():
         """A simple, reversible substitute for Fernet for testing purposes."""
         def __init__(self, key):
             self.key = key
+            # Tokens are bound to the key, so data encrypted with one key does not decrypt with another.
+            self._tag = self._marker + hashlib.sha256(key).digest()[:8]
 
         @staticmethod
         def generate_key():
             return base64.urlsafe_b64encode(os.urandom(32))
 
+        # Stands in for Fernet's authentication, so tampered or foreign tokens are rejected
+        # while arbitrary binary plaintexts (e.g. compressed payloads) round-trip.
+        _marker = b"DUMMY-FERNET:"
+
         def encrypt(self, data: bytes) -> bytes:
             # A simple, non-secure, but reversible operation.
-            return base64.urlsafe_b64encode(data[::-1])
+            return base64.urlsafe_b64encode(self._tag + data[::-1])
 
         def decrypt(self, token: bytes) -> bytes:
             try:
                 decoded = base64.urlsafe_b64decode(token)
             except Exception as exc:
                 raise InvalidToken from exc
-            plain = decoded[::-1]
-            try:
-                plain.decode("utf-8")
-            except UnicodeDecodeError as exc:
-                raise InvalidToken from exc
-            return plain
+            if not decoded.startswith(self._tag):
+                raise InvalidToken
+            return decoded[len(self._tag):][::-1]
 
     fernet_module.Fernet = DummyFernet
     fernet_module.InvalidToken = InvalidToken
@@ -49,8 +49,8 @@ def test_patient_clinician_workflow(monkeypatch, service):
     assert pending == "pending"
     assert service.approve_user("clin", "clinician", hospital_id) is True
 
-    service.logout()
-    assert isinstance(service.login("clin", "V4lid!Pass", "clinician", hospital_id), User)
+    principal = service.login("clin", "V4lid!Pass", "clinician", hospital_id)
+    assert isinstance(principal, User)
 
     assert service.assign_clinician_to_patient(hospital_id, "patient", "clin") is True
     note = PatientNote(
@@ -71,14 +71,14 @@ def test_patient_clinician_workflow(monkeypatch, service):
 
     monkeypatch.setattr(auth_module, "generate_feedback", fake_feedback, raising=False)
     assert service.generate_and_store_ai_feedback(note.note_id, hospital_id) is True
-    pending_feedback = service.get_pending_feedback(hospital_id)
+    pending_feedback = service.get_pending_feedback(hospital_id, principal)
     assert len(pending_feedback) == 1
     assert service.approve_ai_feedback(note.note_id, hospital_id, "Reviewed feedback") is True
 
-    service.current_user = User("clin", "hash", "clinician", "", "", "", "", "")
-    clinician_notes = service.get_notes_for_patient(hospital_id, "patient")
+    principal = User("clin", "hash", "clinician", "", "", "", "", "")
+    clinician_notes = service.get_notes_for_patient(hospital_id, "patient", principal)
     assert clinician_notes and clinician_notes[0]["note_id"] == note.note_id
-    assert service.get_pending_feedback(hospital_id) == []
+    assert service.get_pending_feedback(hospital_id, principal) == []
 
     chat = service.chat
     general_entry = chat.add_general_message(hospital_id, "patient", "clin", "clinician", "Check-in complete")
@@ -90,10 +90,10 @@ def test_patient_clinician_workflow(monkeypatch, service):
     assert chat.get_general_messages(hospital_id, "patient")
     assert chat.get_direct_messages(hospital_id, "patient", "clin")
 
-    service.current_user = User("admin", "hash", "admin", "", "", "", "", "")
-    search_results = service.search_notes(hospital_id, "patient", "better")
+    principal = User("admin", "hash", "admin", "", "", "", "", "")
+    search_results = service.search_notes(hospital_id, "patient", "better", principal)
     assert search_results and search_results[0]["note_id"] == note.note_id
-    assert service.get_all_patients(hospital_id)
+    assert service.get_all_patients(hospital_id, principal)
     assert service.get_all_clinicians(hospital_id)
 
 
@@ -62,21 +62,21 @@ def test_end_to_end_system_state(monkeypatch, service):
     assert chat.list_general_patients(hospital_id)
     assert chat.list_direct_threads_for_clinician(hospital_id, "clinician")
 
-    service.current_user = User("clinician", "hash", "clinician", "", "", "", "", "")
-    clinician_notes = service.get_notes_for_patient(hospital_id, "patient")
+    principal = User("clinician", "hash", "clinician", "", "", "", "", "")
+    clinician_notes = service.get_notes_for_patient(hospital_id, "patient", principal)
     assert clinician_notes and clinician_notes[0]["ai_feedback"]["status"] == "approved"
 
-    service.current_user = User("secondary_admin", "hash", "admin", "", "", "", "", "")
-    search_hits = service.search_notes(hospital_id, "patient", "severe")
+    principal = User("secondary_admin", "hash", "admin", "", "", "", "", "")
+    search_hits = service.search_notes(hospital_id, "patient", "severe", principal)
     assert search_hits and search_hits[0]["note_id"] == pain_note.note_id
 
     dataset = service.get_hospital_dataset(hospital_id)
     assert dataset["users"]
     assert dataset["notes"]
 
-    service.delete_user(hospital_id, "clinician", "clinician")
-    service.delete_user(hospital_id, "patient", "patient")
-    assert not service.get_all_patients(hospital_id)
+    service.delete_user(hospital_id, "clinician", "clinician", principal)
+    service.delete_user(hospital_id, "patient", "patient", principal)
+    assert not service.get_all_patients(hospital_id, principal)
     assert not service.get_all_clinicians(hospital_id)
 
     service.dismiss_alert(hospital_id, pain_note.note_id)
@@ -106,4 +106,5 @@ def test_system_persistence_with_multiple_services(service):
 
     reloaded = auth_module.CareLogService()
     assert hospital_id in reloaded.get_all_hospitals()
-    assert reloaded.get_notes_for_patient(hospital_id, "user") == [{"note_id": "n1", "patient_id": "user"}]
+    principal = User("admin", "hash", "admin", "", "", "", "", "")
+    assert reloaded.get_notes_for_patient(hospital_id, "user", principal) == [{"note_id": "n1", "patient_id": "user"}]